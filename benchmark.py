@@ -0,0 +1,309 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+from statistics import median
+from tqdm import tqdm
+
+import constants
+import generate_data
+from global_utils import make_dir
+from w1.cache import ColumnarCache
+from w1.index import FileIndex
+from w1.result_cache import ResultCache
+from w3.executor import ChunkedExecutor
+import w3.main
+
+CURRENT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_FOLDER_NAME = 'bench'
+REPORT_COLUMNS = ['path', 'n_rows', 'wall_time', 'rows_per_sec', 'cpu_time', 'cpu_utilisation', 'peak_rss_mb']
+
+
+def get_dataset(n_rows, n_files, workers=None):
+    """
+    Files of the benchmark dataset, generated on the first use: `n_files` yearly files of `n_rows` rows each in
+    `data/bench/<n_rows>`. The generator is seeded per file, so a dataset is the same on every machine.
+
+    :return: paths of the files
+    """
+    folder_name = os.path.join(BENCHMARK_FOLDER_NAME, str(n_rows))
+    files_to_generate = [{
+        'folder_name': folder_name,
+        'n_datapoints': n_rows,
+        'file_name': f'{year}.csv',
+        'start_date': datetime.strptime(f'{year}/1/1', constants.DATE_FORMAT),
+        'end_date': datetime.strptime(f'{year}/12/31', constants.DATE_FORMAT),
+    } for year in range(2015, 2015 + n_files)]
+
+    file_paths = [os.path.join(CURRENT_FOLDER, constants.DATA_FOLDER_NAME, folder_name, file_details['file_name'])
+                  for file_details in files_to_generate]
+    missing = [file_details for file_details, file_path in zip(files_to_generate, file_paths)
+               if not os.path.isfile(file_path) or FileIndex(fp=file_path).load().get_n_rows() != n_rows]
+    if missing:
+        generate_data.generate_files(files_to_generate=missing, workers=workers or os.cpu_count())
+
+    return file_paths
+
+
+def get_result_cache(file_path):
+    return ResultCache(cache_path=os.path.join(os.path.dirname(file_path), constants.RESULT_CACHE_FOLDER_NAME))
+
+
+def sales_plan(file_path, use_cache=False, result_cache=None):
+    # the plan of get_sales_information, the paths only differ by the caches it may use
+    plan = w3.main.DP(file_path=file_path).sales_plan()
+    plan.set_use_cache(use_cache)
+    plan.set_result_cache(result_cache)
+    return plan
+
+
+def run_w1_rows(file_paths, n_processes):
+    # w1 sequential, row by row dict iterator
+    for file_path in file_paths:
+        sales_plan(file_path).run(columnar=False, progress_bar=False)
+
+
+def run_w1_columnar(file_paths, n_processes):
+    # w1 sequential, columnar chunks parsed from the CSV
+    for file_path in file_paths:
+        sales_plan(file_path).run(progress_bar=False)
+
+
+def run_w1_columnar_cache(file_paths, n_processes):
+    # w1 sequential, columnar chunks memory mapped from the ColumnarCache
+    for file_path in file_paths:
+        sales_plan(file_path, use_cache=True).run(progress_bar=False)
+
+
+def run_w3_chunked(file_paths, n_processes):
+    # w3 multiprocessing over byte ranges of the files
+    ChunkedExecutor(n_processes=n_processes).run(plans=[sales_plan(file_path) for file_path in file_paths])
+
+
+def run_result_cache(file_paths, n_processes):
+    # rerun on unchanged files, served from the ResultCache
+    for file_path in file_paths:
+        sales_plan(file_path, result_cache=get_result_cache(file_path)).run(progress_bar=False)
+
+
+PATHS = {
+    'w1_rows': run_w1_rows,
+    'w1_columnar': run_w1_columnar,
+    'w1_columnar_cache': run_w1_columnar_cache,
+    'w3_chunked': run_w3_chunked,
+    'result_cache': run_result_cache
+}
+
+
+def prepare(file_paths):
+    """
+    Warm state the cached paths measure: the ColumnarCache of every file and its results in the ResultCache
+    """
+    for file_path in file_paths:
+        ColumnarCache(fp=file_path).load_or_build()
+        sales_plan(file_path, result_cache=get_result_cache(file_path)).run(progress_bar=False)
+
+
+def get_peak_rss():
+    """
+    Peak resident memory of this process in bytes
+    """
+    # VmHWM starts over in a new process on Linux, ru_maxrss keeps the peak of the parent the process was spawned by
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def measure(path, file_paths, n_processes, connection):
+    """
+    Run one path in this (fresh) process and send its wall time, CPU time of the process and of its children and
+    peak resident memory through the connection
+    """
+    st_self, st_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    st = time.perf_counter()
+    PATHS[path](file_paths=file_paths, n_processes=n_processes)
+    en = time.perf_counter()
+    en_self, en_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = sum([(en_usage.ru_utime - st_usage.ru_utime) + (en_usage.ru_stime - st_usage.ru_stime)
+                    for st_usage, en_usage in [(st_self, en_self), (st_children, en_children)]])
+
+    # worker processes of the path count as well, e.g. the pool of the multiprocessing path
+    peak_rss = max(get_peak_rss(), en_children.ru_maxrss * (1 if sys.platform == 'darwin' else 1024))
+
+    connection.send({'wall_time': en - st, 'cpu_time': cpu_time, 'peak_rss_mb': peak_rss / (1 << 20)})
+    connection.close()
+
+
+def run_benchmark(n_rows, n_files, paths, repeat=3, n_processes=None):
+    """
+    Run every path `repeat` times over the benchmark dataset, each run in a new process so that the peak memory is
+    the one of the path alone
+
+    :return: report with the median of every measure per path
+    """
+    n_processes = n_processes or os.cpu_count()
+    file_paths = get_dataset(n_rows=n_rows, n_files=n_files)
+    prepare(file_paths)
+    total_rows = sum([FileIndex(fp=file_path).load().get_n_rows() for file_path in file_paths])
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for path in tqdm(paths, desc='Benchmark'):
+        runs = []
+        for _ in range(repeat):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=measure, args=(path, file_paths, n_processes, sender))
+            process.start()
+            runs.append(receiver.recv())
+            process.join()
+
+        wall_time = median([run['wall_time'] for run in runs])
+        cpu_time = median([run['cpu_time'] for run in runs])
+        results.append({
+            'path': path,
+            'n_rows': total_rows,
+            'wall_time': wall_time,
+            'rows_per_sec': total_rows / wall_time if wall_time > 0 else 0,
+            'cpu_time': cpu_time,
+            # busy cores on average, up to n_processes for the multiprocessing path
+            'cpu_utilisation': cpu_time / wall_time if wall_time > 0 else 0,
+            'peak_rss_mb': median([run['peak_rss_mb'] for run in runs])
+        })
+
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'n_rows_per_file': n_rows,
+            'n_files': n_files,
+            'repeat': repeat,
+            'n_processes': n_processes,
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def save_report(report, output_path):
+    """
+    Save the report as `<output_path>.json` and its results as `<output_path>.csv`
+    """
+    make_dir(os.path.dirname(os.path.abspath(output_path)))
+
+    with open(f'{output_path}.json', 'w') as f:
+        f.write(json.dumps(report, indent=2))
+
+    with open(f'{output_path}.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(report['results'])
+
+
+def load_report(report_path):
+    with open(report_path) as f:
+        return json.loads(f.read())
+
+
+def compare_reports(baseline, report, threshold=0.1):
+    """
+    Compare the throughput of every path in both reports
+
+    :param threshold: relative drop of rows/sec over which a path is a regression, e.g. 0.1 for 10%
+    :return: list of {path, baseline, current, change, regression} for the paths in both reports
+    """
+    baseline_results = {result['path']: result for result in baseline['results']}
+
+    comparison = []
+    for result in report['results']:
+        if result['path'] not in baseline_results:
+            continue
+
+        baseline_rows_per_sec = baseline_results[result['path']]['rows_per_sec']
+        change = (result['rows_per_sec'] - baseline_rows_per_sec) / baseline_rows_per_sec \
+            if baseline_rows_per_sec > 0 else 0
+        comparison.append({
+            'path': result['path'],
+            'baseline': baseline_rows_per_sec,
+            'current': result['rows_per_sec'],
+            'change': change,
+            'regression': change < -threshold
+        })
+
+    return comparison
+
+
+def print_comparison(comparison):
+    for row in comparison:
+        tqdm.write(f"{row['path']:<20} {int(row['baseline']):>12} -> {int(row['current']):>12} rows/sec "
+                   f"({100 * row['change']:+.1f}%){'  REGRESSION' if row['regression'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of get_sales_information on every execution path")
+    parser.add_argument('--rows',
+                        default=200000,
+                        type=int,
+                        help='Number of rows of every file of the dataset')
+    parser.add_argument('--n-files',
+                        default=4,
+                        type=int,
+                        help='Number of files of the dataset')
+    parser.add_argument('--paths',
+                        default=list(PATHS.keys()),
+                        nargs='+',
+                        choices=list(PATHS.keys()),
+                        help='Execution paths to benchmark')
+    parser.add_argument('--repeat',
+                        default=3,
+                        type=int,
+                        help='Number of runs of every path, the report has the median')
+    parser.add_argument('--n-processes',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of processes of the multiprocessing path')
+    parser.add_argument('--output',
+                        default=os.path.join(CURRENT_FOLDER, 'output', 'benchmark'),
+                        help='Report path, without extension (a .json and a .csv file are written)')
+    parser.add_argument('--baseline',
+                        default=None,
+                        help='Report (.json) to compare with, exits with status 1 on a regression')
+    parser.add_argument('--threshold',
+                        default=0.1,
+                        type=float,
+                        help='Relative drop of rows/sec that is a regression')
+    args = parser.parse_args()
+
+    report = run_benchmark(n_rows=args.rows, n_files=args.n_files, paths=args.paths, repeat=args.repeat,
+                           n_processes=args.n_processes)
+    save_report(report=report, output_path=args.output)
+
+    for result in report['results']:
+        tqdm.write(f"{result['path']:<20} {int(result['rows_per_sec']):>12} rows/sec, "
+                   f"{result['wall_time']:.3f}s, {result['cpu_utilisation']:.2f} cores, "
+                   f"{result['peak_rss_mb']:.0f} MB")
+
+    if args.baseline is not None:
+        comparison = compare_reports(baseline=load_report(args.baseline), report=report, threshold=args.threshold)
+        print_comparison(comparison)
+
+        if any([row['regression'] for row in comparison]):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 DATA_FOLDER_NAME = 'data'
 SEED_FOLDER_NAME = 'seed'
 SEED_FILE_NAME = 'items.json'
+RESULT_CACHE_FOLDER_NAME = '.results'
 DATE_FORMAT = "%Y/%m/%d"
 
 
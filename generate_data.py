@@ -1,5 +1,10 @@
 import json
 import random
+import time
+import tempfile
+import multiprocessing
+import zlib
+import numpy as np
 from tqdm import tqdm
 
 from global_utils import make_dir, human_readable
@@ -12,14 +17,27 @@ import argparse
 import uuid
 
 CURRENT_FOLDER = os.path.dirname(os.path.abspath(__file__))
-random.seed(42)
+SEED = 42
+random.seed(SEED)
+
+UNITS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+UNITS_WEIGHTS = [0.2, 0.2, 0.25, 0.11, 0.08, 0.07, 0.03, 0.03, 0.02, 0.01]
+COUNTRIES = ['United States', 'China', 'Japan', 'Germany', 'India',
+             'United Kingdom', 'France', 'Canada', 'Russia', 'Italy']
+COUNTRIES_WEIGHTS = [0.2, 0.05, 0.05, 0.1, 0.1, 0.2, 0.1, 0.1, 0.05, 0.05]
 
 
 class DataGenerator:
-    def __init__(self):
+    def __init__(self, seed=SEED):
         self._seed_data = None
         self.read_seed_data()
 
+        # the vectorised mode draws from its own generator, the same seed always gives the same files
+        self._rng = np.random.default_rng(seed)
+        self._item_prefixes = None
+        self._totals = None
+        self._totals_str = None
+
     @staticmethod
     def can_typecast_to_float(val):
         try:
@@ -59,11 +77,8 @@ class DataGenerator:
 
     def generate_data(self, start_date, end_date):
         n_row = random.randint(0, len(self._seed_data) - 1)
-        n_units = random.choices([1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-                                 [0.2, 0.2, 0.25, 0.11, 0.08, 0.07, 0.03, 0.03, 0.02, 0.01])
-        country = random.choices(['United States', 'China', 'Japan', 'Germany', 'India',
-                                  'United Kingdom', 'France', 'Canada', 'Russia', 'Italy'],
-                                 [0.2, 0.05, 0.05, 0.1, 0.1, 0.2, 0.1, 0.1, 0.05, 0.05])
+        n_units = random.choices(UNITS, UNITS_WEIGHTS)
+        country = random.choices(COUNTRIES, COUNTRIES_WEIGHTS)
         row = self._seed_data[n_row]
 
         data = {
@@ -78,6 +93,60 @@ class DataGenerator:
         }
         return data
 
+    def _build_tables(self):
+        """
+        Every value of a row that only depends on the item and the number of units is formatted once up front:
+        `StockCode,Description,UnitPrice` per item and `TotalPrice` per (item, units)
+        """
+        self._item_prefixes = np.array([
+            ",".join([str(row[constants.SeedDataColNames.STOCK_NO]),
+                      str(row[constants.SeedDataColNames.DESCRIPTION]).replace(',', ''),
+                      str(row[constants.SeedDataColNames.UNIT_PRICE])]) for row in self._seed_data], dtype=object)
+
+        unit_prices = np.array([row[constants.SeedDataColNames.UNIT_PRICE] for row in self._seed_data],
+                               dtype=np.float64)
+        self._totals = np.outer(unit_prices, UNITS)
+        self._totals_str = np.array([str(total) for total in self._totals.ravel().tolist()], dtype=object)
+
+    def generate_block(self, n_rows, start_date, end_date):
+        """
+        Vectorised `generate_data`: every column of `n_rows` rows is drawn at once with NumPy and the rows are
+        formatted in bulk
+
+        :return: the rows as CSV text (every row ends with a line break), total units and total price
+        """
+        if self._item_prefixes is None:
+            self._build_tables()
+
+        items = self._rng.integers(0, len(self._seed_data), size=n_rows)
+        units = self._rng.choice(len(UNITS), size=n_rows, p=UNITS_WEIGHTS)
+        countries = self._rng.choice(len(COUNTRIES), size=n_rows, p=COUNTRIES_WEIGHTS)
+
+        # random second between the two dates like `random_date`, only the day is written
+        n_seconds = int((end_date - start_date).total_seconds())
+        days = self._rng.integers(0, n_seconds, size=n_rows) // (24 * 60 * 60)
+        day_names = np.array([(start_date + timedelta(days=day)).strftime(constants.DATE_FORMAT)
+                              for day in range(int(days.max()) + 1 if n_rows else 0)], dtype=object)
+
+        # random UUID formatted invoice numbers: 32 hex digits per row, the dashes and a line break inserted column
+        # wise, so the whole column is decoded and split at once
+        hex_digits = np.frombuffer(self._rng.bytes(16 * n_rows).hex().encode(), dtype=np.uint8).reshape(n_rows, 32)
+        invoice_nos = np.insert(hex_digits, [8, 12, 16, 20, 32], [ord('-')] * 4 + [ord('\n')], axis=1)
+
+        table_inds = items * len(UNITS) + units
+        columns = [self._item_prefixes[items].tolist(),
+                   np.array([str(n_units) for n_units in UNITS], dtype=object)[units].tolist(),
+                   self._totals_str[table_inds].tolist(),
+                   np.array(COUNTRIES, dtype=object)[countries].tolist(),
+                   invoice_nos.tobytes().decode().split('\n')[:-1],
+                   day_names[days].tolist()]
+
+        text = "\n".join(map(",".join, zip(*columns))) + "\n" if n_rows else ""
+        total_units = int(np.sum(np.array(UNITS)[units]))
+        total_price = float(np.sum(self._totals.ravel()[table_inds]))
+
+        return text, total_units, total_price
+
 
 def generate_file(data_gen_obj, file_details):
     total_units = 0
@@ -119,8 +188,110 @@ def generate_file(data_gen_obj, file_details):
                f"Total price : ${int(total_price)}")
 
 
-def tst():
-    data_gen = DataGenerator()
+def generate_file_vectorised(data_gen_obj, file_details, block_rows=1 << 18, progress_bar=True):
+    """
+    Same file as `generate_file`, generated `block_rows` rows at a time with `DataGenerator.generate_block` and
+    written one block at a time
+    """
+    total_units = 0
+    total_price = 0
+
+    file_path = os.path.join(CURRENT_FOLDER, constants.DATA_FOLDER_NAME, file_details['folder_name'],
+                             file_details['file_name'])
+    make_dir(directory=os.path.join(CURRENT_FOLDER, constants.DATA_FOLDER_NAME, file_details['folder_name']))
+
+    with open(file_path, 'w', buffering=1 << 22) as f:
+        f.write(",".join([constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.DESCRIPTION,
+                          constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.QUANTITY,
+                          constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY,
+                          constants.OutDataColNames.INVOICE_NO, constants.OutDataColNames.DATE]))
+        f.write("\n")
+
+        with tqdm(total=file_details['n_datapoints'], unit=' rows', disable=not progress_bar) as bar:
+            for start in range(0, file_details['n_datapoints'], block_rows):
+                n_rows = min(block_rows, file_details['n_datapoints'] - start)
+                text, block_units, block_price = data_gen_obj.generate_block(n_rows=n_rows,
+                                                                             start_date=file_details['start_date'],
+                                                                             end_date=file_details['end_date'])
+                f.write(text)
+
+                total_units += block_units
+                total_price += block_price
+                bar.update(n_rows)
+
+    tqdm.write(f"File Name : {file_details['file_name']}, Total units : {int(total_units)}, "
+               f"Total price : ${int(total_price)}")
+
+
+def get_file_seed(file_details):
+    """
+    Seed of one file, derived from the global seed and the folder and name of the file: a file is the same no
+    matter which files are generated with it, in which order or by how many processes
+    """
+    file_key = zlib.crc32(f"{file_details['folder_name']}/{file_details['file_name']}".encode())
+    return np.random.SeedSequence([SEED, file_key])
+
+
+def generate_file_task(file_details):
+    generate_file_vectorised(data_gen_obj=DataGenerator(seed=get_file_seed(file_details)),
+                             file_details=file_details, progress_bar=False)
+    return file_details['file_name']
+
+
+def generate_files(files_to_generate, vectorised=True, workers=1, rows_scale=1.0):
+    """
+    :param vectorised: generate every file with its own seed in `workers` processes, else one row at a time from
+                       the global `random` stream, one file after another
+    :param workers: number of processes generating files in parallel
+    :param rows_scale: multiplier of the number of rows of every file, e.g. 10 for a stress dataset 10x `bg`
+    """
+    files_to_generate = [dict(file_details, n_datapoints=int(round(file_details['n_datapoints'] * rows_scale)))
+                         for file_details in files_to_generate]
+
+    if not vectorised:
+        data_gen = DataGenerator()
+        for file_to_generate in files_to_generate:
+            generate_file(data_gen_obj=data_gen, file_details=file_to_generate)
+        return
+
+    # largest files first, so that the last file to finish is a small one
+    files_to_generate = sorted(files_to_generate, key=lambda file_details: -file_details['n_datapoints'])
+
+    if workers <= 1:
+        for file_to_generate in files_to_generate:
+            generate_file_vectorised(data_gen_obj=DataGenerator(seed=get_file_seed(file_to_generate)),
+                                     file_details=file_to_generate)
+        return
+
+    with multiprocessing.Pool(processes=min(workers, len(files_to_generate))) as pool:
+        for file_name in tqdm(pool.imap_unordered(generate_file_task, files_to_generate, chunksize=1),
+                              total=len(files_to_generate), unit=' files'):
+            tqdm.write(f"Generated {file_name}")
+
+
+def benchmark(n_rows=200000):
+    """
+    Rows/sec of the row by row and the vectorised generation of a `n_rows` rows file
+    """
+    file_details = {
+        'folder_name': tempfile.mkdtemp(),
+        'n_datapoints': n_rows,
+        'file_name': 'benchmark.csv',
+        'start_date': datetime.strptime(f'2015/1/1', constants.DATE_FORMAT),
+        'end_date': datetime.strptime(f'2015/12/31', constants.DATE_FORMAT),
+    }
+
+    for generate in [generate_file, generate_file_vectorised]:
+        st = time.perf_counter()
+        generate(data_gen_obj=DataGenerator(), file_details=file_details)
+        en = time.perf_counter()
+        tqdm.write(f"{generate.__name__} : {int(n_rows / (en - st))} rows/sec")
+
+    os.remove(os.path.join(file_details['folder_name'], file_details['file_name']))
+    os.rmdir(file_details['folder_name'])
+
+
+def tst(vectorised=True, workers=1, rows_scale=1.0):
 
     files_to_generate = [{
         'folder_name': inspect.stack()[0][3],
@@ -166,12 +337,10 @@ def tst():
         'end_date': datetime.strptime(f'2021/12/31', constants.DATE_FORMAT),
     }]
 
-    for file_to_generate in files_to_generate:
-        generate_file(data_gen_obj=data_gen, file_details=file_to_generate)
+    generate_files(files_to_generate=files_to_generate, vectorised=vectorised, workers=workers, rows_scale=rows_scale)
 
 
-def sml():
-    data_gen = DataGenerator()
+def sml(vectorised=True, workers=1, rows_scale=1.0):
 
     files_to_generate = [{
         'folder_name': inspect.stack()[0][3],
@@ -217,12 +386,10 @@ def sml():
         'end_date': datetime.strptime(f'2021/12/31', constants.DATE_FORMAT),
     }]
 
-    for file_to_generate in files_to_generate:
-        generate_file(data_gen_obj=data_gen, file_details=file_to_generate)
+    generate_files(files_to_generate=files_to_generate, vectorised=vectorised, workers=workers, rows_scale=rows_scale)
 
 
-def bg():
-    data_gen = DataGenerator()
+def bg(vectorised=True, workers=1, rows_scale=1.0):
 
     files_to_generate = [{
         'folder_name': inspect.stack()[0][3],
@@ -268,8 +435,7 @@ def bg():
         'end_date': datetime.strptime(f'2021/12/31', constants.DATE_FORMAT),
     }]
 
-    for file_to_generate in files_to_generate:
-        generate_file(data_gen_obj=data_gen, file_details=file_to_generate)
+    generate_files(files_to_generate=files_to_generate, vectorised=vectorised, workers=workers, rows_scale=rows_scale)
 
 
 if __name__ == '__main__':
@@ -278,16 +444,34 @@ if __name__ == '__main__':
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--mode',
+                        default='vectorised',
+                        choices=['vectorised', 'row'],
+                        help='Generate blocks of rows with NumPy, or one row at a time')
+    parser.add_argument('--workers',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of files generated in parallel (vectorised mode), the files do not depend on it')
+    parser.add_argument('--rows-scale',
+                        default=1.0,
+                        type=float,
+                        help='Multiplier of the number of rows of every file, e.g. 10 for a 10x `bg` dataset')
+    parser.add_argument('--benchmark',
+                        action='store_true',
+                        help='Print the rows/sec of both modes instead of generating data')
     args = parser.parse_args()
 
-    if args.type == 'tst':
+    if args.benchmark:
+        benchmark()
+
+    elif args.type == 'tst':
         tqdm.write("Generating `test` data")
-        tst()
+        tst(vectorised=args.mode == 'vectorised', workers=args.workers, rows_scale=args.rows_scale)
 
     elif args.type == 'sml':
         tqdm.write("Generating `small` data")
-        sml()
+        sml(vectorised=args.mode == 'vectorised', workers=args.workers, rows_scale=args.rows_scale)
 
     elif args.type == 'bg':
         tqdm.write("Generating `big` data")
-        bg()
+        bg(vectorised=args.mode == 'vectorised', workers=args.workers, rows_scale=args.rows_scale)
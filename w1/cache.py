@@ -0,0 +1,289 @@
+from typing import Generator, List, Tuple
+from w1.utils import DataReader, ColumnarChunk, COLUMN_TYPES
+from w1.profiler import profiler
+from tqdm import tqdm
+import numpy as np
+import argparse
+import tempfile
+import shutil
+import struct
+import json
+import os
+import constants
+
+CACHE_VERSION = 2
+# fixed size of the `.npy` headers, the columns are written before their final shape and dtype are known
+NPY_HEADER_SIZE = 128
+CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
+
+
+class ColumnarCache:
+    """
+    Binary columnar copy of a CSV file, saved next to it in the `<file name>.cols` folder (e.g. `2015.csv.cols`)
+
+    - one `.npy` file per column: float64 for FLOAT columns, int64 for INT columns, int32 dictionary codes for
+      CATEGORY columns (Country, StockCode, Description, Date) and fixed width bytes for the rest (InvoiceNo)
+    - `meta.json` with the size and modification time of the CSV, the number of rows and bytes of the CSV the
+      columns hold (its complete rows) and the dictionaries
+
+    Columns are memory mapped when read, so chunks are zero copy slices of the files on disk and only the
+    columns a query needs are ever touched. The cache is rebuilt automatically when the CSV file changes.
+
+    cache = ColumnarCache(fp='2015.csv').load_or_build()
+    for chunk in cache.iter_chunks(column_names=['Country', 'TotalPrice']):
+        ...
+    """
+    def __init__(self, fp: str, sep: str = ',') -> None:
+        self._fp = fp
+        self._sep = sep
+        self._meta = None
+        self._columns = {}
+
+    @staticmethod
+    def get_cache_path(fp: str) -> str:
+        return f'{fp}.cols'
+
+    def get_n_rows(self) -> int:
+        return self._meta['n_rows']
+
+    def get_n_bytes(self) -> int:
+        """
+        Byte offset of the CSV file after the last row in the cache
+        """
+        return self._meta['n_bytes']
+
+    def get_column_names(self) -> List[str]:
+        return list(self._meta['columns'].keys())
+
+    def _fingerprint(self) -> Tuple[int, int]:
+        stat = os.stat(self._fp)
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self) -> 'ColumnarCache':
+        """
+        :return: self if the cache exists and is valid for the current CSV file, else None
+        """
+        file_size, mtime_ns = self._fingerprint()
+        cache_path = self.get_cache_path(self._fp)
+
+        try:
+            with open(os.path.join(cache_path, 'meta.json')) as f:
+                meta = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        if not (isinstance(meta, dict) and meta.get('version') == CACHE_VERSION and
+                meta.get('file_size') == file_size and meta.get('mtime_ns') == mtime_ns):
+            return None
+
+        return self._map_columns(cache_path, meta)
+
+    def _map_columns(self, cache_path: str, meta: dict) -> 'ColumnarCache':
+        """
+        Memory map every column up front: the maps stay valid when a rebuild replaces the folder, so the
+        cache keeps reading the version its meta describes.
+
+        :return: self, or None if the columns do not match the meta (the folder was replaced in between)
+        """
+        try:
+            columns = {column_name: np.load(os.path.join(cache_path, f'{column_name}.npy'), mmap_mode='r',
+                                            allow_pickle=False)
+                       for column_name in meta['columns']}
+        except (OSError, ValueError):
+            return None
+
+        if any(len(vals) != meta['n_rows'] for vals in columns.values()):
+            return None
+
+        self._meta = meta
+        self._columns = columns
+        return self
+
+    def load_or_build(self) -> 'ColumnarCache':
+        return self.load() or self.build()
+
+    def build(self) -> 'ColumnarCache':
+        """
+        Parse the CSV file once and write every column to the cache folder. The columns are streamed to a
+        temporary folder next to the cache as the chunks are parsed, which then replaces the cache folder as a
+        whole: readers never see half written files and at most one chunk is held in memory.
+        """
+        file_size, mtime_ns = self._fingerprint()
+
+        with open(self._fp) as f:
+            col_names = f.readline().rstrip('\n').split(self._sep)
+
+        data_reader = DataReader(fp=self._fp, sep=self._sep, col_names=col_names)
+        # only the rows that are complete now, a row still being appended is not cached half way
+        byte_range = data_reader.get_rows_range()
+
+        cache_path = self.get_cache_path(self._fp)
+        tmp_path = tempfile.mkdtemp(prefix=f'{os.path.basename(cache_path)}.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(cache_path)))
+        try:
+            writers = {column_name: _ColumnWriter(os.path.join(tmp_path, f'{column_name}.npy'))
+                       for column_name in col_names}
+            categories = {}
+            n_rows = 0
+            for chunk in tqdm(data_reader.iter_chunks(byte_range=byte_range),
+                              desc=f'Caching {os.path.basename(self._fp)}'):
+                for column_name in col_names:
+                    vals = chunk.get_column(column_name)
+                    writers[column_name].append(vals if vals.dtype.kind != 'U' else np.char.encode(vals))
+
+                # dictionaries only grow from one chunk to the next, the last chunk has all the values
+                categories = {column_name: chunk.get_categories(column_name)
+                              for column_name in col_names if chunk.is_categorical(column_name)}
+                n_rows += chunk.get_n_rows()
+
+            for writer in writers.values():
+                writer.close()
+
+            meta = {
+                'version': CACHE_VERSION,
+                'file_size': file_size,
+                'mtime_ns': mtime_ns,
+                'n_rows': n_rows,
+                'n_bytes': byte_range[1],
+                'columns': {column_name: COLUMN_TYPES.get(column_name, 'string') for column_name in col_names},
+                'categories': categories
+            }
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                f.write(json.dumps(meta))
+
+            # mapped before the swap, the maps follow the files wherever the folder goes
+            self._map_columns(tmp_path, meta)
+            self._replace_dir(tmp_path, cache_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        return self
+
+    @staticmethod
+    def _replace_dir(src: str, dst: str) -> None:
+        """
+        Move the folder `src` to `dst`. A folder cannot be renamed over a non empty one, the old one is renamed
+        aside first and deleted once the new one is in place: readers that mapped its columns keep them.
+        """
+        old_path = None
+        if os.path.isdir(dst):
+            old_path = tempfile.mkdtemp(prefix=f'{os.path.basename(dst)}.', suffix='.old',
+                                        dir=os.path.dirname(os.path.abspath(dst)))
+            os.replace(dst, old_path)
+        os.replace(src, dst)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def get_column(self, column_name: str) -> np.ndarray:
+        # read only memory map of the column, nothing is read from disk until it is used
+        return self._columns[column_name]
+
+    def iter_chunks(self, column_names: List[str] = None, chunk_rows: int = 1 << 20,
+                    predicate: 'Predicate' = None) -> Generator:
+        """
+        Same as DataReader.iter_chunks, served from the cache: upon iteration the data is of type ColumnarChunk
+        and holds up to `chunk_rows` rows of the requested columns. The files of the other columns are never
+        opened. With a predicate, the requested columns are only sliced for the rows that match it.
+        """
+        column_names = column_names or self.get_column_names()
+        predicate_names = predicate.get_column_names() if predicate is not None else []
+        parse_names = column_names + [column_name for column_name in predicate_names if column_name not in column_names]
+        columns = {column_name: self.get_column(column_name) for column_name in parse_names}
+        categories = {column_name: self._meta['categories'][column_name]
+                      for column_name in parse_names if column_name in self._meta['categories']}
+
+        def get_vals(column_name: str, start: int, mask: np.ndarray = None) -> np.ndarray:
+            vals = columns[column_name][start:start + chunk_rows]
+            vals = vals if mask is None else vals[mask]
+            return vals if vals.dtype.kind != 'S' else np.char.decode(vals)
+
+        for start in range(0, self.get_n_rows(), chunk_rows):
+            n_rows = min(chunk_rows, self.get_n_rows() - start)
+            chunk_columns = {}
+            with profiler.stage('cache_read'):
+                mask = None
+                if predicate is not None:
+                    mask = predicate.mask(ColumnarChunk(
+                        columns={column_name: get_vals(column_name, start) for column_name in predicate_names},
+                        categories=categories, n_rows=n_rows))
+                    if mask.all():
+                        mask = None
+                    else:
+                        profiler.count('rows_filtered', n_rows - int(np.count_nonzero(mask)))
+                        n_rows = int(np.count_nonzero(mask))
+
+                if n_rows > 0:
+                    for column_name in column_names:
+                        chunk_columns[column_name] = get_vals(column_name, start, mask)
+            profiler.count('rows_from_cache', min(chunk_rows, self.get_n_rows() - start))
+
+            if n_rows == 0:
+                continue
+
+            yield ColumnarChunk(columns=chunk_columns,
+                                categories={column_name: categories[column_name]
+                                            for column_name in column_names if column_name in categories},
+                                n_rows=n_rows)
+
+
+class _ColumnWriter:
+    """
+    Streams the chunks of one column to a `.npy` file: the values are appended after a fixed size header that
+    is written by close(), once the dtype and the number of rows are known. A chunk of a wider dtype (longer
+    strings, floats after ints) converts the rows already written, as np.concatenate would.
+    """
+    def __init__(self, fp: str) -> None:
+        self._fp = fp
+        self._dtype = None
+        self._n_rows = 0
+        self._f = open(fp, 'wb')
+        self._f.seek(NPY_HEADER_SIZE)
+
+    def append(self, vals: np.ndarray) -> None:
+        dtype = vals.dtype if self._dtype is None else np.result_type(self._dtype, vals.dtype)
+        if self._n_rows > 0 and dtype != self._dtype:
+            self._convert(dtype)
+        self._dtype = dtype
+        vals.astype(dtype, copy=False).tofile(self._f)
+        self._n_rows += len(vals)
+
+    def _convert(self, dtype: np.dtype, block_rows: int = 1 << 20) -> None:
+        self._f.close()
+        written = np.memmap(self._fp, dtype=self._dtype, mode='r', offset=NPY_HEADER_SIZE, shape=(self._n_rows,))
+        with open(f'{self._fp}.tmp', 'wb') as f:
+            f.seek(NPY_HEADER_SIZE)
+            for start in range(0, self._n_rows, block_rows):
+                written[start:start + block_rows].astype(dtype).tofile(f)
+        del written
+        os.replace(f'{self._fp}.tmp', self._fp)
+        self._f = open(self._fp, 'r+b')
+        self._f.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        dtype = self._dtype if self._dtype is not None else np.dtype(np.float64)
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                       'shape': (self._n_rows,)})
+        # magic string, version and header length take 10 bytes, the header is padded with spaces
+        header = (header.ljust(NPY_HEADER_SIZE - 11) + '\n').encode('latin1')
+        self._f.seek(0)
+        self._f.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header)
+        self._f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
+    parser.add_argument('--type',
+                        default='tst',
+                        choices=['tst', 'sml', 'bg'],
+                        help='Type of data to convert')
+    args = parser.parse_args()
+
+    data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
+    files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
+
+    for file_name in files:
+        ColumnarCache(fp=os.path.join(data_folder_path, file_name)).load_or_build()
+
+
+if __name__ == '__main__':
+    main()
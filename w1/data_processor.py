@@ -1,18 +1,25 @@
-from typing import List
+from typing import Dict, List
 from pprint import pprint
 from w1.utils import Stats, DataReader
-from tqdm import tqdm
+from w1.engine import QueryPlan, DescribeOperator, AggregateOperator, GroupByOperator, HashAggregateOperator
+from w1.index import FileIndex
+from w1.result_cache import ResultCache
+from w1.predicate import Predicate
+import constants
 import os
 
 
 class DataProcessor:
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, result_cache: ResultCache = None) -> None:
         self._fp = file_path
         self._col_names = []
         self._sep = ","
         self._stats = None
         self._file_name = os.path.basename(file_path)
         self._n_rows = 0
+        self._index = FileIndex(fp=file_path).load()
+        # results of unchanged files are served from the result cache, see ResultCache
+        self._result_cache = result_cache or ResultCache()
 
         self._set_col_names()
         self.data_reader = DataReader(fp=file_path, sep=self._sep, col_names=self._col_names)
@@ -25,42 +32,48 @@ class DataProcessor:
         except:
             return None
 
-    def _set_n_rows(self) -> None:
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        _ = next(data_reader_gen)
+    def get_index(self) -> FileIndex:
+        return self._index
 
-        for _ in tqdm(data_reader_gen):
-            self._n_rows += 1
+    def _set_n_rows(self) -> None:
+        # the row count comes from the sidecar index, the file is only scanned when the index is stale
+        self._n_rows = self._index.get_n_rows()
 
     def _set_col_names(self) -> None:
-        with open(self._fp) as f:
-            first_row = f.readline().strip('\n')
-
-        col_names = first_row.split(self._sep)
+        col_names = self._index.get_header().split(self._sep)
         self._col_names = col_names
 
-    def describe(self, column_names: List[str]):
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
-        # key is the column name and value is the stats object
-        stats = {name: Stats() for name in column_names}
-
-        # update stats as we iterate through the file
-        for row in tqdm(data_reader_gen):
-            for column_name in column_names:
-                stats[column_name].update_stats(val=row[column_name])
+    def new_plan(self, predicate: Predicate = None) -> QueryPlan:
+        return QueryPlan(data_reader=self.data_reader, result_cache=self._result_cache, predicate=predicate)
 
+    def sales_plan(self) -> QueryPlan:
+        """
+        Plan of get_sales_information: describe, aggregate and revenue per region, all fed by a single scan of
+        the file
+        """
+        plan = self.new_plan()
+        plan.register('describe', DescribeOperator(column_names=[constants.OutDataColNames.UNIT_PRICE,
+                                                                 constants.OutDataColNames.TOTAL_PRICE]))
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                            value_column=constants.OutDataColNames.TOTAL_PRICE))
+        return plan
+
+    def run_plan(self, plan: QueryPlan) -> Dict:
+        return plan.run()
+
+    def set_stats(self, stats: Dict[str, Stats]) -> None:
         self._stats = stats
         for column_name, value in self._stats.items():
             pprint(column_name)
             pprint(value.get_stats())
 
+    def describe(self, column_names: List[str]):
+        plan = self.new_plan()
+        plan.register('describe', DescribeOperator(column_names=column_names))
+
+        self.set_stats(self.run_plan(plan)['describe'])
+
     def aggregate(self, column_name: str) -> float:
         """
         Input : List[str]
@@ -78,6 +91,26 @@ class DataProcessor:
 
         aggregate should be 105.58
         """
-        ######################################## YOUR CODE HERE ##################################################
+        plan = self.new_plan()
+        plan.register('aggregate', AggregateOperator(column_name=column_name))
+
+        return self.run_plan(plan)['aggregate']
+
+    def group_by(self, keys: List[str], aggs: Dict[str, List], predicate: Predicate = None) -> Dict:
+        """
+        Input : key columns, aggregations per value column (any of sum, count, mean, min, max), row filter
+        Output : Dict
+
+        Group the rows by the key columns and aggregate the value columns, with the vectorised hash aggregation of
+        HashAggregateOperator. For example dp.group_by(keys=['Country', 'StockCode'],
+        aggs={'TotalPrice': ['sum', 'mean']}) returns
+        {
+            ('India', '22180'): {'TotalPrice': {'sum': 79.84, 'mean': 19.96}},
+            ...
+        }
+        A single key column gives the key value itself as key instead of a tuple.
+        """
+        plan = self.new_plan(predicate=predicate)
+        plan.register('group_by', HashAggregateOperator(keys=keys, aggs=aggs))
 
-        ######################################## YOUR CODE HERE ##################################################
+        return self.run_plan(plan)['group_by']
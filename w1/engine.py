@@ -0,0 +1,785 @@
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+from w1.utils import Stats, DataReader, ColumnarChunk, HyperLogLog, hash64, COLUMN_TYPES, FLOAT, INT
+from w1.cache import ColumnarCache
+from w1.result_cache import ResultCache
+from w1.profiler import profiler
+from w1.predicate import Predicate
+from tqdm import tqdm
+import numpy as np
+import os
+
+
+class Operator:
+    """
+    Base class for every consumer that can be registered on a QueryPlan.
+
+    An operator receives the file either row by row through `consume` or as columnar chunks through
+    `consume_chunk`, and exposes its final value through `result`. Operators that ran over different parts of
+    a file are combined with `merge`
+    """
+    @staticmethod
+    def to_float(val):
+        try:
+            return float(val)
+        except:
+            return None
+
+    def get_column_names(self) -> List[str]:
+        raise NotImplementedError
+
+    def get_cache_key(self) -> str:
+        """
+        Operation and columns, two operators with the same key compute the same result over the same file
+        """
+        return f'{type(self).__name__}({",".join(self.get_column_names())})'
+
+    def consume(self, row: Dict) -> None:
+        raise NotImplementedError
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        raise NotImplementedError
+
+    def merge(self, other: 'Operator') -> None:
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class DescribeOperator(Operator):
+    """
+    Stats (see Stats) of every column
+
+    With `count_distinct` every column also gets a distinct count: numbers are counted on their parsed value,
+    the other columns (e.g. InvoiceNo, StockCode) only get the distinct count - on a CATEGORY column the
+    categories of a chunk are hashed, not the rows.
+
+    DescribeOperator(column_names=['UnitPrice', 'InvoiceNo'], count_distinct=True).result()['InvoiceNo'].get_stats()
+    """
+    def __init__(self, column_names: List[str], count_distinct: bool = False, distinct_precision: int = 12) -> None:
+        self._count_distinct = count_distinct
+        self._distinct_precision = distinct_precision
+        # key is the column name and value is the stats object
+        self._stats = {name: Stats(count_distinct=count_distinct, distinct_precision=distinct_precision)
+                       for name in column_names}
+
+    def get_column_names(self) -> List[str]:
+        return list(self._stats.keys())
+
+    def get_cache_key(self) -> str:
+        if not self._count_distinct:
+            return super().get_cache_key()
+        return f'{type(self).__name__}({",".join(self.get_column_names())}|distinct,{self._distinct_precision})'
+
+    def _is_distinct_only(self, column_name: str) -> bool:
+        return self._count_distinct and COLUMN_TYPES.get(column_name) not in (FLOAT, INT)
+
+    def consume(self, row: Dict) -> None:
+        for column_name, stats in self._stats.items():
+            if self._is_distinct_only(column_name):
+                stats.update_distinct(val=row[column_name])
+            else:
+                stats.update_stats(val=row[column_name])
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        for column_name, stats in self._stats.items():
+            if not self._is_distinct_only(column_name):
+                stats.update_stats_batch(vals=chunk.get_column(column_name))
+            elif chunk.is_categorical(column_name):
+                codes, categories = chunk.factorize(column_name)
+                present = np.bincount(codes, minlength=len(categories)) > 0
+                stats.update_distinct_batch(vals=np.array(categories)[present])
+            else:
+                stats.update_distinct_batch(vals=chunk.get_column(column_name))
+
+    def merge(self, other: 'DescribeOperator') -> None:
+        for column_name, stats in self._stats.items():
+            stats.merge(other._stats[column_name])
+
+    def result(self) -> Dict[str, Stats]:
+        return self._stats
+
+
+class DistinctCountOperator(Operator):
+    """
+    Number of distinct values of columns (e.g. InvoiceNo, StockCode), optionally per group (e.g. per Country)
+
+    Every group and column has its own HyperLogLog: 2^precision bytes (4KB by default) whatever the number of
+    rows, a relative standard error of 1.04 / sqrt(2^precision) (1.6% by default) and exact counts while a group
+    has few distinct values. The values of a chunk are hashed once (a CATEGORY column once per category), then
+    the hashes are split per group.
+
+    Operators over different chunks, processes or files (e.g. all the years) are combined with `merge`, the
+    counts of the merged operator are the counts of the union of the values.
+
+    DistinctCountOperator(column_names=['InvoiceNo', 'StockCode'], group_column='Country').result()
+    # {'India': {'InvoiceNo': 1523, 'StockCode': 3410}, ...}
+    """
+    def __init__(self, column_names: List[str], group_column: str = None, precision: int = 12) -> None:
+        self._column_names = list(column_names)
+        self._group_column = group_column
+        self._precision = precision
+
+        # group value (None without group column) -> column name -> HyperLogLog
+        self._groups: Dict = {}
+        # rows of the row by row engine, hashed in batches
+        self._rows: List[Dict] = []
+
+    def get_column_names(self) -> List[str]:
+        group_columns = [self._group_column] if self._group_column is not None else []
+        return group_columns + [column_name for column_name in self._column_names
+                                if column_name != self._group_column]
+
+    def get_cache_key(self) -> str:
+        return f'{type(self).__name__}({",".join(self._column_names)}|{self._group_column}|{self._precision})'
+
+    def _get_sketch(self, group, column_name: str) -> HyperLogLog:
+        sketches = self._groups.setdefault(group, {})
+        if column_name not in sketches:
+            sketches[column_name] = HyperLogLog(precision=self._precision)
+        return sketches[column_name]
+
+    @staticmethod
+    def _hash(vals: np.ndarray, categories: List = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: hash of every row and whether the row has a value (numbers that could not be parsed are NaN)
+        """
+        if categories is not None:
+            hashes = hash64(np.array(categories))[vals] if categories else np.zeros(len(vals), dtype=np.uint64)
+            return hashes, np.ones(len(vals), dtype=bool)
+
+        valid = ~np.isnan(vals) if vals.dtype.kind == 'f' else np.ones(len(vals), dtype=bool)
+        return hash64(vals), valid
+
+    def _add(self, group_codes: np.ndarray, groups: List, columns: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+        # rows ordered by group, the rows of every group are a slice
+        order = np.argsort(group_codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(group_codes, minlength=len(groups)))]).tolist()
+
+        for column_name, (hashes, valid) in columns.items():
+            hashes, valid = hashes[order], valid[order]
+            for group_code, group in enumerate(groups):
+                start, end = bounds[group_code], bounds[group_code + 1]
+                if start < end:
+                    self._get_sketch(group, column_name).update_hashes(hashes[start:end][valid[start:end]])
+
+    def consume(self, row: Dict) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= 1 << 16:
+            self._consume_rows()
+
+    def _consume_rows(self) -> None:
+        if not self._rows:
+            return
+
+        rows, self._rows = self._rows, []
+        if self._group_column is None:
+            group_codes, groups = np.zeros(len(rows), dtype=np.int64), [None]
+        else:
+            groups, group_codes = np.unique(np.array([row[self._group_column] for row in rows]),
+                                            return_inverse=True)
+            groups = groups.tolist()
+
+        columns = {}
+        for column_name in self._column_names:
+            # numbers are counted on their value, the same way as the floats of the columnar chunks
+            if COLUMN_TYPES.get(column_name) in (FLOAT, INT):
+                vals = np.array([np.nan if val is None else val for val in
+                                 [self.to_float(row[column_name]) for row in rows]], dtype=np.float64)
+            else:
+                vals = np.array([row[column_name] for row in rows])
+            columns[column_name] = self._hash(vals)
+
+        self._add(group_codes, groups, columns)
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        self._consume_rows()
+        if self._group_column is None:
+            group_codes, groups = np.zeros(chunk.get_n_rows(), dtype=np.int64), [None]
+        else:
+            group_codes, groups = chunk.factorize(self._group_column)
+
+        self._add(group_codes, groups,
+                  {column_name: self._hash(chunk.get_column(column_name),
+                                           chunk.get_categories(column_name)
+                                           if chunk.is_categorical(column_name) else None)
+                   for column_name in self._column_names})
+
+    def merge(self, other: 'DistinctCountOperator') -> None:
+        self._consume_rows()
+        other._consume_rows()
+
+        for group, sketches in other._groups.items():
+            for column_name, sketch in sketches.items():
+                self._get_sketch(group, column_name).merge(sketch)
+
+    def get_error(self) -> float:
+        """
+        Relative standard error of the counts that are not exact
+        """
+        return 1.04 / np.sqrt(1 << self._precision)
+
+    def result(self) -> Dict:
+        """
+        :return: {column name: count}, per group value in a Dict with a group column
+        """
+        self._consume_rows()
+        counts = {group: {column_name: sketch.count() for column_name, sketch in sketches.items()}
+                  for group, sketches in self._groups.items()}
+
+        if self._group_column is None:
+            return counts.get(None, {column_name: 0 for column_name in self._column_names})
+
+        return counts
+
+
+class AggregateOperator(Operator):
+    def __init__(self, column_name: str) -> None:
+        self._column_name = column_name
+        self._aggregate = 0
+
+    def get_column_names(self) -> List[str]:
+        return [self._column_name]
+
+    def consume(self, row: Dict) -> None:
+        val = self.to_float(row[self._column_name])
+        if val:
+            self._aggregate += val
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        self._aggregate += float(np.nansum(chunk.get_column(self._column_name)))
+
+    def merge(self, other: 'AggregateOperator') -> None:
+        self._aggregate += other._aggregate
+
+    def result(self) -> float:
+        return self._aggregate
+
+
+class GroupByOperator(Operator):
+    def __init__(self, key_column: str, value_column: str) -> None:
+        self._key_column = key_column
+        self._value_column = value_column
+        self._aggregate = dict()
+
+    def get_column_names(self) -> List[str]:
+        return [self._key_column, self._value_column]
+
+    def consume(self, row: Dict) -> None:
+        key = row[self._key_column]
+        val = self.to_float(row[self._value_column])
+
+        if key not in self._aggregate:
+            self._aggregate[key] = 0
+        if val is not None:
+            self._aggregate[key] += val
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        codes, keys = chunk.factorize(self._key_column)
+        vals = np.nan_to_num(chunk.get_column(self._value_column).astype(np.float64), nan=0.0)
+
+        sums = np.bincount(codes, weights=vals, minlength=len(keys))
+        counts = np.bincount(codes, minlength=len(keys))
+        for key, total, count in zip(keys, sums.tolist(), counts.tolist()):
+            if count == 0:
+                continue
+
+            if key not in self._aggregate:
+                self._aggregate[key] = 0
+            self._aggregate[key] += total
+
+    def merge(self, other: 'GroupByOperator') -> None:
+        for key, total in other._aggregate.items():
+            if key not in self._aggregate:
+                self._aggregate[key] = 0
+            self._aggregate[key] += total
+
+    def result(self) -> Dict:
+        return self._aggregate
+
+
+AGGREGATIONS = ['sum', 'count', 'mean', 'min', 'max']
+
+
+class HashAggregateOperator(Operator):
+    """
+    Group by any number of key columns with any of AGGREGATIONS per value column
+
+    Vectorised hash aggregation: the keys of every chunk are factorised into integer codes, the codes of all the
+    keys are combined into a single group index and every aggregation is a `np.bincount` (or a `reduceat` for
+    min and max) over that index. When the product of the distinct values of the keys in the chunk is small the
+    combined index is used as is (a perfect hash, no sort at all), else it is compacted with `np.unique`.
+
+    The partial aggregates of a chunk are then added to the groups seen so far, which are kept as sorted arrays
+    of their combined global key codes. NaN values (that could not be parsed) are skipped by every aggregation.
+
+    operator = HashAggregateOperator(keys=['Country', 'StockCode'], aggs={'TotalPrice': ['sum', 'mean']})
+    operator.result()  # {('India', '22180'): {'TotalPrice': {'sum': 79.84, 'mean': 19.96}}, ...}
+    """
+    def __init__(self, keys: List[str], aggs: Dict[str, List], max_dense_groups: int = 1 << 22) -> None:
+        if not keys:
+            raise ValueError('At least one key column is required')
+
+        self._keys = list(keys)
+        # builtins and NumPy functions are accepted for their name, e.g. sum, min, max, np.mean
+        self._aggs = {column_name: [agg if isinstance(agg, str) else
+                                    {'amin': 'min', 'amax': 'max'}.get(agg.__name__, agg.__name__)
+                                    for agg in col_aggs]
+                      for column_name, col_aggs in aggs.items()}
+        for column_name, col_aggs in self._aggs.items():
+            if any([agg not in AGGREGATIONS for agg in col_aggs]):
+                raise ValueError(f'Aggregations of `{column_name}` should be among {AGGREGATIONS}')
+
+        self._max_dense_groups = max_dense_groups
+        self._key_bits = 63 // len(self._keys)
+
+        # key value -> global code, per key column
+        self._key_codes: List[Dict] = [{} for _ in self._keys]
+        # combined global key of every group, in order of creation, and the same keys sorted to look groups up
+        self._group_keys = np.zeros(0, dtype=np.int64)
+        self._sorted_keys = np.zeros(0, dtype=np.int64)
+        self._sorted_ids = np.zeros(0, dtype=np.int64)
+        # aggregation -> value column -> one value per group
+        self._states = {state: {column_name: np.zeros(0, dtype=np.float64) for column_name in self._aggs}
+                        for state in self._get_states()}
+
+        # rows of the row by row engine, aggregated in batches
+        self._rows: List[Dict] = []
+
+    def get_column_names(self) -> List[str]:
+        return self._keys + [column_name for column_name in self._aggs if column_name not in self._keys]
+
+    def get_cache_key(self) -> str:
+        aggs = ";".join([f'{column_name}:{",".join(col_aggs)}' for column_name, col_aggs in self._aggs.items()])
+        return f'{type(self).__name__}({",".join(self._keys)}|{aggs})'
+
+    def get_n_groups(self) -> int:
+        self._consume_rows()
+        return len(self._group_keys)
+
+    def _get_states(self) -> List[str]:
+        # mean is sum / count, count is always kept to skip the groups without a value
+        states = {'count'}
+        for col_aggs in self._aggs.values():
+            states.update(['sum' if agg == 'mean' else agg for agg in col_aggs])
+
+        return sorted(states)
+
+    def _to_global_codes(self, ind: int, values: List) -> np.ndarray:
+        codes = np.array([self._key_codes[ind].setdefault(val, len(self._key_codes[ind])) for val in values],
+                         dtype=np.int64)
+        if len(self._key_codes[ind]) >= 1 << self._key_bits:
+            raise ValueError(f'Too many distinct values in `{self._keys[ind]}` to group by {len(self._keys)} keys')
+
+        return codes
+
+    def _partial(self, local_codes: List[np.ndarray], local_values: List[List],
+                 columns: Dict[str, np.ndarray]) -> None:
+        """
+        Aggregate one batch of rows given the codes of its keys (indexes in `local_values`) and add it to the groups
+        """
+        sizes = [len(values) for values in local_values]
+        index = np.zeros(len(local_codes[0]), dtype=np.int64)
+        for codes, size in zip(local_codes, sizes):
+            index = index * size + codes
+
+        if int(np.prod(sizes, dtype=np.float64)) <= self._max_dense_groups:
+            # perfect hash - the combined codes are the group index
+            n_rows = np.bincount(index, minlength=int(np.prod(sizes)))
+            groups = np.flatnonzero(n_rows)
+            lookup = np.zeros(len(n_rows), dtype=np.int64)
+            lookup[groups] = np.arange(len(groups))
+            inverse = lookup[index]
+        else:
+            groups, inverse = np.unique(index, return_inverse=True)
+
+        # global key of every group of the batch
+        global_keys = np.zeros(len(groups), dtype=np.int64)
+        remainder = groups.copy()
+        for ind in reversed(range(len(self._keys))):
+            codes = remainder % sizes[ind]
+            remainder //= sizes[ind]
+            global_codes = self._to_global_codes(ind, local_values[ind])
+            global_keys |= global_codes[codes] << (ind * self._key_bits) if len(global_codes) > 0 else 0
+
+        partials = {state: {} for state in self._states}
+        order, starts = None, None
+        for column_name in self._aggs:
+            vals = columns[column_name].astype(np.float64)
+            valid = ~np.isnan(vals)
+            partials['count'][column_name] = np.bincount(inverse, weights=valid, minlength=len(groups))
+            if 'sum' in partials:
+                partials['sum'][column_name] = np.bincount(inverse, weights=np.where(valid, vals, 0.0),
+                                                           minlength=len(groups))
+
+            if 'min' in partials or 'max' in partials:
+                if order is None:
+                    # rows sorted by group, a radix sort when the group index fits in 16 bits
+                    order = np.argsort(inverse.astype(np.uint16) if len(groups) <= 1 << 16 else inverse,
+                                       kind='stable')
+                    starts = np.searchsorted(inverse[order], np.arange(len(groups)))
+                sorted_vals = vals[order]
+                if 'min' in partials:
+                    partials['min'][column_name] = np.fmin.reduceat(sorted_vals, starts) if len(groups) else \
+                        np.zeros(0)
+                if 'max' in partials:
+                    partials['max'][column_name] = np.fmax.reduceat(sorted_vals, starts) if len(groups) else \
+                        np.zeros(0)
+
+        self._add_groups(global_keys, partials)
+
+    def _add_groups(self, keys: np.ndarray, partials: Dict[str, Dict[str, np.ndarray]]) -> None:
+        """
+        Add partial aggregates of distinct global keys to the groups, new keys create new groups
+        """
+        pos = np.searchsorted(self._sorted_keys, keys)
+        found = np.zeros(len(keys), dtype=bool)
+        in_range = pos < len(self._sorted_keys)
+        found[in_range] = self._sorted_keys[pos[in_range]] == keys[in_range]
+
+        ids = np.empty(len(keys), dtype=np.int64)
+        ids[found] = self._sorted_ids[pos[found]]
+        n_new = int(np.count_nonzero(~found))
+        if n_new > 0:
+            ids[~found] = np.arange(len(self._group_keys), len(self._group_keys) + n_new)
+            self._group_keys = np.concatenate([self._group_keys, keys[~found]])
+            order = np.argsort(self._group_keys, kind='stable')
+            self._sorted_keys, self._sorted_ids = self._group_keys[order], order
+
+            initial = {'count': 0.0, 'sum': 0.0, 'min': np.nan, 'max': np.nan}
+            for state, columns in self._states.items():
+                for column_name in columns:
+                    columns[column_name] = np.concatenate([columns[column_name], np.full(n_new, initial[state])])
+
+        # every key is in the batch once, so the groups can be updated with plain fancy indexing
+        for column_name in self._aggs:
+            for state, columns in self._states.items():
+                partial = partials[state][column_name]
+                if state in ['count', 'sum']:
+                    columns[column_name][ids] += partial
+                elif state == 'min':
+                    columns[column_name][ids] = np.fmin(columns[column_name][ids], partial)
+                else:
+                    columns[column_name][ids] = np.fmax(columns[column_name][ids], partial)
+
+    def consume(self, row: Dict) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= 1 << 16:
+            self._consume_rows()
+
+    def _parse_key(self, key: str, vals: List[str]) -> np.ndarray:
+        # numbers are typed as in the columnar chunks, so that groups match across engines and merges
+        col_type = COLUMN_TYPES.get(key)
+        if col_type == INT:
+            try:
+                return np.array(vals, dtype=np.int64)
+            except ValueError:
+                pass
+
+        if col_type in (FLOAT, INT):
+            return np.array([np.nan if val is None else val for val in [self.to_float(val) for val in vals]],
+                            dtype=np.float64)
+
+        return np.array(vals)
+
+    def _consume_rows(self) -> None:
+        if not self._rows:
+            return
+
+        rows, self._rows = self._rows, []
+        local_codes, local_values = [], []
+        for key in self._keys:
+            values, codes = np.unique(self._parse_key(key, [row[key] for row in rows]), return_inverse=True)
+            local_codes.append(codes)
+            local_values.append(values.tolist())
+
+        columns = {column_name: np.array([np.nan if val is None else val for val in
+                                          [self.to_float(row[column_name]) for row in rows]], dtype=np.float64)
+                   for column_name in self._aggs}
+        self._partial(local_codes, local_values, columns)
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        self._consume_rows()
+        local_codes, local_values = zip(*[chunk.factorize(key) for key in self._keys])
+        self._partial(list(local_codes), list(local_values),
+                      {column_name: chunk.get_column(column_name) for column_name in self._aggs})
+
+    def merge(self, other: 'HashAggregateOperator') -> None:
+        self._consume_rows()
+        other._consume_rows()
+
+        # the groups of the other operator are a batch of partial aggregates, its key codes are its local codes
+        mask = (1 << other._key_bits) - 1
+        local_codes = [(other._group_keys >> (ind * other._key_bits)) & mask for ind in range(len(self._keys))]
+        local_values = [list(key_codes.keys()) for key_codes in other._key_codes]
+
+        global_keys = np.zeros(len(other._group_keys), dtype=np.int64)
+        for ind, codes in enumerate(local_codes):
+            global_codes = self._to_global_codes(ind, local_values[ind])
+            global_keys |= global_codes[codes] << (ind * self._key_bits) if len(global_codes) > 0 else 0
+
+        self._add_groups(global_keys, other._states)
+
+    def result(self) -> Dict:
+        """
+        :return: Dict with the key value (a tuple of the key values with more than one key) as key and
+                 {value column: {aggregation: value}} as value
+        """
+        self._consume_rows()
+        mask = (1 << self._key_bits) - 1
+        key_values = [list(key_codes.keys()) for key_codes in self._key_codes]
+        codes = [((self._group_keys >> (ind * self._key_bits)) & mask).tolist() for ind in range(len(self._keys))]
+
+        states = {state: {column_name: vals.tolist() for column_name, vals in columns.items()}
+                  for state, columns in self._states.items()}
+        results = {}
+        for group_id, group_codes in enumerate(zip(*codes)):
+            key = tuple(values[code] for values, code in zip(key_values, group_codes))
+            aggregates = {}
+            for column_name, col_aggs in self._aggs.items():
+                count = states['count'][column_name][group_id]
+                aggregates[column_name] = {}
+                for agg in col_aggs:
+                    if agg == 'count':
+                        aggregates[column_name][agg] = int(count)
+                    elif agg == 'mean':
+                        aggregates[column_name][agg] = states['sum'][column_name][group_id] / count if count else None
+                    else:
+                        val = states[agg][column_name][group_id]
+                        aggregates[column_name][agg] = None if val != val else val
+
+            results[key if len(key) > 1 else key[0]] = aggregates
+
+        return results
+
+
+class QueryPlan:
+    """
+    Fused query plan - operators register as consumers and a single scan of the DataReader feeds all of them,
+    so the file is read and parsed exactly once no matter how many operators are registered
+
+    By default the scan is columnar and only reads the columns the registered operators need. Whole file scans
+    are served from the memory mapped ColumnarCache of the file (built on the first scan, `use_cache=False` parses
+    the CSV with DataReader.iter_chunks instead); `run(columnar=False)` falls back to the row by row dict iterator.
+
+    With a `predicate` (see w1.predicate) the operators only see the rows that match it, the readers check it
+    before parsing the other columns.
+
+    With a `result_cache`, whole file runs first load the operators already computed for the file from the
+    ResultCache and only scan the file for the others, if any. Operators computed before rows were appended to the
+    file only consume the new rows.
+
+    plan = QueryPlan(data_reader=data_reader)
+    plan.register('total_revenue', AggregateOperator(column_name='TotalPrice'))
+    plan.register('revenue_per_region', GroupByOperator(key_column='Country', value_column='TotalPrice'))
+    results = plan.run()  # {'total_revenue': float, 'revenue_per_region': Dict}
+    """
+    def __init__(self, data_reader: DataReader, use_cache: bool = True, result_cache: ResultCache = None,
+                 predicate: Predicate = None) -> None:
+        self._data_reader = data_reader
+        self._use_cache = use_cache
+        self._result_cache = result_cache
+        self._predicate = predicate
+        self._operators: Dict[str, Operator] = {}
+
+    def register(self, name: str, operator: Operator) -> Operator:
+        if name in self._operators:
+            raise ValueError(f'An operator is already registered with the name `{name}`')
+
+        self._operators[name] = operator
+        return operator
+
+    def get_operators(self) -> Dict[str, Operator]:
+        return self._operators
+
+    def get_data_reader(self) -> DataReader:
+        return self._data_reader
+
+    def get_predicate(self) -> Predicate:
+        return self._predicate
+
+    def get_column_names(self) -> List[str]:
+        # columns required by at least one operator, in order of first use
+        column_names = []
+        for operator in self._operators.values():
+            column_names.extend([name for name in operator.get_column_names() if name not in column_names])
+
+        return column_names
+
+    def run(self, progress_callback: Optional[Callable[[int], None]] = None, progress_every: int = 10000,
+            columnar: bool = True, byte_range: Tuple[int, int] = None, progress_bar: bool = True) -> Dict:
+        """
+        Scan the file once and push every row to all the registered operators
+
+        :param progress_callback: called with the number of rows processed so far, at least every
+                                  `progress_every` rows for the row engine and once per chunk for the columnar one
+        :param progress_every: number of rows between two progress callbacks
+        :param columnar: use the columnar engine, else the row by row engine
+        :param byte_range: only scan the rows in this row aligned byte range [start, end) - columnar engine only
+        :param progress_bar: show a tqdm progress bar
+        :return: Dict with the operator name as key and the operator result as value
+        """
+        if self._result_cache is not None and byte_range is None:
+            pending = self.load_cached()
+            if pending:
+                # the checkpoint is the end of the rows that were scanned, rows appended meanwhile are left to
+                # the next run
+                end = self.subplan(pending)._run_complete_rows(progress_callback=progress_callback,
+                                                               progress_every=progress_every, columnar=columnar,
+                                                               progress_bar=progress_bar)
+                self.save_cached(pending, file_size=end)
+        elif columnar:
+            self._run_columnar(progress_callback=progress_callback, byte_range=byte_range, progress_bar=progress_bar)
+        elif byte_range is None:
+            self._run_rows(progress_callback=progress_callback, progress_every=progress_every,
+                           progress_bar=progress_bar)
+        else:
+            raise ValueError('`byte_range` is only supported by the columnar engine')
+
+        return self.results()
+
+    def _run_complete_rows(self, progress_callback: Optional[Callable[[int], None]], progress_every: int,
+                           columnar: bool, progress_bar: bool) -> int:
+        """
+        Scan the complete rows of the file as it is now, a row that is still being appended is left out
+
+        :return: byte offset after the last row scanned
+        """
+        if columnar and self._use_cache:
+            cache = self._load_columnar_cache()
+            self._run_columnar(progress_callback=progress_callback, progress_bar=progress_bar,
+                               chunks=cache.iter_chunks(column_names=self.get_column_names(),
+                                                        predicate=self._predicate))
+            return cache.get_n_bytes()
+
+        byte_range = self._data_reader.get_rows_range()
+        if columnar:
+            self._run_columnar(progress_callback=progress_callback, byte_range=byte_range, progress_bar=progress_bar)
+        else:
+            self._run_rows(progress_callback=progress_callback, progress_every=progress_every,
+                           progress_bar=progress_bar, byte_range=byte_range)
+
+        return byte_range[1]
+
+    def subplan(self, names: List[str]) -> 'QueryPlan':
+        """
+        Plan over the same file with only the operators `names`, the operators are shared with this plan
+        """
+        plan = QueryPlan(data_reader=self._data_reader, use_cache=self._use_cache, predicate=self._predicate)
+        for name in names:
+            plan.register(name, self._operators[name])
+
+        return plan
+
+    def load_cached(self) -> List[str]:
+        """
+        Load the results of the operators that are in the result cache into the (empty) registered operators.
+        The operators cached before rows were appended to the file consume the new rows right away, with a
+        columnar scan of the appended byte range only, and are cached again.
+
+        :return: names of the operators that are not cached and still need a scan of the file
+        """
+        fp = self._data_reader.get_file_path()
+        _, end = self._data_reader.get_rows_range()
+
+        pending = []
+        appended: Dict[int, List[str]] = {}
+        for name, operator in self._operators.items():
+            cached = self._result_cache.get(fp=fp, key=self._get_cache_key(name))
+            if cached is None or type(cached[0]) is not type(operator):
+                profiler.count('result_cache_misses')
+                pending.append(name)
+                continue
+            profiler.count('result_cache_hits')
+
+            cached_operator, offset = cached
+            operator.merge(cached_operator)
+            if offset < end:
+                appended.setdefault(offset, []).append(name)
+
+        for offset, names in appended.items():
+            self.subplan(names).run(byte_range=(offset, end), progress_bar=False)
+            self.save_cached(names, file_size=end)
+
+        return pending
+
+    def save_cached(self, names: List[str], file_size: int = None) -> None:
+        fp = self._data_reader.get_file_path()
+        for name in names:
+            self._result_cache.put(fp=fp, key=self._get_cache_key(name), operator=self._operators[name],
+                                   file_size=file_size)
+
+    def _get_cache_key(self, name: str) -> str:
+        # an operator over filtered rows is a different result
+        key = self._operators[name].get_cache_key()
+        return key if self._predicate is None else f'{key} WHERE {self._predicate.get_cache_key()}'
+
+    def get_result_cache(self) -> ResultCache:
+        return self._result_cache
+
+    def set_result_cache(self, result_cache: ResultCache) -> None:
+        self._result_cache = result_cache
+
+    def set_use_cache(self, use_cache: bool) -> None:
+        self._use_cache = use_cache
+
+    def results(self) -> Dict:
+        return {name: operator.result() for name, operator in self._operators.items()}
+
+    def merge(self, operators: Dict[str, Operator]) -> None:
+        """
+        Merge the operators of the same plan run over another part of the file (see `w3.executor`)
+        """
+        for name, operator in self._operators.items():
+            operator.merge(operators[name])
+
+    def _run_rows(self, progress_callback: Optional[Callable[[int], None]], progress_every: int,
+                  progress_bar: bool, byte_range: Tuple[int, int] = None) -> None:
+        # get generator from data_reader, only the columns of the operators and the rows that match the predicate
+        data_reader_gen = self._data_reader.iter_rows(column_names=self.get_column_names(), predicate=self._predicate,
+                                                      byte_range=byte_range)
+
+        operators = list(self._operators.values())
+        row_num = -1
+        # read, parse and consume are interleaved row by row, the row engine is timed as a single stage
+        with profiler.stage('scan_rows'):
+            for row_num, row in enumerate(tqdm(data_reader_gen, disable=not progress_bar)):
+                if progress_callback is not None and row_num % progress_every == 0:
+                    progress_callback(row_num)
+
+                for operator in operators:
+                    operator.consume(row)
+
+        profiler.count('rows_parsed', row_num + 1)
+        profiler.count('bytes_read', byte_range[1] - byte_range[0] if byte_range is not None else
+                       os.path.getsize(self._data_reader.get_file_path()))
+
+    def _run_columnar(self, progress_callback: Optional[Callable[[int], None]], byte_range: Tuple[int, int] = None,
+                      progress_bar: bool = True, chunks: Generator = None) -> None:
+        operators = list(self._operators.values())
+        row_num = 0
+
+        with tqdm(unit=' rows', disable=not progress_bar) as bar:
+            for chunk in chunks if chunks is not None else self._iter_chunks(byte_range=byte_range):
+                if progress_callback is not None:
+                    with profiler.stage('progress'):
+                        progress_callback(row_num)
+
+                with profiler.stage('consume'):
+                    for operator in operators:
+                        operator.consume_chunk(chunk)
+
+                row_num += chunk.get_n_rows()
+                bar.update(chunk.get_n_rows())
+
+    def _load_columnar_cache(self) -> ColumnarCache:
+        return ColumnarCache(fp=self._data_reader.get_file_path(),
+                             sep=self._data_reader.get_separator()).load_or_build()
+
+    def _iter_chunks(self, byte_range: Tuple[int, int]) -> Generator:
+        if self._use_cache and byte_range is None:
+            cache = self._load_columnar_cache()
+            return cache.iter_chunks(column_names=self.get_column_names(), predicate=self._predicate)
+
+        return self._data_reader.iter_chunks(column_names=self.get_column_names(), byte_range=byte_range,
+                                             predicate=self._predicate)
@@ -0,0 +1,153 @@
+from typing import Dict, Tuple
+import hashlib
+import json
+import os
+
+INDEX_VERSION = 3
+
+
+def get_tail_hash(fp: str, size: int, n_bytes: int = 4096) -> str:
+    """
+    Hash of the last `n_bytes` of the first `size` bytes of a file
+    """
+    with open(fp, 'rb') as f:
+        f.seek(max(size - n_bytes, 0))
+        return hashlib.sha1(f.read(min(size, n_bytes))).hexdigest()
+
+
+def is_append(fp: str, size: int, tail_hash: str) -> bool:
+    """
+    True if the file is the version of `size` bytes with rows appended to it: it is larger, it still ends with
+    the same bytes at `size` and that version ended on a line break, so the new rows start right at `size`
+    """
+    if size is None or tail_hash is None or not 0 < size < os.path.getsize(fp):
+        return False
+
+    with open(fp, 'rb') as f:
+        f.seek(size - 1)
+        if f.read(1) != b'\n':
+            return False
+
+    return get_tail_hash(fp=fp, size=size) == tail_hash
+
+
+class FileIndex:
+    """
+    Sidecar index of a CSV file, saved next to it as `<file name>.idx` (e.g. `2015.csv.idx`)
+
+    It records the column names row and the number of rows (column names row excluded). The index is keyed on
+    the size and modification time of the file, so it is rebuilt automatically whenever the file changes, or only
+    extended over the new rows when rows were appended to it.
+
+    index = FileIndex(fp='2015.csv').load()
+    index.get_n_rows()  # O(1) once the sidecar exists
+    """
+    def __init__(self, fp: str) -> None:
+        self._fp = fp
+        self._header = None
+        self._n_rows = 0
+        self._file_size = None
+        self._mtime_ns = None
+        self._tail_hash = None
+
+    @staticmethod
+    def get_index_path(fp: str) -> str:
+        return f'{fp}.idx'
+
+    def get_header(self) -> str:
+        return self._header
+
+    def get_n_rows(self) -> int:
+        return self._n_rows
+
+    def get_file_size(self) -> int:
+        return self._file_size
+
+    def _fingerprint(self) -> Tuple[int, int]:
+        stat = os.stat(self._fp)
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self) -> 'FileIndex':
+        """
+        Read the sidecar index if it is still valid for the file, else build it and save it. When rows were only
+        appended to the file since the index was saved, only the new rows are scanned.
+        """
+        file_size, mtime_ns = self._fingerprint()
+
+        try:
+            with open(self.get_index_path(self._fp)) as f:
+                data = json.loads(f.read())
+        except (OSError, ValueError):
+            data = None
+
+        if not (isinstance(data, dict) and data.get('version') == INDEX_VERSION):
+            self.build()
+        elif data.get('file_size') == file_size and data.get('mtime_ns') == mtime_ns:
+            self._from_dict(data)
+            return self
+        elif is_append(fp=self._fp, size=data.get('file_size'), tail_hash=data.get('tail_hash')):
+            self._from_dict(data)
+            self.build(start=data['file_size'])
+        else:
+            self.build()
+
+        self.save()
+        return self
+
+    def build(self, start: int = None) -> None:
+        """
+        Scan the file once over raw blocks of bytes and count the rows
+
+        :param start: size of the version of the file the index was loaded from, when rows were only appended to
+                      it since: the scan starts there and extends the index
+        """
+        self._file_size, self._mtime_ns = self._fingerprint()
+
+        n_line_breaks = self._n_rows if start is not None else 0
+        last_block = b''
+
+        with open(self._fp, 'rb') as f:
+            if start is None:
+                self._header = f.readline().decode().rstrip('\n')
+            else:
+                f.seek(start)
+
+            for block in iter(lambda: f.read(1 << 22), b''):
+                # a row ends at every line break
+                n_line_breaks += block.count(b'\n')
+                last_block = block
+
+        # last row without a trailing line break
+        if last_block and not last_block.endswith(b'\n'):
+            n_line_breaks += 1
+
+        self._n_rows = n_line_breaks
+        self._tail_hash = get_tail_hash(fp=self._fp, size=self._file_size)
+
+    def save(self) -> None:
+        index_path = self.get_index_path(self._fp)
+        try:
+            # written aside and renamed, another process never loads half an index
+            with open(f'{index_path}.{os.getpid()}.tmp', 'w') as f:
+                f.write(json.dumps(self._to_dict()))
+            os.replace(f'{index_path}.{os.getpid()}.tmp', index_path)
+        except OSError:
+            # read only data folder - the index is simply rebuilt on the next run
+            pass
+
+    def _to_dict(self) -> Dict:
+        return {
+            'version': INDEX_VERSION,
+            'file_size': self._file_size,
+            'mtime_ns': self._mtime_ns,
+            'header': self._header,
+            'n_rows': self._n_rows,
+            'tail_hash': self._tail_hash
+        }
+
+    def _from_dict(self, data: Dict) -> None:
+        self._file_size = data['file_size']
+        self._mtime_ns = data['mtime_ns']
+        self._header = data['header']
+        self._n_rows = data['n_rows']
+        self._tail_hash = data['tail_hash']
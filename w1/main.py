@@ -1,7 +1,12 @@
 import constants
 from w1.data_processor import DataProcessor
+from w1.result_cache import ResultCache
+from w1.engine import GroupByOperator, DistinctCountOperator
+from w1.profiler import profiler
+from w1.rollup import RollupCube
+from w1.topk import TopKOperator
 from pprint import pprint
-from typing import Dict
+from typing import Dict, List
 from tqdm import tqdm
 import os
 import argparse
@@ -43,25 +48,149 @@ def revenue_per_region(dp: DataProcessor) -> Dict:
         'United States': 121.499
     }
     """
-    ######################################## YOUR CODE HERE ##################################################
+    plan = dp.new_plan()
+    plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                        value_column=constants.OutDataColNames.TOTAL_PRICE))
 
-    ######################################## YOUR CODE HERE ##################################################
+    return dp.run_plan(plan)['revenue_per_region']
 
 
-def get_sales_information(file_path: str) -> Dict:
+def get_rollup(dp: DataProcessor) -> RollupCube:
+    """
+    Input : object of instance type Class DataProcessor
+    Output : RollupCube
+
+    Revenue per day x country x stock code of the file. The cube is kept in the result cache, only the rows
+    appended to the file since the last call are scanned.
+    """
+    plan = dp.new_plan()
+    plan.register('rollup', RollupCube())
+
+    return dp.run_plan(plan)['rollup']
+
+
+def revenue_over_time(dp: DataProcessor, granularity: str = 'month', by: List[str] = None,
+                      start_date: str = None, end_date: str = None) -> Dict:
+    """
+    Input : object of instance type Class DataProcessor, time granularity (day|week|month|year), dimensions
+            (Country and/or StockCode), date range
+    Output : Dict
+
+    Revenue per period and dimensions, answered from the rollup cube of the file. For example with
+    granularity='month' and by=['Country']:
+    {
+        ('2015/01', 'France'): 6202.61,
+        ('2015/01', 'India'): 6520.19,
+        ...
+    }
+    """
+    return get_rollup(dp).query(granularity=granularity, by=by, start_date=start_date, end_date=end_date)
+
+
+def top_products_operator(dp: DataProcessor, k: int = 20, per_country: bool = True, approximate: bool = False,
+                          key_column: str = constants.OutDataColNames.STOCK_CODE) -> TopKOperator:
+    plan = dp.new_plan()
+    operator = plan.register('top_products', TopKOperator(
+        key_column=key_column, value_column=constants.OutDataColNames.TOTAL_PRICE, k=k,
+        group_column=constants.OutDataColNames.COUNTRY if per_country else None, approximate=approximate))
+    dp.run_plan(plan)
+
+    return operator
+
+
+def top_products(file_paths: List[str], k: int = 20, per_country: bool = True, approximate: bool = False,
+                 key_column: str = constants.OutDataColNames.STOCK_CODE):
+    """
+    Input : paths of the files (e.g. all the years), number of products, per country or overall, approximate
+            (bounded memory) or exact, product column (StockCode or Description)
+    Output : Dict or List
+
+    Top `k` products by revenue over all the files, see TopKOperator. For example with per_country=True:
+    {
+        'India': [('AMAZONFEE', 107018.76), ('CRUK', 9903.96), ...],
+        ...
+    }
+    """
+    merged = None
+    for file_path in file_paths:
+        operator = top_products_operator(DataProcessor(file_path=file_path), k=k, per_country=per_country,
+                                         approximate=approximate, key_column=key_column)
+        if merged is None:
+            merged = operator
+        else:
+            merged.merge(operator)
+
+    return merged.result() if merged is not None else ({} if per_country else [])
+
+
+def distinct_counts_operator(dp: DataProcessor, column_names: List[str] = None, per_country: bool = True,
+                             precision: int = 12) -> DistinctCountOperator:
+    plan = dp.new_plan()
+    operator = plan.register('distinct_counts', DistinctCountOperator(
+        column_names=column_names or [constants.OutDataColNames.INVOICE_NO, constants.OutDataColNames.STOCK_CODE],
+        group_column=constants.OutDataColNames.COUNTRY if per_country else None, precision=precision))
+    dp.run_plan(plan)
+
+    return operator
+
+
+def distinct_counts(file_paths: List[str], column_names: List[str] = None, per_country: bool = True,
+                    precision: int = 12) -> Dict:
+    """
+    Input : paths of the files (e.g. all the years), columns to count (InvoiceNo and StockCode by default), per
+            country or overall, precision of the HyperLogLog sketches
+    Output : Dict
+
+    Number of distinct invoices and products per year and over all the years, see DistinctCountOperator. The
+    counts have a relative standard error of 1.04 / sqrt(2^precision) (1.6% with the default precision), small
+    counts are exact. For example with per_country=True:
+    {
+        'per_year': {'2015': {'India': {'InvoiceNo': 1523, 'StockCode': 3410}, ...}, ...},
+        'all': {'India': {'InvoiceNo': 4570, 'StockCode': 3998}, ...}
+    }
+    """
+    merged, per_year = None, {}
+    for file_path in file_paths:
+        operator = distinct_counts_operator(DataProcessor(file_path=file_path), column_names=column_names,
+                                            per_country=per_country, precision=precision)
+        per_year[get_file_name(file_path)] = operator.result()
+
+        # the sketches of every year are merged into the counts over all the years
+        if merged is None:
+            merged = operator
+        else:
+            merged.merge(operator)
+
+    return {'per_year': per_year, 'all': merged.result() if merged is not None else {}}
+
+
+def get_sales_information(file_path: str, result_cache: ResultCache = None) -> Dict:
+    # the profiler report covers this file only
+    profiler.reset()
+
     # Initialize
-    dp = DataProcessor(file_path=file_path)
+    dp = DataProcessor(file_path=file_path, result_cache=result_cache)
+
+    # describe, aggregate and revenue per region are all fed by a single scan of the file
+    plan = dp.sales_plan()
+    results = dp.run_plan(plan)
 
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.set_stats(results['describe'])
 
     # return total revenue and revenue per region
-    return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+    information = {
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
+    # timings and counters of the run, with `--profile`
+    if profiler.is_enabled():
+        information['profile'] = profiler.get_report()
+
+    return information
+
 
 def main():
     parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
@@ -69,8 +198,14 @@ def main():
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Record timings and counters of the runs (also enabled with PROFILE=1)')
     args = parser.parse_args()
 
+    if args.profile:
+        profiler.enable()
+
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
     files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
 
@@ -0,0 +1,155 @@
+from typing import Dict, Iterable, List
+from datetime import date, datetime
+from w1.utils import ColumnarChunk, COLUMN_TYPES, FLOAT, INT
+import numpy as np
+import constants
+
+
+def to_key(column_name: str, val):
+    """
+    Comparable value of `val` for the column: a float for the numeric columns, the zero padded `DATE_FORMAT`
+    string for the Date column (so that dates compare as text, the way the files store them) and a string
+    otherwise. None if the value can not be converted.
+    """
+    if COLUMN_TYPES.get(column_name) in (FLOAT, INT):
+        try:
+            return float(val)
+        except (TypeError, ValueError):
+            return None
+
+    if column_name == constants.OutDataColNames.DATE:
+        if isinstance(val, str) and len(val) == 10:
+            # already zero padded, as written by the data generator
+            return val
+        try:
+            if not isinstance(val, date):
+                val = datetime.strptime(str(val), constants.DATE_FORMAT)
+            return val.strftime(constants.DATE_FORMAT)
+        except ValueError:
+            return None
+
+    return str(val)
+
+
+class Predicate:
+    """
+    Row filter pushed down to the readers: DataReader.iter_rows / iter_chunks and ColumnarCache.iter_chunks only
+    parse the columns of the predicate first and drop the rows that do not match before anything else is built.
+
+    `matches` is used by the row by row reader (values are the strings of the file), `mask` by the columnar ones.
+    On a CATEGORY column a predicate is evaluated once per distinct value and looked up by code.
+
+    predicate = And([Equals('Country', 'India'), Between('Date', '2015/01/01', '2015/03/31')])
+    """
+    def get_column_names(self) -> List[str]:
+        raise NotImplementedError
+
+    def get_cache_key(self) -> str:
+        raise NotImplementedError
+
+    def matches(self, row: Dict) -> bool:
+        raise NotImplementedError
+
+    def mask(self, chunk: ColumnarChunk) -> np.ndarray:
+        raise NotImplementedError
+
+    def _mask_values(self, chunk: ColumnarChunk, column_name: str) -> np.ndarray:
+        """
+        Mask of a single column predicate, through the categories of a CATEGORY column
+        """
+        vals = chunk.get_column(column_name)
+        if chunk.is_categorical(column_name):
+            allowed = np.array([self.matches({column_name: category})
+                                for category in chunk.get_categories(column_name)], dtype=bool)
+            return allowed[vals] if len(allowed) > 0 else np.zeros(len(vals), dtype=bool)
+
+        if vals.dtype.kind in 'fiu':
+            return self._mask_numbers(vals)
+
+        return np.array([self.matches({column_name: val}) for val in vals], dtype=bool)
+
+    def _mask_numbers(self, vals: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class IsIn(Predicate):
+    def __init__(self, column_name: str, values: Iterable) -> None:
+        self._column_name = column_name
+        self._keys = {to_key(column_name, val) for val in values} - {None}
+
+    def get_column_names(self) -> List[str]:
+        return [self._column_name]
+
+    def get_cache_key(self) -> str:
+        return f'IsIn({self._column_name},{sorted(self._keys)})'
+
+    def matches(self, row: Dict) -> bool:
+        return to_key(self._column_name, row[self._column_name]) in self._keys
+
+    def mask(self, chunk: ColumnarChunk) -> np.ndarray:
+        return self._mask_values(chunk, self._column_name)
+
+    def _mask_numbers(self, vals: np.ndarray) -> np.ndarray:
+        return np.isin(vals, np.array(sorted(self._keys), dtype=np.float64))
+
+
+class Equals(IsIn):
+    def __init__(self, column_name: str, value) -> None:
+        super().__init__(column_name=column_name, values=[value])
+
+
+class Between(Predicate):
+    """
+    low <= value <= high, either bound can be None. Values that can not be parsed never match.
+    """
+    def __init__(self, column_name: str, low=None, high=None) -> None:
+        self._column_name = column_name
+        self._low = None if low is None else to_key(column_name, low)
+        self._high = None if high is None else to_key(column_name, high)
+
+    def get_column_names(self) -> List[str]:
+        return [self._column_name]
+
+    def get_cache_key(self) -> str:
+        return f'Between({self._column_name},{self._low},{self._high})'
+
+    def matches(self, row: Dict) -> bool:
+        key = to_key(self._column_name, row[self._column_name])
+        return key is not None and (self._low is None or key >= self._low) and \
+            (self._high is None or key <= self._high)
+
+    def mask(self, chunk: ColumnarChunk) -> np.ndarray:
+        return self._mask_values(chunk, self._column_name)
+
+    def _mask_numbers(self, vals: np.ndarray) -> np.ndarray:
+        mask = ~np.isnan(vals) if vals.dtype.kind == 'f' else np.ones(len(vals), dtype=bool)
+        if self._low is not None:
+            mask &= vals >= self._low
+        if self._high is not None:
+            mask &= vals <= self._high
+        return mask
+
+
+class And(Predicate):
+    def __init__(self, predicates: List[Predicate]) -> None:
+        self._predicates = predicates
+
+    def get_column_names(self) -> List[str]:
+        column_names = []
+        for predicate in self._predicates:
+            column_names.extend([name for name in predicate.get_column_names() if name not in column_names])
+
+        return column_names
+
+    def get_cache_key(self) -> str:
+        return f'And({",".join([predicate.get_cache_key() for predicate in self._predicates])})'
+
+    def matches(self, row: Dict) -> bool:
+        return all(predicate.matches(row) for predicate in self._predicates)
+
+    def mask(self, chunk: ColumnarChunk) -> np.ndarray:
+        mask = np.ones(chunk.get_n_rows(), dtype=bool)
+        for predicate in self._predicates:
+            mask &= predicate.mask(chunk)
+
+        return mask
@@ -0,0 +1,99 @@
+from typing import Dict
+import threading
+import time
+import os
+
+PROFILE_ENV_VAR = 'PROFILE'
+
+
+class _Stage:
+    def __init__(self, profiler: 'Profiler', name: str) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._st = 0.0
+
+    def __enter__(self) -> '_Stage':
+        self._st = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._profiler.add_time(self._name, time.perf_counter() - self._st)
+
+
+class _NoopStage:
+    def __enter__(self) -> '_NoopStage':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class Profiler:
+    """
+    Opt-in timings per stage and counters of the hot path (bytes read, rows parsed, parse failures, DB writes...)
+
+    The hooks sit once per chunk or per batch of the scan, never once per row. When the profiler is disabled -
+    the default - `stage` hands back a shared no-op context manager and `count` returns right away.
+
+    profiler.enable()
+    with profiler.stage('parse'):
+        ...
+    profiler.count('rows_parsed', n_rows)
+    profiler.get_report()  # {'stages': {'parse': {'calls': 1, 'seconds': ...}}, 'counters': {'rows_parsed': ...}}
+    """
+    def __init__(self, enabled: bool = False) -> None:
+        self._enabled = enabled
+        self._stages: Dict[str, list] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self) -> None:
+        self._enabled = True
+
+    def disable(self) -> None:
+        self._enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+
+    def stage(self, name: str):
+        """
+        Context manager adding the time spent in its block to the stage `name`
+        """
+        return _Stage(self, name) if self._enabled else _NOOP_STAGE
+
+    def add_time(self, name: str, seconds: float) -> None:
+        if not self._enabled:
+            return
+
+        with self._lock:
+            stage = self._stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        if not self._enabled:
+            return
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def get_report(self) -> Dict:
+        with self._lock:
+            return {
+                'stages': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self._stages.items()},
+                'counters': dict(self._counters)
+            }
+
+
+# process wide profiler, enabled with `--profile` on the main scripts or with PROFILE=1 in the environment
+profiler = Profiler(enabled=os.environ.get(PROFILE_ENV_VAR) == '1')
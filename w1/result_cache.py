@@ -0,0 +1,201 @@
+from typing import Dict, List, Set, Tuple
+from w1.index import get_tail_hash, is_append
+import importlib.util
+import functools
+import tempfile
+import hashlib
+import pickle
+import json
+import io
+import os
+import constants
+
+CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
+PROJECT_FOLDER_NAME = os.path.dirname(CURRENT_FOLDER_NAME)
+# part of the key of every entry, bumped when the format of the entries changes
+RESULT_CACHE_VERSION = 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_hash(module_name: str) -> str:
+    """
+    Hash of the source of a module of the project, the version of the code of the classes it defines
+
+    :return: None if the module is not part of the project (third party modules are versioned by their package)
+             or its source is not available
+    """
+    try:
+        source_path = importlib.util.find_spec(module_name).origin
+        if not source_path.startswith(PROJECT_FOLDER_NAME + os.sep) or 'site-packages' in source_path:
+            return None
+
+        with open(source_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (AttributeError, ImportError, ValueError, TypeError, OSError):
+        return None
+
+
+class CodePickler(pickle.Pickler):
+    """
+    Pickler that records the modules of the classes of the objects it pickles: the operator and its state
+    (Stats, sketches...), the code that gives the pickled state its meaning
+    """
+    def __init__(self, f: io.BytesIO) -> None:
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._module_names = set()
+
+    def reducer_override(self, obj):
+        self._module_names.add(obj.__module__ if isinstance(obj, type) else type(obj).__module__)
+        return NotImplemented
+
+    def get_module_names(self) -> Set[str]:
+        return self._module_names
+
+
+def dump_operator(operator) -> Tuple[bytes, Dict[str, str]]:
+    """
+    :return: the pickled operator and the code hash of every project module its pickle depends on
+    """
+    f = io.BytesIO()
+    pickler = CodePickler(f)
+    pickler.dump(operator)
+
+    code_hashes = {module_name: get_code_hash(module_name) for module_name in sorted(pickler.get_module_names())}
+    return f.getvalue(), {module_name: code_hash for module_name, code_hash in code_hashes.items()
+                          if code_hash is not None}
+
+
+class ResultCache:
+    """
+    Persistent cache of the results of the operators of a QueryPlan, saved in `data/.results`
+
+    An entry is keyed on the file (absolute path) and on the cache key of the operator (operation and columns,
+    e.g. `AggregateOperator(TotalPrice)`), and holds the pickled operator with its final state - a checkpoint of
+    the operator at the size, modification time and last bytes of the file it was computed over.
+
+    - unchanged file: the operator is loaded instead of scanning the file
+    - rows appended to the file: the operator is loaded with the offset of the first new row, only the new rows
+      need to be scanned and consumed by it (see QueryPlan.load_cached)
+    - new or rewritten file: miss, the file is scanned
+    - operator computed by another version of its code (hash of the source of every project module its pickled
+      state uses, see CodePickler): miss, the file is scanned - the state may not mean the same to the new code
+
+    One file per entry, the modification time of the entry file is its last use: `get` touches it and `put`
+    evicts the least recently used entries beyond `max_entries` or `max_bytes`.
+
+    cache = ResultCache()
+    operator, offset = cache.get(fp='2015.csv', key='AggregateOperator(TotalPrice)')  # None if missing
+    cache.put(fp='2015.csv', key='AggregateOperator(TotalPrice)', operator=operator, file_size=file_size)
+    """
+    def __init__(self, cache_path: str = None, max_entries: int = 1024, max_bytes: int = 64 << 20) -> None:
+        self._cache_path = cache_path or os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME,
+                                                      constants.RESULT_CACHE_FOLDER_NAME)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+    def get_cache_path(self) -> str:
+        return self._cache_path
+
+    def _entry_path(self, fp: str, key: str) -> str:
+        entry_key = json.dumps([RESULT_CACHE_VERSION, os.path.abspath(fp), key])
+        return os.path.join(self._cache_path, f'{hashlib.sha1(entry_key.encode()).hexdigest()}.pkl')
+
+    def get(self, fp: str, key: str) -> Tuple[object, int]:
+        """
+        :return: the cached operator and the byte offset of the first row it has not consumed (the size of the
+                 file if it is unchanged), None if there is no entry for the file or the file was rewritten
+        """
+        entry_path = self._entry_path(fp=fp, key=key)
+
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(entry_path)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+        # the operator is only unpickled by the version of the code that pickled it
+        if not (isinstance(entry, dict) and isinstance(entry.get('operator'), bytes) and
+                isinstance(entry.get('code_hashes'), dict) and
+                all([get_code_hash(module_name) == code_hash
+                     for module_name, code_hash in entry['code_hashes'].items()])):
+            return None
+
+        stat = os.stat(fp)
+        if not ((entry.get('file_size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns) or
+                is_append(fp=fp, size=entry.get('file_size'), tail_hash=entry.get('tail_hash'))):
+            return None
+
+        try:
+            return pickle.loads(entry['operator']), entry['file_size']
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError):
+            return None
+
+    def put(self, fp: str, key: str, operator, file_size: int = None) -> None:
+        """
+        :param file_size: byte offset after the last row the operator consumed, the current size of the file by
+                          default
+        """
+        entry_path = self._entry_path(fp=fp, key=key)
+        stat = os.stat(fp)
+        file_size = stat.st_size if file_size is None else file_size
+
+        operator, code_hashes = dump_operator(operator)
+        entry = {
+            'file_size': file_size,
+            # the modification time only identifies the version of the file that was fully scanned
+            'mtime_ns': stat.st_mtime_ns if file_size == stat.st_size else None,
+            'tail_hash': get_tail_hash(fp=fp, size=file_size),
+            'code_hashes': code_hashes,
+            'operator': operator
+        }
+
+        try:
+            os.makedirs(self._cache_path, exist_ok=True)
+
+            # written aside under a name of its own and renamed, a reader never sees half an entry and two
+            # writers never write to the same file
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # read only data folder - the result is simply computed again on the next run
+            return
+
+        self.evict()
+
+    def get_entries(self) -> List[Tuple[str, float, int]]:
+        """
+        :return: (path, last use, size in bytes) of every entry, least recently used first
+        """
+        entries = []
+        for file_name in os.listdir(self._cache_path) if os.path.isdir(self._cache_path) else []:
+            if not file_name.endswith('.pkl'):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self._cache_path, file_name))
+            except OSError:
+                continue
+            entries.append((os.path.join(self._cache_path, file_name), stat.st_mtime, stat.st_size))
+
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def evict(self) -> None:
+        entries = self.get_entries()
+        total_bytes = sum([size for _, _, size in entries])
+
+        for ind, (entry_path, _, size) in enumerate(entries):
+            if len(entries) - ind <= self._max_entries and total_bytes <= self._max_bytes:
+                break
+
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self) -> None:
+        for entry_path, _, _ in self.get_entries():
+            os.remove(entry_path)
@@ -0,0 +1,236 @@
+from typing import Dict, List, Tuple
+from datetime import datetime
+from w1.engine import Operator
+from w1.utils import ColumnarChunk
+import numpy as np
+import constants
+
+# bits of the cell key: day (days since 1970/01/01) | country code | stock code
+COUNTRY_BITS = 16
+STOCK_BITS = 27
+DAY_SHIFT = COUNTRY_BITS + STOCK_BITS
+
+GRANULARITIES = ['day', 'week', 'month', 'year']
+DIMENSIONS = [constants.OutDataColNames.COUNTRY, constants.OutDataColNames.STOCK_CODE]
+
+
+class RollupCube(Operator):
+    """
+    Revenue and number of rows precomputed per day x country x stock code
+
+    Registered on a QueryPlan like any other operator, a scan of the file fills the cube. Every coarser query
+    (week, month or year x country and/or stock code, over a date range) is then answered from the cube alone,
+    the CSV is never read again. Cells are kept as three sorted arrays - an int64 key (day, country code, stock
+    code), the revenue and the row count - i.e. 24 bytes per (day, country, stock code) that had a sale.
+
+    Refresh is incremental: with a ResultCache, the cube of a file is stored with the file and only the rows
+    appended since are scanned and added to it (see QueryPlan.load_cached). The cubes of several files (years)
+    are combined with `merge`.
+
+    plan.register('rollup', RollupCube())
+    cube = plan.run()['rollup']
+    cube.query(granularity='month', by=['Country'])  # {('2015/01', 'India'): 1234.5, ...}
+    """
+    def __init__(self) -> None:
+        # value -> code
+        self._countries: Dict[str, int] = {}
+        self._stock_codes: Dict[str, int] = {}
+
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._revenue = np.zeros(0, dtype=np.float64)
+        self._n_rows = np.zeros(0, dtype=np.int64)
+
+        # partial cells not merged into the sorted arrays yet, compacted in bulk
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._n_pending = 0
+
+        # rows of the row by row engine, added in batches
+        self._rows: List[Tuple[int, int, int, float]] = []
+        self._days: Dict[str, int] = {}
+
+    def get_column_names(self) -> List[str]:
+        return [constants.OutDataColNames.DATE, constants.OutDataColNames.COUNTRY,
+                constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.TOTAL_PRICE]
+
+    def get_n_cells(self) -> int:
+        self._compact()
+        return len(self._keys)
+
+    def get_countries(self) -> List[str]:
+        return list(self._countries.keys())
+
+    def get_stock_codes(self) -> List[str]:
+        return list(self._stock_codes.keys())
+
+    @staticmethod
+    def to_day(val: str) -> int:
+        try:
+            return (datetime.strptime(val, constants.DATE_FORMAT) - datetime(1970, 1, 1)).days
+        except (TypeError, ValueError):
+            return -1
+
+    @staticmethod
+    def _to_codes(values: List[str], value_to_code: Dict[str, int]) -> np.ndarray:
+        return np.array([value_to_code.setdefault(val, len(value_to_code)) for val in values], dtype=np.int64)
+
+    def _add(self, days: np.ndarray, countries: np.ndarray, stock_codes: np.ndarray, revenue: np.ndarray,
+             n_rows: np.ndarray = None) -> None:
+        keep = days >= 0
+        keys = (days[keep] << DAY_SHIFT) | (countries[keep] << STOCK_BITS) | stock_codes[keep]
+        revenue = revenue[keep]
+        n_rows = np.ones(len(keys), dtype=np.int64) if n_rows is None else n_rows[keep]
+
+        # cells of the batch first, the pending lists stay about the size of the cube
+        keys, inverse = np.unique(keys, return_inverse=True)
+        self._pending.append((keys, np.bincount(inverse, weights=revenue, minlength=len(keys)),
+                              np.bincount(inverse, weights=n_rows, minlength=len(keys)).astype(np.int64)))
+        self._n_pending += len(keys)
+
+        if self._n_pending > max(len(self._keys), 1 << 20):
+            self._compact()
+
+    def _add_rows(self) -> None:
+        if not self._rows:
+            return
+
+        days, countries, stock_codes, revenue = zip(*self._rows)
+        self._rows = []
+        self._add(days=np.array(days, dtype=np.int64), countries=np.array(countries, dtype=np.int64),
+                  stock_codes=np.array(stock_codes, dtype=np.int64), revenue=np.array(revenue, dtype=np.float64))
+
+    def _compact(self) -> None:
+        self._add_rows()
+        if not self._pending:
+            return
+
+        keys = np.concatenate([self._keys] + [keys for keys, _, _ in self._pending])
+        revenue = np.concatenate([self._revenue] + [revenue for _, revenue, _ in self._pending])
+        n_rows = np.concatenate([self._n_rows] + [n_rows for _, _, n_rows in self._pending])
+        self._pending, self._n_pending = [], 0
+
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._revenue = np.bincount(inverse, weights=revenue, minlength=len(self._keys))
+        self._n_rows = np.bincount(inverse, weights=n_rows, minlength=len(self._keys)).astype(np.int64)
+
+    def consume(self, row: Dict) -> None:
+        date = row[constants.OutDataColNames.DATE]
+        if date not in self._days:
+            self._days[date] = self.to_day(date)
+
+        self._rows.append((self._days[date],
+                           self._countries.setdefault(row[constants.OutDataColNames.COUNTRY], len(self._countries)),
+                           self._stock_codes.setdefault(row[constants.OutDataColNames.STOCK_CODE],
+                                                        len(self._stock_codes)),
+                           self.to_float(row[constants.OutDataColNames.TOTAL_PRICE]) or 0.0))
+        if len(self._rows) >= 1 << 16:
+            self._add_rows()
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        # every distinct value of a chunk is converted once, the rows only go through the lookups
+        date_codes, dates = chunk.factorize(constants.OutDataColNames.DATE)
+        country_codes, countries = chunk.factorize(constants.OutDataColNames.COUNTRY)
+        stock_codes, stocks = chunk.factorize(constants.OutDataColNames.STOCK_CODE)
+
+        days = np.array([self.to_day(val) for val in dates], dtype=np.int64)
+        self._add(days=days[date_codes] if len(days) > 0 else np.zeros(0, dtype=np.int64),
+                  countries=self._to_codes(countries, self._countries)[country_codes],
+                  stock_codes=self._to_codes(stocks, self._stock_codes)[stock_codes],
+                  revenue=np.nan_to_num(chunk.get_column(constants.OutDataColNames.TOTAL_PRICE)
+                                        .astype(np.float64), nan=0.0))
+
+    def merge(self, other: 'RollupCube') -> None:
+        other._compact()
+        days, countries, stock_codes = other._decode(other._keys)
+
+        # codes of the other cube are remapped to the codes of this one
+        self._add(days=days,
+                  countries=self._to_codes(other.get_countries(), self._countries)[countries]
+                  if len(countries) > 0 else countries,
+                  stock_codes=self._to_codes(other.get_stock_codes(), self._stock_codes)[stock_codes]
+                  if len(stock_codes) > 0 else stock_codes,
+                  revenue=other._revenue, n_rows=other._n_rows)
+
+    def result(self) -> 'RollupCube':
+        return self
+
+    def __getstate__(self) -> Dict:
+        # pickled (e.g. in the ResultCache) without pending cells
+        self._compact()
+        return self.__dict__
+
+    @staticmethod
+    def _decode(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return keys >> DAY_SHIFT, (keys >> STOCK_BITS) & ((1 << COUNTRY_BITS) - 1), keys & ((1 << STOCK_BITS) - 1)
+
+    @staticmethod
+    def _to_periods(days: np.ndarray, granularity: str) -> Tuple[np.ndarray, List[str]]:
+        """
+        :return: period of every day as an integer and the label of every period (indexed by its integer)
+        """
+        dates = days.astype('datetime64[D]')
+        if granularity == 'day':
+            periods = dates
+        elif granularity == 'week':
+            # weeks start on Monday, 1970/01/01 was a Thursday
+            periods = dates - ((days + 3) % 7).astype('timedelta64[D]')
+        elif granularity == 'month':
+            periods = dates.astype('datetime64[M]')
+        elif granularity == 'year':
+            periods = dates.astype('datetime64[Y]')
+        else:
+            raise ValueError(f'`granularity` should be one of {GRANULARITIES} or None')
+
+        uniques, inverse = np.unique(periods, return_inverse=True)
+        # ISO dates, months and years as in DATE_FORMAT, e.g. 2015/04/06, 2015/04 and 2015
+        return inverse, [str(period).replace('-', '/') for period in uniques]
+
+    def query(self, granularity: str = 'month', by: List[str] = None, start_date: str = None,
+              end_date: str = None, measure: str = 'revenue') -> Dict[tuple, float]:
+        """
+        Roll the cube up to a coarser level
+
+        :param granularity: one of GRANULARITIES, None for the whole date range
+        :param by: dimensions to keep, any of DIMENSIONS (Country, StockCode), the others are summed up
+        :param start_date: first day to include (`DATE_FORMAT`), None for no lower bound
+        :param end_date: last day to include (`DATE_FORMAT`), None for no upper bound
+        :param measure: 'revenue' or 'n_rows'
+        :return: Dict with the tuple (period, *dimension values) as key (no period when granularity is None)
+        """
+        by = by or []
+        if any([dimension not in DIMENSIONS for dimension in by]):
+            raise ValueError(f'`by` should only have dimensions among {DIMENSIONS}')
+        for name, date in [('start_date', start_date), ('end_date', end_date)]:
+            if date is not None and self.to_day(date) < 0:
+                raise ValueError(f'`{name}` should be a date in the {constants.DATE_FORMAT} format, not {date!r}')
+        self._compact()
+
+        # the keys are sorted by day first, a date range is a slice of the cube
+        start = 0 if start_date is None else np.searchsorted(self._keys, self.to_day(start_date) << DAY_SHIFT)
+        end = len(self._keys) if end_date is None else \
+            np.searchsorted(self._keys, (self.to_day(end_date) + 1) << DAY_SHIFT)
+        keys = self._keys[start:end]
+        values = (self._revenue if measure == 'revenue' else self._n_rows)[start:end]
+        days, countries, stock_codes = self._decode(keys)
+
+        group_columns, group_labels = [], []
+        if granularity is not None:
+            periods, labels = self._to_periods(days, granularity)
+            group_columns.append(periods)
+            group_labels.append(labels)
+        for dimension in by:
+            if dimension == constants.OutDataColNames.COUNTRY:
+                group_columns.append(countries)
+                group_labels.append(self.get_countries())
+            else:
+                group_columns.append(stock_codes)
+                group_labels.append(self.get_stock_codes())
+
+        if not group_columns:
+            return {(): float(values.sum()) if measure == 'revenue' else int(values.sum())}
+
+        groups, inverse = np.unique(np.stack(group_columns, axis=1), axis=0, return_inverse=True)
+        totals = np.bincount(inverse.reshape(-1), weights=values, minlength=len(groups))
+
+        cast = float if measure == 'revenue' else int
+        return {tuple(labels[code] for labels, code in zip(group_labels, group.tolist())): cast(total)
+                for group, total in zip(groups, totals.tolist())}
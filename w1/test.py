@@ -1,6 +1,19 @@
 import os
+import pickle
+import pytest
+import numpy as np
 from w1.main import get_sales_information
-from w1.utils import DataReader
+from w1.utils import DataReader, Stats, HyperLogLog
+from w1.data_processor import DataProcessor
+from w1.index import FileIndex
+from w1.engine import QueryPlan, DescribeOperator, AggregateOperator, GroupByOperator, HashAggregateOperator, \
+    DistinctCountOperator
+from w1.cache import ColumnarCache
+from w1.result_cache import ResultCache
+from w1.profiler import profiler
+from w1.predicate import And, Between, Equals
+from w1.rollup import RollupCube
+from w1.topk import TopKOperator, SpaceSaving
 import constants
 from global_utils import blockPrint, enablePrint
 from pprint import pprint
@@ -35,13 +48,15 @@ def test_data_reader():
     pprint(row_1)
 
 
-def test_revenue_per_region():
+def test_revenue_per_region(tmp_path):
     blockPrint()
     data_folder_path = os.path.join(CURRENT_FOLDER, '..', constants.DATA_FOLDER_NAME, 'tst')
     files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
 
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
-    revenue_data = [{'file_path': file_path, 'revenue_data': get_sales_information(file_path)}
+    result_cache = ResultCache(cache_path=str(tmp_path))
+    revenue_data = [{'file_path': file_path, 'revenue_data': get_sales_information(file_path,
+                                                                                   result_cache=result_cache)}
                     for file_path in file_paths]
     enablePrint()
 
@@ -50,3 +65,495 @@ def test_revenue_per_region():
     assert all([len(each) > 0 for each in revenue_data])
 
     pprint(revenue_data)
+
+
+def test_fused_plan(tmp_path):
+    blockPrint()
+    dp = DataProcessor(file_path=os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv'),
+                       result_cache=ResultCache(cache_path=str(tmp_path)))
+
+    # every operator is fed by the same scan of the file
+    plan = dp.new_plan()
+    plan.register('describe', DescribeOperator(column_names=[constants.OutDataColNames.TOTAL_PRICE]))
+    plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+    plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                        value_column=constants.OutDataColNames.TOTAL_PRICE))
+    results = dp.run_plan(plan)
+
+    total_revenue = dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE)
+    enablePrint()
+
+    assert results['total_revenue'] == total_revenue
+    assert abs(sum(results['revenue_per_region'].values()) - total_revenue) < 1e-3
+    assert results['describe'][constants.OutDataColNames.TOTAL_PRICE].get_stats()['max'] > 0
+
+
+def test_columnar_plan():
+    blockPrint()
+    dp = DataProcessor(file_path=os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv'))
+
+    results = {}
+    for columnar in [True, False]:
+        # no result cache, both engines scan the file
+        plan = QueryPlan(data_reader=dp.data_reader)
+        plan.register('describe', DescribeOperator(column_names=[constants.OutDataColNames.UNIT_PRICE]))
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                            value_column=constants.OutDataColNames.TOTAL_PRICE))
+        results[columnar] = plan.run(columnar=columnar)
+    enablePrint()
+
+    # columnar and row engines should agree up to floating point summation order
+    assert abs(results[True]['total_revenue'] - results[False]['total_revenue']) < 1e-3
+    assert results[True]['revenue_per_region'].keys() == results[False]['revenue_per_region'].keys()
+    assert all([abs(results[True]['revenue_per_region'][country] - revenue) < 1e-3
+                for country, revenue in results[False]['revenue_per_region'].items()])
+    columnar_stats = results[True]['describe'][constants.OutDataColNames.UNIT_PRICE].get_stats()
+    row_stats = results[False]['describe'][constants.OutDataColNames.UNIT_PRICE].get_stats()
+    assert all([abs(columnar_stats[name] - row_stats[name]) < 1e-6 for name in ['min', 'max', 'mean', 'std']])
+
+
+def test_stats_merge():
+    vals = np.random.default_rng(42).lognormal(size=200000)
+
+    # stats of two halves merged should match the stats of the whole
+    first, second = Stats(), Stats()
+    first.update_stats_batch(vals[:100000])
+    for val in vals[100000:101000]:
+        second.update_stats(val=val)
+    second.update_stats_batch(vals[101000:])
+    stats = first.merge(second).get_stats()
+
+    assert stats['min'] == vals.min() and stats['max'] == vals.max()
+    assert abs(stats['mean'] - vals.mean()) < 1e-9
+    assert abs(stats['std'] - np.std(vals)) < 1e-9
+
+    # percentiles are approximate, check the rank error
+    for name, q in [('25', 0.25), ('median', 0.5), ('75', 0.75)]:
+        assert abs((vals <= stats[name]).mean() - q) < 0.02
+
+
+def test_file_index(tmp_path):
+    file_path = os.path.join(tmp_path, '2016.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2016.csv')) as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines)
+
+    index = FileIndex(fp=file_path).load()
+
+    assert index.get_header() == lines[0].rstrip('\n')
+    assert index.get_n_rows() == len(lines) - 1
+
+    # byte ranges cover every row exactly once
+    n_rows = 0
+    data_reader = DataReader(fp=file_path, sep=',', col_names=index.get_header().split(','))
+    with open(file_path, 'rb') as f:
+        for start, end in data_reader.get_byte_ranges(n_ranges=7):
+            f.seek(start)
+            n_rows += f.read(end - start).count(b'\n')
+    assert n_rows == index.get_n_rows()
+
+    # the sidecar is reused while the file is unchanged, and extended over the rows appended to it
+    index_mtime_ns = os.stat(FileIndex.get_index_path(file_path)).st_mtime_ns
+    assert FileIndex(fp=file_path).load().get_n_rows() == index.get_n_rows()
+    assert os.stat(FileIndex.get_index_path(file_path)).st_mtime_ns == index_mtime_ns
+    with open(file_path, 'a') as f:
+        f.writelines(lines[1:101])
+    assert FileIndex(fp=file_path).load().get_n_rows() == index.get_n_rows() + 100
+    assert sorted(os.listdir(tmp_path)) == ['2016.csv', '2016.csv.idx']
+
+
+def test_columnar_cache(tmp_path):
+    file_path = os.path.join(tmp_path, '2015.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')) as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:5001])
+
+    blockPrint()
+    results = {}
+    for use_cache in [True, False]:
+        plan = QueryPlan(data_reader=DataReader(fp=file_path, sep=',', col_names=lines[0].rstrip('\n').split(',')),
+                         use_cache=use_cache)
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                            value_column=constants.OutDataColNames.TOTAL_PRICE))
+        results[use_cache] = plan.run()
+    enablePrint()
+
+    assert results[True] == results[False]
+
+    # every column is cached, dictionary encoded columns decode back to the original values
+    cache = ColumnarCache(fp=file_path).load()
+    assert cache.get_n_rows() == 5000
+    chunk = next(cache.iter_chunks(column_names=[constants.OutDataColNames.DESCRIPTION,
+                                                 constants.OutDataColNames.INVOICE_NO]))
+    codes = chunk.get_column(constants.OutDataColNames.DESCRIPTION)
+    assert chunk.get_categories(constants.OutDataColNames.DESCRIPTION)[codes[10]] == lines[11].split(',')[1]
+    assert chunk.get_column(constants.OutDataColNames.INVOICE_NO)[10] == lines[11].split(',')[6]
+
+    # the cache is invalidated when the file changes
+    with open(file_path, 'a') as f:
+        f.writelines(lines[5001:5101])
+    assert ColumnarCache(fp=file_path).load() is None
+    assert ColumnarCache(fp=file_path).load_or_build().get_n_rows() == 5100
+
+    # a rebuild replaces the folder as a whole, a cache loaded before keeps reading its own version
+    assert len(cache.get_column(constants.OutDataColNames.INVOICE_NO)) == 5000
+    assert sorted(os.listdir(tmp_path)) == ['2015.csv', '2015.csv.cols']
+
+
+def test_result_cache(tmp_path):
+    file_path = os.path.join(tmp_path, '2015.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')) as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:5001])
+
+    result_cache = ResultCache(cache_path=os.path.join(tmp_path, 'results'), max_entries=2)
+    data_reader = DataReader(fp=file_path, sep=',', col_names=lines[0].rstrip('\n').split(','))
+
+    def run():
+        n_scans = []
+        plan = QueryPlan(data_reader=data_reader, result_cache=result_cache)
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                            value_column=constants.OutDataColNames.TOTAL_PRICE))
+        return plan.run(progress_callback=n_scans.append, progress_bar=False), len(n_scans)
+
+    results, n_chunks = run()
+    cached_results, n_cached_chunks = run()
+
+    # the rerun on the unchanged file does not scan it
+    assert n_chunks > 0 and n_cached_chunks == 0
+    assert cached_results == results
+
+    # rows appended to the file - only the new rows are scanned and merged into the cached results
+    with open(file_path, 'a') as f:
+        f.writelines(lines[5001:5101])
+    appended_results, n_chunks = run()
+    full_scan = QueryPlan(data_reader=data_reader)
+    full_scan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+    expected = full_scan.run(progress_bar=False)
+    assert n_chunks == 0
+    assert abs(appended_results['total_revenue'] - expected['total_revenue']) < 1e-6
+    assert FileIndex(fp=file_path).load().get_n_rows() == 5100
+
+    # a rewritten file is scanned again, its entries replace the old ones
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:3001])
+    new_results, n_chunks = run()
+    assert n_chunks > 0 and new_results['total_revenue'] < results['total_revenue']
+    assert len(result_cache.get_entries()) == 2
+
+    # entries of operators computed by another version of their code are stale, as are foreign pickles
+    entry_path, _, _ = result_cache.get_entries()[-1]
+    with open(entry_path, 'rb') as f:
+        entry = pickle.load(f)
+    assert list(entry['code_hashes'].keys()) == ['w1.engine']
+    with open(entry_path, 'wb') as f:
+        pickle.dump(dict(entry, code_hashes={'w1.engine': 'old'}), f)
+    _, n_chunks = run()
+    assert n_chunks > 0
+    with open(entry_path, 'wb') as f:
+        pickle.dump({'file_size': entry['file_size']}, f)
+    _, n_chunks = run()
+    assert n_chunks > 0
+
+    # the state of an operator is versioned with the code of its classes, e.g. the Stats of DescribeOperator
+    describe = DescribeOperator(column_names=[constants.OutDataColNames.TOTAL_PRICE])
+    result_cache.put(fp=file_path, key=describe.get_cache_key(), operator=describe)
+    entry_path, _, _ = result_cache.get_entries()[-1]
+    with open(entry_path, 'rb') as f:
+        assert set(pickle.load(f)['code_hashes'].keys()) == {'w1.engine', 'w1.utils'}
+
+    # rows appended during a scan (the last one half written) are left to the next run, never counted twice
+    for use_cache, columnar in [(False, True), (True, True), (False, False)]:
+        with open(file_path, 'w') as f:
+            f.writelines(lines[:2001])
+        appending_cache = ResultCache(cache_path=os.path.join(tmp_path, f'appending_{use_cache}_{columnar}'))
+
+        def append_rows(row_num):
+            if row_num == 0:
+                with open(file_path, 'a') as f:
+                    f.writelines(lines[2001:2101] + [lines[2101][:10]])
+
+        for progress_callback in [append_rows, None]:
+            plan = QueryPlan(data_reader=data_reader, use_cache=use_cache, result_cache=appending_cache)
+            plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+            total_revenue = plan.run(progress_callback=progress_callback, columnar=columnar,
+                                     progress_bar=False)['total_revenue']
+            if progress_callback is not None:
+                with open(file_path, 'a') as f:
+                    f.write(lines[2101][10:])
+
+        assert abs(total_revenue - sum([float(line.split(',')[4]) for line in lines[1:2102]])) < 1e-6
+
+
+def test_profiler():
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    data_reader = DataReader(fp=file_path, sep=',', col_names=FileIndex(fp=file_path).load().get_header().split(','))
+
+    def run():
+        plan = QueryPlan(data_reader=data_reader, use_cache=False)
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        return plan.run(progress_bar=False)
+
+    # disabled - nothing is recorded
+    profiler.reset()
+    run()
+    assert profiler.get_report() == {'stages': {}, 'counters': {}}
+
+    profiler.enable()
+    try:
+        run()
+        # values that are not numbers are counted as parse failures
+        vals = data_reader._to_float_array(['1.5', 'x', ''])
+        report = profiler.get_report()
+    finally:
+        profiler.disable()
+        profiler.reset()
+
+    assert report['counters']['rows_parsed'] == FileIndex(fp=file_path).load().get_n_rows()
+    assert report['counters']['bytes_read'] > 0
+    assert report['counters']['parse_failures'] == 2 and np.isnan(vals).sum() == 2
+    assert all([report['stages'][name]['calls'] > 0 and report['stages'][name]['seconds'] >= 0
+                for name in ['read', 'parse', 'consume']])
+
+
+def test_predicate_pushdown(tmp_path):
+    file_path = os.path.join(tmp_path, '2015.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')) as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:20001])
+
+    col_names = lines[0].rstrip('\n').split(',')
+    rows = [dict(zip(col_names, line.rstrip('\n').split(','))) for line in lines[1:20001]]
+    data_reader = DataReader(fp=file_path, sep=',', col_names=col_names)
+    predicate = And([Equals(constants.OutDataColNames.COUNTRY, 'India'),
+                     Between(constants.OutDataColNames.DATE, '2015/02/01', '2015/03/31')])
+    expected = sum([float(row[constants.OutDataColNames.TOTAL_PRICE]) for row in rows
+                    if row[constants.OutDataColNames.COUNTRY] == 'India' and
+                    '2015/02/01' <= row[constants.OutDataColNames.DATE] <= '2015/03/31'])
+
+    # only the projected columns are returned, only for the rows that match
+    projected = list(data_reader.iter_rows(column_names=[constants.OutDataColNames.TOTAL_PRICE], predicate=predicate))
+    assert all([list(row.keys()) == [constants.OutDataColNames.TOTAL_PRICE] for row in projected])
+    assert abs(sum([float(row[constants.OutDataColNames.TOTAL_PRICE]) for row in projected]) - expected) < 1e-6
+
+    def run(**kwargs):
+        plan = QueryPlan(data_reader=data_reader, predicate=predicate)
+        plan.register('total_revenue', AggregateOperator(column_name=constants.OutDataColNames.TOTAL_PRICE))
+        return plan.run(progress_bar=False, **kwargs)['total_revenue']
+
+    # row engine, CSV chunks, columnar cache (built on the first whole file scan)
+    assert abs(run(columnar=False) - expected) < 1e-6
+    assert abs(run(byte_range=data_reader.get_byte_ranges(1)[0]) - expected) < 1e-6
+    assert abs(run() - expected) < 1e-6
+
+    numbers = list(data_reader.iter_rows(predicate=Between(constants.OutDataColNames.TOTAL_PRICE, low=100)))
+    assert len(numbers) > 0 and all([float(row[constants.OutDataColNames.TOTAL_PRICE]) >= 100 for row in numbers])
+
+
+def test_rollup_cube(tmp_path):
+    file_path = os.path.join(tmp_path, '2015.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')) as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:10001])
+
+    result_cache = ResultCache(cache_path=os.path.join(tmp_path, 'results'))
+    data_reader = DataReader(fp=file_path, sep=',', col_names=lines[0].rstrip('\n').split(','))
+
+    def run():
+        n_scans = []
+        plan = QueryPlan(data_reader=data_reader, result_cache=result_cache)
+        plan.register('rollup', RollupCube())
+        plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                            value_column=constants.OutDataColNames.TOTAL_PRICE))
+        results = plan.run(progress_callback=n_scans.append, progress_bar=False)
+        return results['rollup'], results['revenue_per_region'], len(n_scans)
+
+    cube, revenue_per_region, _ = run()
+
+    # coarser levels are rolled up from the cube
+    by_country = cube.query(granularity=None, by=[constants.OutDataColNames.COUNTRY])
+    assert all([abs(by_country[(country,)] - total) < 1e-6 for country, total in revenue_per_region.items()])
+    by_month = cube.query(granularity='month', by=[constants.OutDataColNames.COUNTRY])
+    assert abs(sum(by_month.values()) - sum(revenue_per_region.values())) < 1e-6
+    assert all([len(month) == len('2015/01') for month, _ in by_month.keys()])
+    march = cube.query(granularity='week', start_date='2015/03/01', end_date='2015/03/31')
+    expected = sum([float(line.split(',')[4]) for line in lines[1:10001]
+                    if '2015/03/01' <= line.rstrip('\n').split(',')[7] <= '2015/03/31'])
+    assert abs(sum(march.values()) - expected) < 1e-6
+    with pytest.raises(ValueError):
+        cube.query(granularity='week', start_date='2015-03-01')
+
+    # rows appended to the file are added to the cached cube without a full scan
+    with open(file_path, 'a') as f:
+        f.writelines(lines[10001:10501])
+    refreshed, revenue_per_region, n_chunks = run()
+    assert n_chunks == 0
+    assert abs(refreshed.query(granularity=None)[()] - sum(revenue_per_region.values())) < 1e-6
+    assert refreshed.query(granularity=None, measure='n_rows')[()] == 10500
+
+    # cubes of several files are merged
+    merged = RollupCube()
+    merged.merge(cube)
+    merged.merge(refreshed)
+    assert abs(merged.query(granularity='year')[('2015',)] -
+               cube.query(granularity=None)[()] - refreshed.query(granularity=None)[()]) < 1e-6
+
+
+def test_group_by(tmp_path):
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    with open(file_path) as f:
+        rows = [line.rstrip('\n').split(',') for line in f.readlines()[1:]]
+
+    expected = {}
+    for row in rows:
+        expected.setdefault((row[5], row[0]), []).append(float(row[4]))
+
+    dp = DataProcessor(file_path=file_path, result_cache=ResultCache(cache_path=str(tmp_path)))
+    results = dp.group_by(keys=[constants.OutDataColNames.COUNTRY, constants.OutDataColNames.STOCK_CODE],
+                          aggs={constants.OutDataColNames.TOTAL_PRICE: ['sum', 'count', 'mean', min, max]})
+
+    assert results.keys() == expected.keys()
+    for key, vals in expected.items():
+        aggregates = results[key][constants.OutDataColNames.TOTAL_PRICE]
+        assert abs(aggregates['sum'] - sum(vals)) < 1e-6 and aggregates['count'] == len(vals)
+        assert abs(aggregates['mean'] - sum(vals) / len(vals)) < 1e-6
+        assert aggregates['min'] == min(vals) and aggregates['max'] == max(vals)
+
+    # row engine, small chunks merged together and a single key
+    data_reader = dp.data_reader
+    operators = []
+    for columnar in [False, True]:
+        plan = QueryPlan(data_reader=data_reader, use_cache=False)
+        operators.append(plan.register('group_by', HashAggregateOperator(
+            keys=[constants.OutDataColNames.COUNTRY], aggs={constants.OutDataColNames.TOTAL_PRICE: ['sum', 'max']})))
+        plan.run(columnar=columnar, progress_bar=False)
+    operators[0].merge(operators[1])
+    by_country = operators[0].result()
+    revenue_per_region = dp.group_by(keys=[constants.OutDataColNames.COUNTRY],
+                                     aggs={constants.OutDataColNames.TOTAL_PRICE: ['sum']})
+    assert all([abs(by_country[country][constants.OutDataColNames.TOTAL_PRICE]['sum'] -
+                    2 * aggregates[constants.OutDataColNames.TOTAL_PRICE]['sum']) < 1e-6
+                for country, aggregates in revenue_per_region.items()])
+
+    # numeric keys are numbers in both engines, their partial results merge into the same groups
+    operators = []
+    for columnar in [False, True]:
+        plan = QueryPlan(data_reader=data_reader, use_cache=False)
+        operators.append(plan.register('group_by', HashAggregateOperator(
+            keys=[constants.OutDataColNames.QUANTITY], aggs={constants.OutDataColNames.TOTAL_PRICE: ['count']})))
+        plan.run(columnar=columnar, progress_bar=False)
+    assert operators[0].result() == operators[1].result()
+    assert sorted(operators[0].result().keys()) == sorted({int(row[3]) for row in rows})
+
+    operators[0].merge(operators[1])
+    assert operators[0].get_n_groups() == operators[1].get_n_groups()
+
+
+def test_top_k():
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    with open(file_path) as f:
+        rows = [line.rstrip('\n').split(',') for line in f.readlines()[1:]]
+
+    expected = {}
+    for row in rows:
+        totals = expected.setdefault(row[5], {})
+        totals[row[0]] = totals.get(row[0], 0.0) + float(row[4])
+
+    def run(**kwargs):
+        data_reader = DataReader(fp=file_path, sep=',', col_names=FileIndex(fp=file_path).load().get_header().split(','))
+        operators = []
+        # two halves of the file, merged
+        for byte_range in data_reader.get_byte_ranges(2):
+            plan = QueryPlan(data_reader=data_reader, use_cache=False)
+            operators.append(plan.register('top', TopKOperator(
+                key_column=constants.OutDataColNames.STOCK_CODE, value_column=constants.OutDataColNames.TOTAL_PRICE,
+                k=5, group_column=constants.OutDataColNames.COUNTRY, **kwargs)))
+            plan.run(byte_range=byte_range, progress_bar=False)
+        operators[0].merge(operators[1])
+        return operators[0]
+
+    exact, approximate = run(), run(approximate=True, capacity=200)
+    for country, totals in expected.items():
+        top = sorted(totals.values(), reverse=True)[:5]
+        assert [round(total, 6) for _, total in exact.result()[country]] == [round(total, 6) for total in top]
+
+        # the estimates are upper bounds of the true totals
+        assert all([total >= totals[key] - 1e-6 for key, total in approximate.result()[country]])
+        assert approximate.result()[country][0][0] == exact.result()[country][0][0]
+        assert approximate.estimate(exact.result()[country][0][0], group=country) >= top[0] - 1e-6
+
+    # bounded memory - at most `capacity` counters per country
+    summary = SpaceSaving(capacity=3)
+    summary.update_batch(['a', 'b', 'c', 'd'], np.array([10.0, 5.0, 3.0, 1.0]))
+    summary.update_batch(['d', 'e'], np.array([20.0, 2.0]))
+    assert [key for key, _, _ in summary.top(3)] == ['d', 'a', 'b'] and summary.get_floor() <= 41 / 3
+
+
+def test_distinct_count():
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    with open(file_path) as f:
+        rows = [line.rstrip('\n').split(',') for line in f.readlines()[1:]]
+
+    expected = {}
+    for row in rows:
+        invoices, stock_codes = expected.setdefault(row[5], (set(), set()))
+        invoices.add(row[6])
+        stock_codes.add(row[0])
+
+    column_names = [constants.OutDataColNames.INVOICE_NO, constants.OutDataColNames.STOCK_CODE]
+    data_reader = DataReader(fp=file_path, sep=',', col_names=FileIndex(fp=file_path).load().get_header().split(','))
+
+    operators = []
+    # two halves of the file, merged
+    for byte_range in data_reader.get_byte_ranges(2):
+        plan = QueryPlan(data_reader=data_reader, use_cache=False)
+        operators.append(plan.register('distinct', DistinctCountOperator(
+            column_names=column_names, group_column=constants.OutDataColNames.COUNTRY)))
+        plan.run(byte_range=byte_range, progress_bar=False)
+    operators[0].merge(operators[1])
+    counts = operators[0].result()
+
+    assert counts.keys() == expected.keys()
+    for country, (invoices, stock_codes) in expected.items():
+        for column_name, n_distinct in zip(column_names, [len(invoices), len(stock_codes)]):
+            # well within 4 standard errors, small counts are exact
+            assert abs(counts[country][column_name] - n_distinct) <= 4 * operators[0].get_error() * n_distinct
+            if n_distinct <= 512:
+                assert counts[country][column_name] == n_distinct
+
+    # the row by row engine hashes the same values
+    plan = QueryPlan(data_reader=data_reader, use_cache=False)
+    operator = plan.register('distinct', DistinctCountOperator(column_names=column_names,
+                                                               group_column=constants.OutDataColNames.COUNTRY))
+    plan.run(columnar=False, progress_bar=False)
+    assert operator.result() == counts
+
+    # distinct counts in describe, numbers are counted on their value
+    plan = QueryPlan(data_reader=data_reader, use_cache=False)
+    operator = plan.register('describe', DescribeOperator(
+        column_names=[constants.OutDataColNames.UNIT_PRICE] + column_names, count_distinct=True))
+    plan.run(progress_bar=False)
+    stats = {column_name: stats.get_stats() for column_name, stats in operator.result().items()}
+    for column_name, n_distinct in [(constants.OutDataColNames.UNIT_PRICE, len({float(row[2]) for row in rows})),
+                                    (constants.OutDataColNames.INVOICE_NO, len({row[6] for row in rows})),
+                                    (constants.OutDataColNames.STOCK_CODE, len({row[0] for row in rows}))]:
+        assert abs(stats[column_name]['distinct'] - n_distinct) <= 4 * stats[column_name]['distinct_error'] * n_distinct
+    assert stats[constants.OutDataColNames.UNIT_PRICE]['max'] == max([float(row[2]) for row in rows])
+
+    # exact until the threshold, then the sketch - mergeable either way
+    first, second = HyperLogLog(precision=12), HyperLogLog(precision=12)
+    first.update_batch(np.array([str(val) for val in range(100)]))
+    second.update_batch(np.array([str(val) for val in range(50, 150)]))
+    assert first.merge(second).count() == 150 and first.is_exact()
+
+    second.update_batch(np.arange(100000))
+    assert not second.is_exact() and abs(second.count() - 100100) <= 4 * second.get_error() * 100100
+    assert abs(first.merge(second).count() - 100150) <= 4 * first.get_error() * 100150
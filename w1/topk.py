@@ -0,0 +1,246 @@
+from typing import Dict, List, Tuple
+from operator import itemgetter
+from w1.engine import Operator
+from w1.utils import ColumnarChunk
+import numpy as np
+import heapq
+import zlib
+
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving summary - the heavy hitters of a stream in at most `capacity` counters
+
+    Every monitored key has a count that over-estimates its true weight by at most its error, and every key with
+    a weight over `get_floor()` is monitored. The floor is at most total weight / capacity, so with a capacity of
+    1000 any key with more than 0.1% of the total is found.
+
+    Summaries are mergeable (Agarwal et al., Mergeable Summaries): a key missing from one summary counts for the
+    floor of that summary, then only the `capacity` largest counts are kept. A batch of exact partial sums (e.g.
+    the revenue per stock code of a chunk) is merged the same way, with a floor of 0.
+    """
+    def __init__(self, capacity: int = 1000) -> None:
+        self._capacity = capacity
+        self._counts: Dict[str, float] = {}
+        self._errors: Dict[str, float] = {}
+        # upper bound of the weight of any key that is not monitored
+        self._floor = 0.0
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def get_floor(self) -> float:
+        return self._floor
+
+    def _combine(self, counts: Dict[str, float], errors: Dict[str, float], floor: float) -> None:
+        combined_counts, combined_errors = {}, {}
+        for key in self._counts.keys() | counts.keys():
+            combined_counts[key] = self._counts.get(key, self._floor) + counts.get(key, floor)
+            combined_errors[key] = self._errors.get(key, self._floor) + errors.get(key, floor)
+
+        self._floor += floor
+        if len(combined_counts) > self._capacity:
+            kept = heapq.nlargest(self._capacity + 1, combined_counts.items(), key=itemgetter(1))
+            # the largest count that is dropped bounds every key that is not monitored any more
+            self._floor = max(self._floor, kept.pop()[1])
+            combined_counts = dict(kept)
+            combined_errors = {key: combined_errors[key] for key in combined_counts}
+
+        self._counts, self._errors = combined_counts, combined_errors
+
+    def update_batch(self, keys: List[str], weights: np.ndarray) -> None:
+        """
+        :param keys: distinct keys
+        :param weights: exact total weight of every key in the batch
+        """
+        self._combine(counts=dict(zip(keys, weights.tolist())), errors={}, floor=0.0)
+
+    def merge(self, other: 'SpaceSaving') -> None:
+        self._combine(counts=other._counts, errors=other._errors, floor=other._floor)
+
+    def top(self, k: int) -> List[Tuple[str, float, float]]:
+        """
+        :return: (key, count, error) of the `k` largest counts, the true weight is in [count - error, count]
+        """
+        return [(key, count, self._errors[key])
+                for key, count in heapq.nlargest(k, self._counts.items(), key=itemgetter(1))]
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch - over-estimates the weight of any key by at most e / width * total weight, with probability
+    1 - exp(-depth), in depth x width floats. Keys are hashed with CRC32 so that sketches built in different
+    processes can be merged (added up).
+    """
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        self._width = width
+        self._depth = depth
+        self._table = np.zeros((depth, width), dtype=np.float64)
+
+    def _indexes(self, keys: List[str]) -> np.ndarray:
+        encoded = [str(key).encode() for key in keys]
+        return np.array([[zlib.crc32(key, seed) % self._width for key in encoded] for seed in range(self._depth)],
+                        dtype=np.int64).reshape(self._depth, len(keys))
+
+    def update_batch(self, keys: List[str], weights: np.ndarray) -> None:
+        indexes = self._indexes(keys)
+        for row in range(self._depth):
+            self._table[row] += np.bincount(indexes[row], weights=weights, minlength=self._width)
+
+    def estimate(self, key: str) -> float:
+        indexes = self._indexes([key])[:, 0]
+        return float(self._table[np.arange(self._depth), indexes].min())
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if self._table.shape != other._table.shape:
+            raise ValueError('Only sketches of the same width and depth can be merged')
+        self._table += other._table
+
+
+class TopKOperator(Operator):
+    """
+    Top `k` keys (e.g. StockCode or Description) by total of a value column (by number of rows if None),
+    optionally per group (e.g. per Country)
+
+    Every chunk is first aggregated per (group, key) with `np.bincount`, only the partial sums reach the
+    per group state:
+    - exact: the total of every key, the top k are picked with a heap at the end - memory grows with the number
+      of distinct keys
+    - approximate: a SpaceSaving summary of `capacity` counters and a CountMinSketch per group - memory is bounded
+      whatever the number of distinct keys, the weights of the top k are upper bounds (the smallest of the two
+      estimates)
+
+    Operators over different chunks, byte ranges or files (e.g. all the years) are combined with `merge`.
+
+    TopKOperator(key_column='StockCode', value_column='TotalPrice', k=20, group_column='Country').result()
+    # {'India': [('22180', 1234.5), ...], ...}
+    """
+    def __init__(self, key_column: str, value_column: str = None, k: int = 10, group_column: str = None,
+                 approximate: bool = False, capacity: int = 1000, cm_width: int = 2048, cm_depth: int = 4) -> None:
+        self._key_column = key_column
+        self._value_column = value_column
+        self._k = k
+        self._group_column = group_column
+        self._approximate = approximate
+        self._capacity = max(capacity, k)
+        self._cm_width = cm_width
+        self._cm_depth = cm_depth
+
+        # group value (None without group column) -> exact totals or (SpaceSaving, CountMinSketch)
+        self._groups: Dict = {}
+        # rows of the row by row engine, aggregated in batches
+        self._rows: Dict[Tuple, float] = {}
+
+    def get_column_names(self) -> List[str]:
+        return [column_name for column_name in [self._group_column, self._key_column, self._value_column]
+                if column_name is not None]
+
+    def get_cache_key(self) -> str:
+        mode = f'approximate,{self._capacity},{self._cm_width}x{self._cm_depth}' if self._approximate else 'exact'
+        return f'{type(self).__name__}({",".join(self.get_column_names())}|{self._k}|{mode})'
+
+    def _update(self, group, keys: List[str], weights: np.ndarray) -> None:
+        if self._approximate:
+            if group not in self._groups:
+                self._groups[group] = (SpaceSaving(capacity=self._capacity),
+                                       CountMinSketch(width=self._cm_width, depth=self._cm_depth))
+            summary, sketch = self._groups[group]
+            summary.update_batch(keys, weights)
+            sketch.update_batch(keys, weights)
+        else:
+            totals = self._groups.setdefault(group, {})
+            for key, weight in zip(keys, weights.tolist()):
+                totals[key] = totals.get(key, 0.0) + weight
+
+    def consume(self, row: Dict) -> None:
+        group = row[self._group_column] if self._group_column is not None else None
+        weight = 1.0 if self._value_column is None else (self.to_float(row[self._value_column]) or 0.0)
+
+        key = (group, row[self._key_column])
+        self._rows[key] = self._rows.get(key, 0.0) + weight
+        if len(self._rows) >= 1 << 16:
+            self._consume_rows()
+
+    def _consume_rows(self) -> None:
+        rows, self._rows = self._rows, {}
+
+        batches: Dict = {}
+        for (group, key), weight in rows.items():
+            batches.setdefault(group, ([], []))
+            batches[group][0].append(key)
+            batches[group][1].append(weight)
+
+        for group, (keys, weights) in batches.items():
+            self._update(group, keys, np.array(weights, dtype=np.float64))
+
+    def consume_chunk(self, chunk: ColumnarChunk) -> None:
+        self._consume_rows()
+        key_codes, keys = chunk.factorize(self._key_column)
+        weights = np.ones(chunk.get_n_rows(), dtype=np.float64) if self._value_column is None else \
+            np.nan_to_num(chunk.get_column(self._value_column).astype(np.float64), nan=0.0)
+
+        if self._group_column is None:
+            group_codes, groups = np.zeros(chunk.get_n_rows(), dtype=np.int64), [None]
+        else:
+            group_codes, groups = chunk.factorize(self._group_column)
+
+        # partial aggregation of the chunk per (group, key)
+        index = group_codes.astype(np.int64) * len(keys) + key_codes
+        totals = np.bincount(index, weights=weights, minlength=len(groups) * len(keys))
+        present = np.bincount(index, minlength=len(groups) * len(keys)) > 0
+
+        for group_code, group in enumerate(groups):
+            group_present = present[group_code * len(keys):(group_code + 1) * len(keys)]
+            if not group_present.any():
+                continue
+
+            inds = np.flatnonzero(group_present)
+            self._update(group, [keys[ind] for ind in inds.tolist()],
+                         totals[group_code * len(keys):(group_code + 1) * len(keys)][inds])
+
+    def merge(self, other: 'TopKOperator') -> None:
+        self._consume_rows()
+        other._consume_rows()
+
+        for group, state in other._groups.items():
+            if self._approximate:
+                if group not in self._groups:
+                    self._groups[group] = (SpaceSaving(capacity=self._capacity),
+                                           CountMinSketch(width=self._cm_width, depth=self._cm_depth))
+                self._groups[group][0].merge(state[0])
+                self._groups[group][1].merge(state[1])
+            else:
+                self._update(group, list(state.keys()), np.array(list(state.values()), dtype=np.float64))
+
+    def estimate(self, key: str, group=None) -> float:
+        """
+        Total of any key, exact or a Count-Min upper bound in approximate mode
+        """
+        self._consume_rows()
+        if group not in self._groups:
+            return 0.0
+
+        if self._approximate:
+            summary, sketch = self._groups[group]
+            return sketch.estimate(key)
+
+        return self._groups[group].get(key, 0.0)
+
+    def _top(self, group) -> List[Tuple[str, float]]:
+        if not self._approximate:
+            return heapq.nlargest(self._k, self._groups[group].items(), key=itemgetter(1))
+
+        summary, sketch = self._groups[group]
+        # both estimates are upper bounds, the smaller one is the closest
+        estimates = [(key, min(count, sketch.estimate(key))) for key, count, _ in summary.top(self._capacity)]
+        return heapq.nlargest(self._k, estimates, key=itemgetter(1))
+
+    def result(self):
+        """
+        :return: list of (key, total) in decreasing order, per group value in a Dict with a group column
+        """
+        self._consume_rows()
+        if self._group_column is None:
+            return self._top(None) if None in self._groups else []
+
+        return {group: self._top(group) for group in self._groups}
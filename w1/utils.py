@@ -1,14 +1,330 @@
 from typing import Dict
 import numpy as np
-from typing import Generator, List
+from typing import Generator, List, Tuple, Union
+from w1.profiler import profiler
 import os
+import constants
 
 CURRENT_FOLDER = os.path.dirname(os.path.abspath(__file__))
 
+# data types used by the columnar reader, every other column is kept as an array of strings
+FLOAT = 'float'
+INT = 'int'
+CATEGORY = 'category'
+
+COLUMN_TYPES = {
+    constants.OutDataColNames.UNIT_PRICE: FLOAT,
+    constants.OutDataColNames.TOTAL_PRICE: FLOAT,
+    constants.OutDataColNames.QUANTITY: INT,
+    constants.OutDataColNames.COUNTRY: CATEGORY,
+    constants.OutDataColNames.STOCK_CODE: CATEGORY,
+    constants.OutDataColNames.DESCRIPTION: CATEGORY,
+    constants.OutDataColNames.DATE: CATEGORY,
+}
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch - keeps a bounded number of values no matter how many are streamed in
+
+    Values live in a hierarchy of compactors, a value in compactor `h` stands for 2^h original values. When a
+    compactor is over its capacity it is sorted and every other value (random offset) is promoted to the next
+    compactor. Capacities decrease geometrically (by 2/3) from `k` at the top, so the sketch holds at most ~3k values.
+
+    The normalized rank error of a quantile is roughly 1.7 / k (k=200 -> ~0.85%). Until the first compaction
+    the sketch holds every value and quantiles are exact.
+    """
+    def __init__(self, k: int = 200, seed: int = 42) -> None:
+        self._k = k
+        self._compactors: List[np.ndarray] = [np.empty(0)]
+        self._buffer = []
+        self._n = 0
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_error(cls, error: float, seed: int = 42) -> 'QuantileSketch':
+        return cls(k=max(8, int(np.ceil(1.7 / error))), seed=seed)
+
+    def get_n(self) -> int:
+        return self._n
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._compactors) - level - 1
+        return max(2, int(np.ceil(self._k * (2 / 3) ** depth)))
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._compactors[0] = np.concatenate([self._compactors[0], np.array(self._buffer, dtype=np.float64)])
+            self._buffer = []
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self._compactors):
+            if len(self._compactors[level]) > self._capacity(level):
+                if level + 1 == len(self._compactors):
+                    self._compactors.append(np.empty(0))
+
+                compactor = np.sort(self._compactors[level])
+
+                # an odd value out stays at this level
+                leftover = compactor[len(compactor) - len(compactor) % 2:]
+                compactor = compactor[:len(compactor) - len(compactor) % 2]
+
+                promoted = compactor[self._rng.integers(2)::2]
+                self._compactors[level] = leftover
+                self._compactors[level + 1] = np.concatenate([self._compactors[level + 1], promoted])
+
+            level += 1
+
+    def update(self, val: float) -> None:
+        self._buffer.append(val)
+        self._n += 1
+
+        if len(self._buffer) >= self._k:
+            self._flush()
+            self._compress()
+
+    def update_batch(self, vals: np.ndarray) -> None:
+        self._flush()
+        self._compactors[0] = np.concatenate([self._compactors[0], vals.astype(np.float64)])
+        self._n += len(vals)
+        self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        self._flush()
+        other._flush()
+
+        for level, compactor in enumerate(other._compactors):
+            if level == len(self._compactors):
+                self._compactors.append(np.empty(0))
+            self._compactors[level] = np.concatenate([self._compactors[level], compactor])
+
+        self._n += other._n
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> Union[float, None]:
+        """
+        :param q: quantile between 0 and 1
+        """
+        self._flush()
+        if self._n == 0:
+            return None
+
+        # nothing has been compacted yet - every value is still there
+        if len(self._compactors) == 1:
+            return float(np.percentile(self._compactors[0], 100 * q))
+
+        vals = np.concatenate(self._compactors)
+        weights = np.concatenate([np.full(len(compactor), 2 ** level, dtype=np.float64)
+                                  for level, compactor in enumerate(self._compactors)])
+
+        order = np.argsort(vals, kind='stable')
+        cumulative_weights = np.cumsum(weights[order])
+        ind = np.searchsorted(cumulative_weights, q * cumulative_weights[-1], side='left')
+
+        return float(vals[order][min(ind, len(vals) - 1)])
+
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def _mix64(h: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, every input bit flips about half of the output bits
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def hash64(vals: np.ndarray) -> np.ndarray:
+    """
+    64 bit hash of every value, the same in every process (unlike `hash` on strings) so that sketches built by
+    different workers can be merged
+
+    Strings are hashed with FNV-1a over their characters, vectorised over the rows one character position at a
+    time (the zero padding of the fixed width arrays is skipped, a value hashes the same in arrays of any width).
+    Numbers are hashed through their float64 bits. Both go through the splitmix64 finalizer.
+    """
+    vals = np.asarray(vals)
+    if vals.dtype.kind in 'biuf':
+        return _mix64(vals.astype(np.float64).view(np.uint64))
+
+    if vals.dtype.kind not in 'SU':
+        vals = vals.astype(str)
+
+    # one uint8 (bytes) or uint32 (unicode) per character
+    char_type = np.uint8 if vals.dtype.kind == 'S' else np.uint32
+    width = vals.dtype.itemsize // np.dtype(char_type).itemsize
+    chars = np.ascontiguousarray(vals).view(char_type).reshape(len(vals), width)
+
+    h = np.full(len(vals), FNV_OFFSET, dtype=np.uint64)
+    for position in range(width):
+        char = chars[:, position].astype(np.uint64)
+        h = np.where(char != 0, (h ^ char) * FNV_PRIME, h)
+
+    return _mix64(h)
+
+
+def _bit_length(vals: np.ndarray) -> np.ndarray:
+    # exact for uint64: each 32 bit half is exactly representable as a float64, frexp gives its bit length
+    high, low = vals >> np.uint64(32), vals & np.uint64(0xffffffff)
+    return np.where(high > 0, 32 + np.frexp(high.astype(np.float64))[1], np.frexp(low.astype(np.float64))[1])
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct count (Flajolet et al.) in 2^precision one byte registers, whatever the number of rows
+
+    The first `precision` bits of the 64 bit hash of a value pick a register, the register keeps the largest
+    position of the first 1 bit seen in the rest of the hash. The relative standard error of the count is
+    1.04 / sqrt(2^precision): 1.6% with the default precision of 12 (4KB of registers), 0.8% with 14 (16KB).
+    Small counts use linear counting (number of empty registers), the 64 bit hash needs no large range correction.
+
+    Until more than `exact_threshold` distinct values (by default as many as fit in the size of the registers,
+    2^precision / 8) the sketch keeps the sorted distinct hashes instead and the count is exact.
+
+    Sketches of the same precision are merged with `merge` (register wise max), so counts built per chunk, per
+    process or per file combine into the count of their union.
+
+    hll = HyperLogLog(precision=14)
+    hll.update_batch(chunk.get_column('InvoiceNo'))
+    hll.count()  # 36184419, +- 0.8%
+    """
+    def __init__(self, precision: int = 12, exact_threshold: int = None) -> None:
+        if not 4 <= precision <= 18:
+            raise ValueError('`precision` should be between 4 and 18')
+
+        self._precision = precision
+        self._n_registers = 1 << precision
+        self._exact_threshold = self._n_registers // 8 if exact_threshold is None else exact_threshold
+
+        # sorted distinct hashes while the count is exact, registers (created on the first switch) after that
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._registers = None
+        # values added one by one, hashed in batches
+        self._buffer = []
+
+    def get_precision(self) -> int:
+        return self._precision
+
+    def is_exact(self) -> bool:
+        self._flush()
+        return self._registers is None
+
+    def get_error(self) -> float:
+        """
+        Relative standard error of `count`, 0 while it is exact
+        """
+        return 0.0 if self.is_exact() else 1.04 / np.sqrt(self._n_registers)
+
+    def _update_registers(self, hashes: np.ndarray) -> None:
+        rest_bits = 64 - self._precision
+        inds = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        ranks = rest_bits + 1 - _bit_length(hashes & np.uint64((1 << rest_bits) - 1))
+
+        if len(hashes) < self._n_registers:
+            np.maximum.at(self._registers, inds, ranks.astype(np.uint8))
+            return
+
+        # ranks are at most 64 - precision + 1: flag every (register, rank) seen, then keep the largest rank of
+        # every register - a plain assignment, much faster than np.maximum.at
+        seen = np.zeros((self._n_registers, 64), dtype=bool)
+        seen[inds, ranks] = True
+        largest = 63 - np.argmax(seen[:, ::-1], axis=1)
+        np.maximum(self._registers, np.where(seen.any(axis=1), largest, 0).astype(np.uint8), out=self._registers)
+
+    def _flush(self) -> None:
+        if self._buffer:
+            buffer, self._buffer = self._buffer, []
+            self._add_hashes(hash64(np.array(buffer)))
+
+    def _add_hashes(self, hashes: np.ndarray) -> None:
+        if self._registers is not None:
+            self._update_registers(hashes)
+            return
+
+        self._hashes = np.union1d(self._hashes, hashes)
+        if len(self._hashes) > self._exact_threshold:
+            self._registers = np.zeros(self._n_registers, dtype=np.uint8)
+            self._update_registers(self._hashes)
+            self._hashes = None
+
+    def update(self, val) -> None:
+        self._buffer.append(val)
+        if len(self._buffer) >= 1 << 12:
+            self._flush()
+
+    def update_hashes(self, hashes: np.ndarray) -> None:
+        """
+        :param hashes: `hash64` of the values, e.g. hashed once per chunk and split per group
+        """
+        self._flush()
+        if len(hashes) > 0:
+            self._add_hashes(hashes)
+
+    def update_batch(self, vals: np.ndarray) -> None:
+        self._flush()
+        if len(vals) > 0:
+            self._add_hashes(hash64(vals))
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if self._precision != other._precision:
+            raise ValueError('Only sketches of the same precision can be merged')
+
+        self._flush()
+        other._flush()
+
+        if other.is_exact():
+            self._add_hashes(other._hashes)
+            return self
+
+        if self.is_exact():
+            hashes, self._hashes = self._hashes, None
+            self._registers = other._registers.copy()
+            self._update_registers(hashes)
+        else:
+            np.maximum(self._registers, other._registers, out=self._registers)
+
+        return self
+
+    def count(self) -> int:
+        if self.is_exact():
+            return len(self._hashes)
+
+        m = self._n_registers
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+
+        n_empty = int(np.count_nonzero(self._registers == 0))
+        if estimate <= 2.5 * m and n_empty > 0:
+            estimate = m * np.log(m / n_empty)
+
+        return int(round(estimate))
+
 
 class Stats:
-    def __init__(self) -> None:
-        self._vals = []
+    """
+    Streaming statistics in constant memory
+
+    - min, max, mean and std are exact (Welford's algorithm, batches and merges use Chan's parallel update)
+    - percentiles and median come from a QuantileSketch with a normalized rank error of about `quantile_error`
+
+    - with `count_distinct`, the number of distinct values comes from a HyperLogLog of `distinct_precision`
+      (exact for small counts, see HyperLogLog). `update_distinct` feeds values that are not numbers, e.g. the
+      invoice numbers or stock codes, to the distinct count only
+
+    Two Stats objects can be merged with `merge`, so stats computed per chunk or per process combine into the
+    stats of the whole file
+    """
+    # no distinct count, also for the Stats pickled (ResultCache) without one
+    _distinct: HyperLogLog = None
+
+    def __init__(self, quantile_error: float = 0.01, count_distinct: bool = False,
+                 distinct_precision: int = 12) -> None:
+        self._n = 0
+        self._sum_sq_diff = 0.0
+        self._sketch = QuantileSketch.from_error(error=quantile_error)
         self._min = None
         self._max = None
         self._mean = None
@@ -17,6 +333,8 @@ class Stats:
         self._25 = None
         self._50 = None
         self._75 = None
+        if count_distinct:
+            self._distinct = HyperLogLog(precision=distinct_precision)
 
     @staticmethod
     def to_float(val):
@@ -25,15 +343,18 @@ class Stats:
         except:
             return None
 
+    def get_n(self) -> int:
+        return self._n
+
     def get_stats(self) -> Dict:
-        # calculate mean, std and percentiles only when required
-        self.calculate_mean()
+        # calculate std and percentiles only when required
         self.calculate_std()
         self.calculate_25()
         self.calculate_50()
         self.calculate_75()
+        self.calculate_median()
 
-        return {
+        stats = {
             'min': self._min,
             'max': self._max,
             'mean': self._mean,
@@ -44,6 +365,12 @@ class Stats:
             '75': self._75
         }
 
+        if self._distinct is not None:
+            stats['distinct'] = self._distinct.count()
+            stats['distinct_error'] = self._distinct.get_error()
+
+        return stats
+
     def update_min(self, val: float) -> None:
         if self._min is None:
             self._min = val
@@ -58,29 +385,134 @@ class Stats:
         if val > self._max:
             self._max = val
 
-    def calculate_mean(self) -> None:
-        self._mean = sum(self._vals) / len(self._vals)
+    def _update_moments(self, n: int, mean: float, sum_sq_diff: float) -> None:
+        # combine the running count, mean and sum of squared differences with the ones of another set of values
+        if n == 0:
+            return
+
+        if self._n == 0:
+            self._n, self._mean, self._sum_sq_diff = n, mean, sum_sq_diff
+            return
+
+        total = self._n + n
+        delta = mean - self._mean
+        self._mean += delta * n / total
+        self._sum_sq_diff += sum_sq_diff + delta ** 2 * self._n * n / total
+        self._n = total
 
     def calculate_std(self) -> None:
-        self._std = np.std(self._vals)
+        # population standard deviation, same as np.std
+        self._std = (self._sum_sq_diff / self._n) ** 0.5 if self._n > 0 else None
 
     def calculate_25(self) -> None:
-        self._25 = np.percentile(self._vals, 25)
+        self._25 = self._sketch.quantile(0.25)
 
     def calculate_50(self) -> None:
-        self._50 = np.percentile(self._vals, 50)
+        self._50 = self._sketch.quantile(0.5)
 
     def calculate_75(self) -> None:
-        self._75 = np.percentile(self._vals, 75)
+        self._75 = self._sketch.quantile(0.75)
+
+    def calculate_median(self) -> None:
+        self._median = self._sketch.quantile(0.5)
 
     def update_stats(self, val) -> None:
         val = self.to_float(val)
         if val is None:
             return
 
-        self._vals.append(val)
+        # Welford's online update
+        self._n += 1
+        if self._mean is None:
+            self._mean = 0.0
+        delta = val - self._mean
+        self._mean += delta / self._n
+        self._sum_sq_diff += delta * (val - self._mean)
+
+        self._sketch.update(val)
         self.update_min(val=val)
         self.update_max(val=val)
+        if self._distinct is not None:
+            self._distinct.update(val)
+
+    def update_stats_batch(self, vals: np.ndarray) -> None:
+        # values that could not be parsed are NaN in the columnar chunks
+        vals = vals[~np.isnan(vals)]
+        if len(vals) == 0:
+            return
+
+        mean = float(vals.mean())
+        self._update_moments(n=len(vals), mean=mean, sum_sq_diff=float(((vals - mean) ** 2).sum()))
+
+        self._sketch.update_batch(vals)
+        self.update_min(val=float(vals.min()))
+        self.update_max(val=float(vals.max()))
+        if self._distinct is not None:
+            self._distinct.update_batch(vals)
+
+    def update_distinct(self, val) -> None:
+        """
+        Count the value as it is (strings are not parsed as numbers), the other stats are left untouched
+        """
+        if self._distinct is not None:
+            self._distinct.update(val)
+
+    def update_distinct_batch(self, vals: np.ndarray) -> None:
+        if self._distinct is not None:
+            self._distinct.update_batch(vals)
+
+    def merge(self, other: 'Stats') -> 'Stats':
+        self._update_moments(n=other._n, mean=other._mean, sum_sq_diff=other._sum_sq_diff)
+        if self._distinct is not None and other._distinct is not None:
+            self._distinct.merge(other._distinct)
+
+        self._sketch.merge(other._sketch)
+        if other._min is not None:
+            self.update_min(val=other._min)
+        if other._max is not None:
+            self.update_max(val=other._max)
+
+        return self
+
+
+class ColumnarChunk:
+    """
+    A block of rows stored column wise as NumPy arrays
+
+    - FLOAT columns are float64 arrays (NaN for values that could not be parsed)
+    - INT columns are int64 arrays (float64 with NaN if any value in the chunk could not be parsed)
+    - CATEGORY columns are int32 codes, `get_categories` maps a code back to its value
+    - every other column is an array of strings
+    """
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, List[str]], n_rows: int) -> None:
+        self._columns = columns
+        self._categories = categories
+        self._n_rows = n_rows
+
+    def get_n_rows(self) -> int:
+        return self._n_rows
+
+    def get_column_names(self) -> List[str]:
+        return list(self._columns.keys())
+
+    def get_column(self, column_name: str) -> np.ndarray:
+        return self._columns[column_name]
+
+    def is_categorical(self, column_name: str) -> bool:
+        return column_name in self._categories
+
+    def get_categories(self, column_name: str) -> List[str]:
+        return self._categories[column_name]
+
+    def factorize(self, column_name: str) -> Tuple[np.ndarray, List]:
+        """
+        Returns integer codes and the values they map to, for any column type
+        """
+        if self.is_categorical(column_name):
+            return self._columns[column_name], self._categories[column_name]
+
+        uniques, codes = np.unique(self._columns[column_name], return_inverse=True)
+        return codes, uniques.tolist()
 
 
 class DataReader:
@@ -111,13 +543,236 @@ class DataReader:
             'Country': 'Russia',
         }
         """
-    ######################################## YOUR CODE HERE ##################################################
+        with open(self._fp) as f:
+            for line in f:
+                values = line.rstrip('\n').split(self._sep)
+                yield {col_name: values[ind] for ind, col_name in enumerate(self._col_names)}
+
+    def iter_rows(self, column_names: List[str] = None, predicate: 'Predicate' = None,
+                  byte_range: Tuple[int, int] = None) -> Generator:
+        """
+        Input : column names to return (all the columns if None), row filter (see w1.predicate), byte range
+                [start, end) to read (whole file if None)
+        Output : Generator
+
+        Projected and filtered counterpart of `__iter__`, without the column names row. A line is only split up to
+        the last column that is needed, the predicate is checked on its own columns and the dict of a row is
+        only built for the rows that match.
+
+        `byte_range` must start and end on row boundaries, as for `iter_chunks`
+        """
+        column_names = column_names or self._col_names
+        col_inds = [(column_name, self._col_names.index(column_name)) for column_name in column_names]
+        predicate_inds = [(column_name, self._col_names.index(column_name))
+                          for column_name in (predicate.get_column_names() if predicate is not None else [])]
+        max_split = max([ind for _, ind in col_inds + predicate_inds]) + 1
+
+        with open(self._fp, 'rb') as f:
+            if byte_range is None:
+                # skip first row as it is the column name
+                _ = f.readline()
+                remaining = None
+            else:
+                f.seek(byte_range[0])
+                remaining = byte_range[1] - byte_range[0]
+
+            for line in f:
+                if remaining is not None:
+                    if remaining <= 0:
+                        break
+                    remaining -= len(line)
+
+                values = line.decode().rstrip('\n').split(self._sep, max_split)
+                if predicate is not None and not predicate.matches({column_name: values[ind]
+                                                                    for column_name, ind in predicate_inds}):
+                    continue
+
+                yield {column_name: values[ind] for column_name, ind in col_inds}
+
+    @staticmethod
+    def to_float(val):
+        try:
+            return float(val)
+        except:
+            return None
+
+    def _to_float_array(self, vals: List[str]) -> np.ndarray:
+        try:
+            return np.array(vals, dtype=np.float64)
+        except ValueError:
+            vals = [self.to_float(val) for val in vals]
+            # only the slow path can meet a value that is not a number, the count costs nothing otherwise
+            profiler.count('parse_failures', vals.count(None))
+            return np.array([np.nan if val is None else val for val in vals], dtype=np.float64)
+
+    def _to_int_array(self, vals: List[str]) -> np.ndarray:
+        try:
+            return np.array(vals, dtype=np.int64)
+        except ValueError:
+            return self._to_float_array(vals)
+
+    @staticmethod
+    def _to_codes(vals: List[str], categories: Dict[str, int]) -> np.ndarray:
+        uniques, first_inds, inverse = np.unique(np.array(vals), return_index=True, return_inverse=True)
+
+        # new values get the next code in order of first appearance, so codes are stable across chunks
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for ind in np.argsort(first_inds, kind='stable'):
+            mapping[ind] = categories.setdefault(str(uniques[ind]), len(categories))
+
+        return mapping[inverse]
+
+    def get_rows_range(self, block_size: int = 1 << 16) -> Tuple[int, int]:
+        """
+        Byte range [start, end) of the complete rows of the file as it is now: from the end of the column names
+        row to the last line break. A row that is still being appended is left out.
+        """
+        with open(self._fp, 'rb') as f:
+            _ = f.readline()
+            start = f.tell()
+
+            end = f.seek(0, os.SEEK_END)
+            while end > start:
+                f.seek(max(end - block_size, start))
+                block = f.read(end - f.tell())
+                cut = block.rfind(b'\n')
+                if cut >= 0:
+                    return start, end - len(block) + cut + 1
+                end -= len(block)
+
+        return start, start
+
+    def get_byte_ranges(self, n_ranges: int, rows_range: Tuple[int, int] = None) -> List[Tuple[int, int]]:
+        """
+        Split the rows of the file (column names row excluded) into at most `n_ranges` byte ranges [start, end)
+        of about the same size. Every boundary is moved forward to the next line break so that no row is split.
+
+        :param rows_range: row aligned byte range to split (see `get_rows_range`), all the rows of the file by
+                           default
+        """
+        with open(self._fp, 'rb') as f:
+            if rows_range is None:
+                _ = f.readline()
+                rows_range = f.tell(), os.path.getsize(self._fp)
+            file_size = rows_range[1]
+            boundaries = [rows_range[0]]
+
+            for ind in range(1, n_ranges):
+                f.seek(max(boundaries[0] + (file_size - boundaries[0]) * ind // n_ranges, boundaries[-1]))
+                if f.tell() > boundaries[0]:
+                    # finish the row the boundary fell into
+                    f.seek(f.tell() - 1)
+                    _ = f.readline()
+                boundaries.append(min(f.tell(), file_size))
+
+        boundaries.append(file_size)
+        return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
+
+    def _parse_column(self, column_name: str, vals: List[str], categories: Dict[str, Dict[str, int]]) -> np.ndarray:
+        col_type = COLUMN_TYPES.get(column_name)
+
+        if col_type == FLOAT:
+            return self._to_float_array(vals)
+        elif col_type == INT:
+            return self._to_int_array(vals)
+        elif col_type == CATEGORY:
+            return self._to_codes(vals, categories[column_name])
+
+        return np.array(vals)
+
+    def iter_chunks(self, column_names: List[str] = None, chunk_bytes: int = 1 << 23,
+                    byte_range: Tuple[int, int] = None, predicate: 'Predicate' = None) -> Generator:
+        """
+        Input : column names to parse (all the columns if None), approximate size of a chunk in bytes,
+                byte range [start, end) to read (whole file if None), row filter (see w1.predicate)
+        Output : Generator
+
+        Columnar counterpart of `__iter__`. Upon iteration the data is of type ColumnarChunk and holds the rows of
+        about `chunk_bytes` of the file, with only the requested columns typed as per COLUMN_TYPES. Unlike
+        `__iter__` the column names row is not returned.
+
+        Lines are only split up to the last column that is needed. With a predicate its columns are parsed first
+        and the other columns are only parsed for the rows that match, chunks without a match are not returned.
+
+        `byte_range` must start and end on row boundaries (see `get_byte_ranges`)
+        """
+        column_names = column_names or self._col_names
+        predicate_names = predicate.get_column_names() if predicate is not None else []
+        parse_names = column_names + [column_name for column_name in predicate_names if column_name not in column_names]
+        col_inds = {column_name: self._col_names.index(column_name) for column_name in parse_names}
+        max_split = max(col_inds.values()) + 1
 
-    ######################################## YOUR CODE HERE ##################################################
+        # value -> code, shared by all the chunks of this scan
+        categories = {column_name: {} for column_name in parse_names if COLUMN_TYPES.get(column_name) == CATEGORY}
+
+        with open(self._fp, 'rb') as f:
+            if byte_range is None:
+                # skip first row as it is the column name
+                _ = f.readline()
+                end = None
+            else:
+                f.seek(byte_range[0])
+                end = byte_range[1]
+
+            remainder = b''
+            while True:
+                n_bytes = chunk_bytes if end is None else min(chunk_bytes, end - f.tell())
+                with profiler.stage('read'):
+                    block = f.read(n_bytes) if n_bytes > 0 else b''
+                profiler.count('bytes_read', len(block))
+
+                if block:
+                    # only complete rows are parsed, the partial last row is carried over to the next block
+                    block = remainder + block
+                    cut = block.rfind(b'\n') + 1
+                    block, remainder = block[:cut], block[cut:]
+                else:
+                    block, remainder = remainder, b''
+
+                if not block:
+                    if remainder:
+                        continue
+                    break
+
+                with profiler.stage('parse'):
+                    rows = [line.split(self._sep, max_split) for line in block.decode().split('\n') if line]
+                    if not rows:
+                        continue
+                    profiler.count('rows_parsed', len(rows))
+
+                    columns = {}
+                    if predicate is not None:
+                        for column_name in predicate_names:
+                            columns[column_name] = self._parse_column(
+                                column_name, [row[col_inds[column_name]] for row in rows], categories)
+
+                        mask = predicate.mask(ColumnarChunk(
+                            columns=columns, n_rows=len(rows),
+                            categories={column_name: list(categories[column_name].keys())
+                                        for column_name in predicate_names if column_name in categories}))
+                        if not mask.all():
+                            profiler.count('rows_filtered', len(rows) - int(np.count_nonzero(mask)))
+                            rows = [row for row, keep in zip(rows, mask.tolist()) if keep]
+                            columns = {column_name: vals[mask] for column_name, vals in columns.items()}
+                        if not rows:
+                            continue
+
+                    for column_name in column_names:
+                        if column_name not in columns:
+                            columns[column_name] = self._parse_column(
+                                column_name, [row[col_inds[column_name]] for row in rows], categories)
+
+                yield ColumnarChunk(columns={column_name: columns[column_name] for column_name in column_names},
+                                    categories={column_name: list(categories[column_name].keys())
+                                                for column_name in column_names if column_name in categories},
+                                    n_rows=len(rows))
 
     def get_file_path(self):
         return self._fp
 
+    def get_separator(self):
+        return self._sep
+
     def get_column_names(self):
         return self._col_names
 
@@ -0,0 +1,92 @@
+from typing import Callable, Dict, List
+from datetime import datetime
+from pprint import pprint
+import argparse
+import tempfile
+import sqlite3
+import time
+import uuid
+import os
+from w2.utils.database import DB
+
+BENCHMARK_DB_NAME = 'db_benchmark.sqlite'
+
+
+def get_records(n_records: int) -> List[Dict]:
+    start_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return [{'process_id': str(uuid.uuid4()), 'start_time': start_time, 'file_name': 'sample.csv',
+             'file_path': '/usr/sample.csv', 'description': f'chunk {ind}'} for ind in range(n_records)]
+
+
+def fstring_inserts(connection: sqlite3.Connection, records: List[Dict]) -> None:
+    # before: the values are formatted into the SQL text, every statement is a new text to parse, one commit each
+    for record in records:
+        connection.execute(f'''INSERT INTO processes (process_id, file_name, file_path, description, start_time)
+                               VALUES ('{record['process_id']}', '{record['file_name']}', '{record['file_path']}',
+                                       '{record['description']}', '{record['start_time']}');''')
+        connection.commit()
+
+
+def fstring_end_times(connection: sqlite3.Connection, records: List[Dict], end_time: str) -> None:
+    for record in records:
+        connection.execute(f'''UPDATE processes SET end_time='{end_time}'
+                               WHERE process_id='{record['process_id']}';''')
+        connection.commit()
+
+
+def time_ops(func: Callable, n_ops: int) -> Dict:
+    st = time.perf_counter()
+    func()
+    en = time.perf_counter()
+
+    return {'n_ops': n_ops, 'seconds': en - st, 'ops_per_sec': n_ops / max(en - st, 1e-9)}
+
+
+def run(n_records: int) -> Dict[str, Dict]:
+    """
+    Ops/sec of registering `n_records` processes and setting their end time, with the former f-string SQL (one
+    parse and one commit per row) and with the prepared statements and bulk APIs of DB
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # an absolute path is used as is by DB, the benchmark never writes to the database folder
+        db_path = os.path.join(tmp_dir, BENCHMARK_DB_NAME)
+        return run_db(db=DB(db_name=db_path), connection=sqlite3.connect(db_path), n_records=n_records)
+
+
+def run_db(db: DB, connection: sqlite3.Connection, n_records: int) -> Dict[str, Dict]:
+    end_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    results = {}
+    records = get_records(n_records)
+    results['insert (f-string)'] = time_ops(lambda: fstring_inserts(connection, records), n_records)
+    results['update_end_time (f-string)'] = time_ops(lambda: fstring_end_times(connection, records, end_time),
+                                                     n_records)
+
+    records = get_records(n_records)
+    results['insert (prepared)'] = time_ops(lambda: [db.insert(**record) for record in records], n_records)
+    results['update_end_time (prepared)'] = time_ops(
+        lambda: [db.update_end_time(process_id=record['process_id'], end_time=end_time) for record in records],
+        n_records)
+
+    records = get_records(n_records)
+    results['insert_many'] = time_ops(lambda: db.insert_many(records), n_records)
+    results['upsert_many'] = time_ops(lambda: db.upsert_many([dict(record, end_time=end_time, percentage=100)
+                                                              for record in records]), n_records)
+
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the writes to the processes table")
+    parser.add_argument('--n-records',
+                        default=2000,
+                        type=int,
+                        help='Number of processes to register per benchmark')
+    args = parser.parse_args()
+
+    pprint(run(n_records=args.n_records))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,12 @@
 import datetime
 from typing import List, Dict
 from pprint import pprint
-from w1.utils import Stats
-from tqdm import tqdm
 import os
-from w2.utils.database import DB
+from w2.utils.database import DB, get_shared_db
 import uuid
 import inspect
 from w1.data_processor import DataProcessor
+from w1.engine import QueryPlan, DescribeOperator, AggregateOperator, GroupByOperator
 import argparse
 from global_utils import make_dir,  plot_sales_data, get_file_name
 import json
@@ -19,7 +18,7 @@ CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 class DP(DataProcessor):
     def __init__(self, file_path):
         super().__init__(file_path)
-        self._db = DB()
+        self._db = get_shared_db()
 
     def get_db(self) -> DB:
         return self._db
@@ -33,6 +32,26 @@ class DP(DataProcessor):
     def get_n_rows(self) -> int:
         return self._n_rows
 
+    def run_plan(self, plan: QueryPlan, description: str = None) -> Dict:
+        process_id = str(uuid.uuid4())
+        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                        file_name=self._file_name, file_path=self._fp,
+                        description=description or ','.join(plan.get_operators().keys()))
+
+        # progress goes through the buffered writer, the scan never waits on SQLite
+        progress_writer = self._db.get_progress_writer()
+
+        def update_percentage(row_num: int) -> None:
+            if isinstance(self._n_rows, int) and self._n_rows > 0:
+                progress_writer.update(process_id=process_id, percentage=100 * row_num/self._n_rows)
+
+        results = plan.run(progress_callback=update_percentage)
+
+        progress_writer.flush()
+        self._db.update_percentage(process_id=process_id, percentage=100)
+        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        return results
+
     def aggregate(self, column_name: str) -> float:
         """
         Input : List[str]
@@ -50,56 +69,16 @@ class DP(DataProcessor):
 
         aggregate should be 105.58
         """
-        process_id = str(uuid.uuid4())
-        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                        file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
-
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
-        aggregate = 0
+        plan = self.new_plan()
+        plan.register('aggregate', AggregateOperator(column_name=column_name))
 
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
-
-            if self.to_float(row[column_name]):
-                aggregate += self.to_float(row[column_name])
-
-        self._db.update_percentage(process_id=process_id, percentage=100)
-        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-        return aggregate
+        return self.run_plan(plan, description=inspect.stack()[0][3])['aggregate']
 
     def describe(self, column_names: List[str]):
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
+        plan = self.new_plan()
+        plan.register('describe', DescribeOperator(column_names=column_names))
 
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
-        stats = {name: Stats() for name in column_names}
-
-        process_id = str(uuid.uuid4())
-        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                        file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
-
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
-
-            for column_name in column_names:
-                stats[column_name].update_stats(val=row[column_name])
-
-        self._stats = stats
-        for column_name, value in self._stats.items():
-            pprint(column_name)
-            pprint(value.get_stats())
-
-        self._db.update_percentage(process_id=process_id, percentage=100)
-        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        self.set_stats(self.run_plan(plan, description=inspect.stack()[0][3])['describe'])
 
 
 def revenue_per_region(dp: DP) -> Dict:
@@ -132,43 +111,28 @@ def revenue_per_region(dp: DP) -> Dict:
         'United States': 121.499
     }
     """
-    # get generator from data_reader
-    data_reader_gen = (row for row in dp.data_reader)
-
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
-
-    aggregate = dict()
-
-    process_id = str(uuid.uuid4())
-    dp.get_db().insert(process_id=process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                       file_name=dp.get_file_name(), file_path=dp.get_file_path(), description=inspect.stack()[0][3])
+    plan = dp.new_plan()
+    plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                        value_column=constants.OutDataColNames.TOTAL_PRICE))
 
-    for n_row, row in enumerate(tqdm(data_reader_gen)):
-        if isinstance(dp.get_n_rows(), int) and isinstance(n_row, int) and n_row % 10000 == 0:
-            dp.get_db().update_percentage(process_id=process_id, percentage=100 * n_row / dp.get_n_rows())
-
-        if row[constants.OutDataColNames.COUNTRY] not in aggregate:
-            aggregate[row[constants.OutDataColNames.COUNTRY]] = 0
-        aggregate[row[constants.OutDataColNames.COUNTRY]] += dp.to_float(row[constants.OutDataColNames.TOTAL_PRICE])
-
-    dp.get_db().update_percentage(process_id=process_id, percentage=100)
-    dp.get_db().update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-
-    return aggregate
+    return dp.run_plan(plan, description=inspect.stack()[0][3])['revenue_per_region']
 
 
 def get_sales_information(file_path: str) -> Dict:
     # Initialize
     dp = DP(file_path=file_path)
 
+    # describe, aggregate and revenue per region are all fed by a single scan of the file
+    plan = dp.sales_plan()
+    results = dp.run_plan(plan, description=inspect.stack()[0][3])
+
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.set_stats(results['describe'])
 
     # return total revenue and revenue per region
     return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
@@ -1,27 +1,35 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 from typing import List, Dict, Union
-from threading import Thread
 import asyncio
 from pydantic import BaseModel
 from starlette.websockets import WebSocket, WebSocketState
 from w2.utils.websocket import ConnectionManager
 from w2.utils.response_model import ProcessStatus
-from w2.utils.database import DB
+from w2.utils.database import DB, ProcessFilter
 
 app = FastAPI()
 manager = ConnectionManager()
 
-# start an asynchronous task that will keep broadcasting the process status to all the connected clients
-broadcast_continuous = Thread(target=asyncio.run, args=(manager.broadcast_all(),))
-broadcast_continuous.start()
+
+# start an asynchronous task on the event loop of the app that will keep broadcasting the process status to all the
+# connected clients
+@app.on_event("startup")
+async def start_broadcast() -> None:
+    app.state.broadcast_task = asyncio.create_task(manager.broadcast_all())
+
+
+@app.on_event("shutdown")
+async def stop_broadcast() -> None:
+    app.state.broadcast_task.cancel()
 
 
 # The below endpoint is used to create websocket connection
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # create a websocket connection for a client and assign it to a room
-    await manager.connect(websocket)
+    # create a websocket connection for a client and assign it to a room, the query parameters filter the processes
+    # it receives (e.g. `/ws?running=true`)
+    await manager.connect(websocket, process_filter=ProcessFilter.from_params(websocket.query_params))
 
     try:
         while True:
@@ -29,7 +37,9 @@ async def websocket_endpoint(websocket: WebSocket):
             # Broadcast message to all the connections/clients in a chatroom
             await websocket.send_text(f"Websocket connection established Connected")
 
-    except WebSocketDisconnect:
+    # RuntimeError: the socket was closed by the manager (a client that could not keep up)
+    except (WebSocketDisconnect, RuntimeError):
+        manager.disconnect(websocket)
         print("Client disconnected")
 
 
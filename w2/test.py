@@ -1,6 +1,10 @@
-from w2.utils.database import DB
+from w2.utils.database import DB, BufferedProgressWriter, ProcessFilter
+from w2.utils.change_feed import ProcessSnapshot
 from w2.utils.response_model import ProcessStatus
 import uuid
+import sqlite3
+import tempfile
+import os
 from datetime import datetime
 import time
 from pprint import pprint
@@ -67,3 +71,136 @@ class TestApp(unittest.TestCase):
 
         records = self.db.read_all()
         pprint(records)
+
+    def test_progress_writer(self):
+        process_id = str(uuid.uuid4())
+        self.db.insert(process_id=process_id, start_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                       file_name='sample.csv', file_path='/usr/sample.csv', description='sample')
+
+        progress_writer = BufferedProgressWriter(db=self.db, flush_interval=0.1)
+
+        # updates are coalesced, only the latest percentage is written
+        for percentage in range(100):
+            progress_writer.update(process_id=process_id, percentage=percentage)
+        time.sleep(0.5)
+
+        records = {record['process_id']: record for record in self.db.read_all()}
+        self.assertEqual(records[process_id]['percentage'], 99, msg='Latest percentage should be written')
+
+        progress_writer.update(process_id=process_id, percentage=100)
+        progress_writer.close()
+
+        records = {record['process_id']: record for record in self.db.read_all()}
+        self.assertEqual(records[process_id]['percentage'], 100, msg='Pending percentage should be flushed on close')
+
+    def test_change_feed(self):
+        snapshot = ProcessSnapshot(db=self.db)
+        snapshot.refresh()
+        n_rows = len(snapshot.get_rows())
+
+        process_id = str(uuid.uuid4())
+        self.db.insert(process_id=process_id, start_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                       file_name='sample.csv', file_path='/usr/sample.csv', description='sample')
+
+        # a new process is sent with all its fields
+        deltas = snapshot.refresh()
+        self.assertEqual(list(deltas.keys()), [process_id], msg='Only the new process should be sent')
+        self.assertEqual(deltas[process_id]['file_name'], 'sample.csv', msg='New process should have all fields')
+        self.assertEqual(len(snapshot.get_rows()), n_rows + 1, msg='Snapshot should contain the new process')
+
+        # an update only sends the changed fields
+        self.db.update_percentage(process_id=process_id, percentage=50)
+        self.assertEqual(snapshot.refresh(), {process_id: {'percentage': 50}}, msg='Only the change should be sent')
+        self.assertEqual(snapshot.refresh(), {}, msg='Nothing changed')
+        snapshot.close()
+
+    def test_change_feed_per_database(self):
+        other_db = DB('db_test_other.sqlite')
+        snapshot = ProcessSnapshot(db=self.db)
+        snapshot.refresh()
+
+        # writes to another database file never reach the snapshot
+        process_id = str(uuid.uuid4())
+        other_db.insert(process_id=process_id, start_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                        file_name='sample.csv', file_path='/usr/sample.csv', description='sample')
+        other_db.update_percentage(process_id=process_id, percentage=50)
+        self.assertEqual(snapshot.refresh(), {}, msg='Changes of another database should not be sent')
+
+        # DB objects of the same file share its feed
+        same_db = DB('db_test.sqlite')
+        same_db.insert(process_id=process_id, start_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                       file_name='sample.csv', file_path='/usr/sample.csv', description='sample')
+        self.assertEqual(list(snapshot.refresh().keys()), [process_id], msg='Changes of the same file should be sent')
+        snapshot.close()
+
+    def test_read_page(self):
+        file_name = f'{uuid.uuid4()}.csv'
+        process_ids = [str(uuid.uuid4()) for _ in range(5)]
+        for ind, process_id in enumerate(process_ids):
+            self.db.insert(process_id=process_id, start_time=f'2023-01-0{ind + 1} 10:00:00', file_name=file_name,
+                           file_path=f'/usr/{file_name}', description='sample')
+        self.db.update_end_time(process_id=process_ids[0], end_time='2023-01-01 10:01:30')
+
+        # keyset pages of 2 rows, in start time order
+        pages, cursor = [], None
+        while True:
+            processes, cursor = self.db.read_page(process_filter=ProcessFilter(file_name=file_name), limit=2,
+                                                  cursor=cursor)
+            pages.append([process['process_id'] for process in processes])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [process_ids[:2], process_ids[2:4], process_ids[4:]], msg='Wrong pages')
+
+        with self.assertRaises(ValueError, msg='A malformed cursor should be rejected'):
+            self.db.read_page(cursor='garbage')
+
+        processes, _ = self.db.read_page(process_filter=ProcessFilter(file_name=file_name, running=True))
+        self.assertEqual([process['process_id'] for process in processes], process_ids[1:],
+                         msg='Finished process should be filtered out')
+
+        processes, _ = self.db.read_page(process_filter=ProcessFilter(file_name=file_name, running=False,
+                                                                      start_before='2023-01-02 00:00:00'))
+        self.assertEqual(processes[0]['time_taken'], 90, msg='Time taken should be stored with the end time')
+
+    def test_upsert_many(self):
+        start_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        records = [{'process_id': str(uuid.uuid4()), 'start_time': start_time, 'file_name': 'sample.csv',
+                    'file_path': '/usr/sample.csv', 'description': f'chunk {ind}'} for ind in range(100)]
+        self.db.insert_many(records)
+
+        # only the given fields are updated, new process ids are inserted
+        new_record = dict(records[0], process_id=str(uuid.uuid4()))
+        self.db.upsert_many([{'process_id': record['process_id'], 'start_time': start_time, 'percentage': 50}
+                             for record in records[:10]] + [new_record])
+
+        stored = {record['process_id']: record for record in self.db.read_all()}
+        self.assertTrue(all([record['process_id'] in stored for record in records + [new_record]]),
+                        msg='Every record should be stored')
+        self.assertEqual([stored[record['process_id']]['percentage'] for record in records[:11]], [50] * 10 + [None],
+                         msg='Only the upserted percentages should change')
+        self.assertEqual(stored[records[0]['process_id']]['description'], 'chunk 0',
+                         msg='Missing fields should not overwrite the stored values')
+
+        # the start time can be left out of the update of a stored process
+        self.db.upsert_many([{'process_id': records[0]['process_id'], 'percentage': 75}])
+        stored = {record['process_id']: record for record in self.db.read_all()}
+        self.assertEqual(stored[records[0]['process_id']]['percentage'], 75, msg='Percentage should be updated')
+        self.assertEqual(stored[records[0]['process_id']]['start_time'], start_time, msg='Start time should be kept')
+
+    def test_duplicate_process_ids(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a table of an older version, without the unique index on the process id
+            db_path = os.path.join(tmp_dir, 'db_old.sqlite')
+            connection = sqlite3.connect(db_path)
+            connection.execute('''CREATE TABLE processes (process_id TEXT NOT NULL, file_name TEXT DEFAULT NULL,
+                                                          file_path TEXT DEFAULT NULL, description TEXT DEFAULT NULL,
+                                                          start_time TEXT NOT NULL, end_time TEXT DEFAULT NULL,
+                                                          percentage REAL DEFAULT NULL);''')
+            connection.executemany('''INSERT INTO processes (process_id, start_time, percentage)
+                                      VALUES (?, '2023-01-01 10:00:00', ?);''', [('a', 10), ('a', 20), ('b', 30)])
+            connection.commit()
+            connection.close()
+
+            records = {record['process_id']: record for record in DB(db_path).read_all()}
+            self.assertEqual({process_id: record['percentage'] for process_id, record in records.items()},
+                             {'a': 20, 'b': 30}, msg='The latest row of every process should be kept')
@@ -0,0 +1,137 @@
+import threading
+import os
+from typing import List, Dict
+
+
+class Subscription:
+    """
+    Pending changes of one subscriber, coalesced per process id
+    """
+    def __init__(self) -> None:
+        self._pending: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def push(self, process_id: str, changes: Dict) -> None:
+        with self._lock:
+            self._pending.setdefault(process_id, {}).update(changes)
+
+    def drain(self) -> Dict[str, Dict]:
+        """
+        :return: changed fields per process id since the last drain
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        return pending
+
+
+class ChangeFeed:
+    """
+    In-process pub/sub of the changes made to the processes table
+
+    DB publishes the process id and the changed fields of every write, every subscriber gets its own
+    Subscription to drain at its own pace
+    """
+    def __init__(self) -> None:
+        self._subscriptions: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        with self._lock:
+            self._subscriptions.append(subscription)
+
+        return subscription
+
+    def has_subscriptions(self) -> bool:
+        return len(self._subscriptions) > 0
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, process_id: str, changes: Dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            subscription.push(process_id=process_id, changes=changes)
+
+
+_change_feeds: Dict[str, ChangeFeed] = {}
+_change_feeds_lock = threading.Lock()
+
+
+def get_change_feed(db_path: str) -> ChangeFeed:
+    """
+    Change feed of one database file, shared by every DB object of the process that opens the same file
+    """
+    key = os.path.realpath(db_path)
+    with _change_feeds_lock:
+        if key not in _change_feeds:
+            _change_feeds[key] = ChangeFeed()
+
+        return _change_feeds[key]
+
+
+class ProcessSnapshot:
+    """
+    Latest state of the processes table of `db`, kept up to date from the change feed of its database file
+
+    `refresh` is meant to be called once per broadcast tick and returns only what changed since the previous
+    tick. Writes made through a DB object in this process arrive through the change feed and do not touch the
+    table. The table is read at most once per tick, and only when SQLite reports a commit from another
+    connection (`PRAGMA data_version`), e.g. a `main.py` run in another process.
+    """
+    def __init__(self, db: 'DB') -> None:
+        self._db = db
+        self._change_feed = db.get_change_feed()
+        self._subscription = self._change_feed.subscribe()
+        self._rows: Dict[str, Dict] = {}
+        self._data_version = None
+
+    def get_rows(self) -> List[Dict]:
+        return list(self._rows.values())
+
+    def get_row(self, process_id: str) -> Dict:
+        return self._rows.get(process_id, {})
+
+    @staticmethod
+    def diff(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        :return: process id -> changed fields (every field for a new process)
+        """
+        deltas = {}
+        for process_id, row in new.items():
+            old_row = old.get(process_id)
+            if old_row is None:
+                deltas[process_id] = dict(row)
+                continue
+
+            changes = {col_name: val for col_name, val in row.items() if old_row.get(col_name) != val}
+            if changes:
+                deltas[process_id] = changes
+
+        return deltas
+
+    def refresh(self) -> Dict[str, Dict]:
+        changes = self._subscription.drain()
+        data_version = self._db.get_data_version()
+
+        if data_version != self._data_version:
+            # another connection wrote to the table - read it once, the diff covers the feed changes as well
+            self._data_version = data_version
+            rows = {row['process_id']: row for row in self._db.read_all()}
+        else:
+            rows = dict(self._rows)
+            # time_taken comes with the end time in the feed, it is never parsed again here
+            for process_id, row_changes in changes.items():
+                rows[process_id] = dict(rows.get(process_id, {'time_taken': 0}), **row_changes)
+
+        deltas = self.diff(self._rows, rows)
+        self._rows = rows
+        return deltas
+
+    def close(self) -> None:
+        self._change_feed.unsubscribe(self._subscription)
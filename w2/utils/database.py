@@ -1,23 +1,210 @@
-
 # import the sqlite3 package
 import sqlite3
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+import asyncio
+import base64
+import json
 import os
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
 from global_utils import make_dir
+from w2.utils.change_feed import ChangeFeed, get_change_feed
+from w1.profiler import profiler
+
+
+class BufferedProgressWriter:
+    """
+    Coalesces percentage updates in memory and writes them from a background thread
+
+    `update` only stores the latest percentage of a process under a lock, so the analytics loop never waits on
+    SQLite. Every `flush_interval` seconds the background thread writes all the pending percentages with a single
+    prepared UPDATE statement (`executemany`) in one transaction, i.e. one commit per interval instead of one
+    commit per progress tick.
+    """
+    def __init__(self, db: 'DB', flush_interval: float = 1.0) -> None:
+        self._db = db
+        self._flush_interval = flush_interval
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # flushes are serialised, once `flush` returns no older percentage can still be written
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
+
+    def update(self, process_id: str, percentage: float) -> None:
+        with self._lock:
+            self._pending[process_id] = percentage
+        self._start()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if pending:
+                self._db.update_percentages(list(pending.items()))
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+class ProcessFilter:
+    """
+    Server side filter on the processes, used both as the WHERE clause of `DB.read_page` and on the rows held in
+    memory by the websocket subscriptions
+
+    :param running: only the running processes (no end time) if True, only the finished ones if False
+    :param file_name: only the processes of this file
+    :param start_after: only the processes started at or after this time ('%Y-%m-%d %H:%M:%S')
+    :param start_before: only the processes started before this time ('%Y-%m-%d %H:%M:%S')
+    """
+    def __init__(self, running: bool = None, file_name: str = None, start_after: str = None,
+                 start_before: str = None) -> None:
+        self._running = running
+        self._file_name = file_name
+        self._start_after = start_after
+        self._start_before = start_before
+
+    @classmethod
+    def from_params(cls, params: Dict[str, str]) -> 'ProcessFilter':
+        """
+        Filter from query parameters, e.g. `/ws?running=true&file_name=2015.csv`
+        """
+        running = params.get('running')
+        if running is not None:
+            running = running.lower() in ('1', 'true', 'yes')
+
+        return cls(running=running, file_name=params.get('file_name'), start_after=params.get('start_after'),
+                   start_before=params.get('start_before'))
+
+    def is_empty(self) -> bool:
+        return (self._running is None and self._file_name is None and self._start_after is None and
+                self._start_before is None)
+
+    def to_sql(self) -> Tuple[List[str], List]:
+        """
+        :return: list of conditions to AND together and their parameters
+        """
+        conditions, params = [], []
+        if self._running is not None:
+            conditions.append('end_time IS NULL' if self._running else 'end_time IS NOT NULL')
+        if self._file_name is not None:
+            conditions.append('file_name = ?')
+            params.append(self._file_name)
+        if self._start_after is not None:
+            conditions.append('start_time >= ?')
+            params.append(self._start_after)
+        if self._start_before is not None:
+            conditions.append('start_time < ?')
+            params.append(self._start_before)
+
+        return conditions, params
+
+    def matches(self, row: Dict) -> bool:
+        # start times are '%Y-%m-%d %H:%M:%S' strings, they compare in the same order as the times
+        start_time = row.get('start_time') or ''
+        return ((self._running is None or (row.get('end_time') is None) == self._running) and
+                (self._file_name is None or row.get('file_name') == self._file_name) and
+                (self._start_after is None or start_time >= self._start_after) and
+                (self._start_before is None or start_time < self._start_before))
+
+
+def _encode_cursor(start_time: str, process_id: str) -> str:
+    # opaque to the clients, they only send back the cursor of the previous page
+    return base64.urlsafe_b64encode(json.dumps([start_time, process_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        position = None
+
+    if not (isinstance(position, list) and len(position) == 2 and all([isinstance(val, str) for val in position])):
+        raise ValueError(f'Invalid cursor `{cursor}`')
+
+    return position[0], position[1]
 
 
 class DB:
     def __init__(self, db_name: str = "database.sqlite") -> None:
         self._db_save_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'database')
         make_dir(self._db_save_path)
-        self._connection = sqlite3.connect(os.path.join(self._db_save_path, db_name),
-                                           check_same_thread=False)
+        db_path = os.path.join(self._db_save_path, db_name)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        # writes are published to the subscribers of this database file only
+        self._change_feed = get_change_feed(db_path)
         self._table_name = 'processes'
+        self._metrics_table_name = 'metrics'
         self._col_order = ['process_id', 'file_name', 'file_path', 'description', 'start_time', 'end_time', 'percentage']
 
+        # duration in seconds, computed by SQLite once the end time is known and stored with the row
+        self._time_taken_sql = ("CAST(strftime('%s', {end_time}) AS INTEGER) - "
+                                "CAST(strftime('%s', {start_time}) AS INTEGER)")
+        self._statements = self._prepare_statements()
+
+        # the connection is shared with the progress writer thread
+        self._lock = threading.RLock()
+        self._progress_writer = None
+
+        # WAL - readers do not block the writer and commits do not need to rewrite the main database file
+        self._connection.execute('PRAGMA journal_mode=WAL;')
+        self._connection.execute('PRAGMA synchronous=NORMAL;')
+
         self.create_table()
 
+    def get_change_feed(self) -> ChangeFeed:
+        return self._change_feed
+
+    def _prepare_statements(self) -> Dict[str, str]:
+        """
+        Every statement is built once, with `?` parameters for all the values: sqlite3 keeps the compiled
+        statement of every SQL text it has seen (`cached_statements`), so a statement is parsed on its first call
+        only and every other call reuses it
+        """
+        col_names = ",".join(self._col_order)
+        values = ", ".join(["?"] * len(self._col_order))
+        insert = f'''INSERT INTO {self._table_name} ({col_names}, time_taken)
+                      VALUES ({values}, {self._time_taken_sql.format(end_time='?', start_time='?')})'''
+
+        # the values of a record that are None do not overwrite the stored ones
+        updates = ", ".join([f'{col_name}=COALESCE(excluded.{col_name}, {col_name})'
+                             for col_name in self._col_order if col_name != 'process_id'])
+        time_taken = self._time_taken_sql.format(end_time='COALESCE(excluded.end_time, end_time)',
+                                                 start_time='COALESCE(excluded.start_time, start_time)')
+
+        select = f'''SELECT {col_names}, COALESCE(time_taken, 0) FROM {self._table_name}'''
+
+        return {
+            'insert': f'{insert} RETURNING COALESCE(time_taken, 0);',
+            'insert_many': f'{insert};',
+            'upsert_many': f'''{insert}
+                               ON CONFLICT(process_id) DO UPDATE SET {updates}, time_taken={time_taken};''',
+            'update_end_time': f'''UPDATE {self._table_name}
+                                   SET end_time=?, time_taken={self._time_taken_sql.format(end_time='?',
+                                                                                          start_time='start_time')}
+                                   WHERE process_id=?
+                                   RETURNING time_taken;''',
+            'update_percentage': f'''UPDATE {self._table_name} SET percentage=? WHERE process_id=?;''',
+            'read_all': f'''{select} ORDER BY start_time, process_id;''',
+            'select': select
+        }
+
     @staticmethod
     def calculate_time_taken(start_time: str, end_time: str, datetime_fmt: str) -> float:
         if isinstance(start_time, str) and isinstance(end_time, str):
@@ -41,12 +228,54 @@ class DB:
         - start_time : TEXT (not null)
         - end_time : TEXT (default is null)
         - percentage : REAL (default is null)
+        - time_taken : REAL (default is null, set with the end time)
+
+        Indexes back the keyset pagination and the filters of `read_page`: (start_time, process_id) for the
+        pages, (file_name, start_time, process_id) for one file and a partial index on the running processes.
 
         Read more about datatypes in Sqlite here -> https://www.sqlite.org/datatype3.html
         """
-    ######################################## YOUR CODE HERE ##################################################
+        with self._lock:
+            self._connection.execute(f'''CREATE TABLE IF NOT EXISTS {self._table_name}
+                                         (process_id TEXT NOT NULL,
+                                          file_name TEXT DEFAULT NULL,
+                                          file_path TEXT DEFAULT NULL,
+                                          description TEXT DEFAULT NULL,
+                                          start_time TEXT NOT NULL,
+                                          end_time TEXT DEFAULT NULL,
+                                          percentage REAL DEFAULT NULL,
+                                          time_taken REAL DEFAULT NULL);''')
+
+            # tables created before time_taken was stored
+            col_names = [row[1] for row in self._connection.execute(f'PRAGMA table_info({self._table_name});')]
+            if 'time_taken' not in col_names:
+                self._connection.execute(f'''ALTER TABLE {self._table_name}
+                                             ADD COLUMN time_taken REAL DEFAULT NULL;''')
+                time_taken_sql = self._time_taken_sql.format(end_time='end_time', start_time='start_time')
+                self._connection.execute(f'''UPDATE {self._table_name} SET time_taken={time_taken_sql}
+                                             WHERE end_time IS NOT NULL;''')
 
-    ######################################## YOUR CODE HERE ##################################################
+            # tables created before process ids were unique may hold several rows of a process, the latest is kept
+            if self._connection.execute('''SELECT 1 FROM sqlite_master WHERE type='index' AND name=?;''',
+                                        (f'idx_{self._table_name}_process_id',)).fetchone() is None:
+                self._connection.execute(f'''DELETE FROM {self._table_name}
+                                             WHERE rowid NOT IN (SELECT MAX(rowid) FROM {self._table_name}
+                                                                 GROUP BY process_id);''')
+            self._connection.execute(f'''CREATE UNIQUE INDEX IF NOT EXISTS idx_{self._table_name}_process_id
+                                         ON {self._table_name} (process_id);''')
+            self._connection.execute(f'''CREATE INDEX IF NOT EXISTS idx_{self._table_name}_start_time
+                                         ON {self._table_name} (start_time, process_id);''')
+            self._connection.execute(f'''CREATE INDEX IF NOT EXISTS idx_{self._table_name}_file_name
+                                         ON {self._table_name} (file_name, start_time, process_id);''')
+            self._connection.execute(f'''CREATE INDEX IF NOT EXISTS idx_{self._table_name}_running
+                                         ON {self._table_name} (start_time, process_id) WHERE end_time IS NULL;''')
+
+            # profiler reports of the runs (see `save_metrics`), one JSON document per process
+            self._connection.execute(f'''CREATE TABLE IF NOT EXISTS {self._metrics_table_name}
+                                         (process_id TEXT PRIMARY KEY,
+                                          created_at TEXT NOT NULL,
+                                          report TEXT NOT NULL);''')
+            self._connection.commit()
 
     def insert(self, process_id, start_time, file_name=None, file_path=None,
                description=None, end_time=None, percentage=None) -> None:
@@ -62,29 +291,137 @@ class DB:
         :param percentage: Percentage of process completed
         :return: None
         """
-    ######################################## YOUR CODE HERE ##################################################
+        with profiler.stage('db_write'), self._lock:
+            time_taken = self._connection.execute(self._statements['insert'],
+                                                  (process_id, file_name, file_path, description, start_time,
+                                                   end_time, percentage, end_time, start_time)).fetchone()[0]
+            self._connection.commit()
+        profiler.count('db_writes')
+
+        self._change_feed.publish(process_id=process_id,
+                                  changes={'process_id': process_id, 'file_name': file_name,
+                                           'file_path': file_path, 'description': description,
+                                           'start_time': start_time, 'end_time': end_time,
+                                           'percentage': percentage, 'time_taken': time_taken})
+
+    def _to_params(self, records: List[Dict]) -> List[tuple]:
+        # the end and start times are passed twice, the second time to compute time_taken
+        return [tuple(record.get(col_name) for col_name in self._col_order) +
+                (record.get('end_time'), record.get('start_time')) for record in records]
+
+    def insert_many(self, records: List[Dict]) -> None:
+        """
+        Insert many records with one prepared statement (`executemany`) in a single transaction
+
+        :param records: list of dicts with the same keys as the parameters of `insert`
+        :return: None
+        """
+        with profiler.stage('db_write'), self._lock:
+            with self._connection:
+                self._connection.executemany(self._statements['insert_many'], self._to_params(records))
+        profiler.count('db_writes', len(records))
+
+        self._publish_rows([record['process_id'] for record in records])
+
+    def upsert_many(self, records: List[Dict]) -> None:
+        """
+        Insert many records, or update them when their process id is already in the table, with one prepared
+        statement in a single transaction. The values of a record that are None leave the stored ones as they are.
+
+        :param records: list of dicts with the same keys as the parameters of `insert`
+        :return: None
+        """
+        with profiler.stage('db_write'), self._lock:
+            with self._connection:
+                # SQLite checks NOT NULL before the conflict, a record without a start time takes the stored one
+                start_times = self._read_start_times([record['process_id'] for record in records
+                                                      if record.get('start_time') is None])
+                records = [record if record.get('start_time') is not None else
+                           dict(record, start_time=start_times.get(record['process_id'])) for record in records]
+                self._connection.executemany(self._statements['upsert_many'], self._to_params(records))
+        profiler.count('db_writes', len(records))
+
+        self._publish_rows([record['process_id'] for record in records])
+
+    def _read_start_times(self, process_ids: List[str], batch_size: int = 500) -> Dict[str, str]:
+        start_times = {}
+        for start in range(0, len(process_ids), batch_size):
+            batch = process_ids[start:start + batch_size]
+            start_times.update(self._connection.execute(f'''SELECT process_id, start_time FROM {self._table_name}
+                                                            WHERE process_id IN ({", ".join(["?"] * len(batch))});''',
+                                                        batch).fetchall())
+
+        return start_times
+
+    def _publish_rows(self, process_ids: List[str], batch_size: int = 500) -> None:
+        """
+        Publish the stored rows of the processes to the change feed, read back in batches
+        """
+        if not self._change_feed.has_subscriptions():
+            return
+
+        for start in range(0, len(process_ids), batch_size):
+            batch = process_ids[start:start + batch_size]
+            with self._lock:
+                rows = self._connection.execute(f'''{self._statements['select']}
+                                                   WHERE process_id IN ({", ".join(["?"] * len(batch))});''',
+                                                batch).fetchall()
 
-    ######################################## YOUR CODE HERE ##################################################
+            for row in self._to_dicts(rows):
+                self._change_feed.publish(process_id=row['process_id'], changes=row)
+
+    def _to_dicts(self, rows: List[tuple]) -> List[Dict]:
+        col_names = self._col_order + ['time_taken']
+        return [{col_name: row[ind] for ind, col_name in enumerate(col_names)} for row in rows]
 
     def read_all(self) -> List[Dict]:
-        data = []
-        cursor = self._connection.execute(f'''SELECT {",".join(self._col_order)}
-                                              FROM {self._table_name}''')
-        for row in cursor.fetchall():
-            row_dict = {col_name: row[ind] for ind, col_name in enumerate(self._col_order)}
-            time_taken = self.calculate_time_taken(start_time=row_dict['start_time'], end_time=row_dict['end_time'],
-                                                   datetime_fmt='%Y-%m-%d %H:%M:%S')
-            row_dict['time_taken'] = time_taken
+        with profiler.stage('db_read'), self._lock:
+            rows = self._connection.execute(self._statements['read_all']).fetchall()
+
+        return self._to_dicts(rows)
 
-            data.append(row_dict)
+    def read_page(self, process_filter: ProcessFilter = None, limit: int = 100,
+                  cursor: str = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Read one page of the processes, in start time order, with keyset pagination: the cursor is the position of
+        the last row of the previous page, so every page is an index range scan no matter how deep it is
 
-        return data
+        :param process_filter: only the processes that match this filter
+        :param limit: maximum number of processes in the page
+        :param cursor: `next_cursor` of the previous page, None for the first page - any other value raises a
+                       ValueError
+        :return: the processes of the page and the cursor of the next page (None on the last page)
+        """
+        conditions, params = (process_filter or ProcessFilter()).to_sql()
+        if cursor is not None:
+            start_time, process_id = _decode_cursor(cursor)
+            conditions.append('(start_time, process_id) > (?, ?)')
+            params.extend([start_time, process_id])
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        with profiler.stage('db_read'), self._lock:
+            # one row more than the page, to know whether there is a next page
+            rows = self._connection.execute(f'''{self._statements['select']}
+                                               {where}
+                                               ORDER BY start_time, process_id
+                                               LIMIT ?''', params + [limit + 1]).fetchall()
+
+        processes = self._to_dicts(rows[:limit])
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = _encode_cursor(processes[-1]['start_time'], processes[-1]['process_id'])
+
+        return processes, next_cursor
 
     def update_end_time(self, process_id, end_time):
-        self._connection.execute(f'''UPDATE {self._table_name} SET end_time='{end_time}'
-                                     WHERE process_id='{process_id}';''')
+        with profiler.stage('db_write'), self._lock:
+            row = self._connection.execute(self._statements['update_end_time'],
+                                           (end_time, end_time, process_id)).fetchone()
+            self._connection.commit()
+        profiler.count('db_writes')
 
-        self._connection.commit()
+        self._change_feed.publish(process_id=process_id,
+                                  changes={'end_time': end_time, 'time_taken': row[0] if row is not None else 0})
 
     def update_percentage(self, process_id, percentage):
         """
@@ -94,8 +431,149 @@ class DB:
         :param percentage: Percentage of process completed
         :return: None
         """
-    ######################################## YOUR CODE HERE ##################################################
+        self.update_percentages([(process_id, percentage)])
+
+    def update_percentages(self, percentages: List[tuple]) -> None:
+        """
+        Update the percentage of many records in a single transaction
+
+        :param percentages: list of (process_id, percentage)
+        :return: None
+        """
+        with profiler.stage('db_write'), self._lock:
+            self._connection.executemany(self._statements['update_percentage'],
+                                         [(percentage, process_id) for process_id, percentage in percentages])
+            self._connection.commit()
+        profiler.count('db_writes', len(percentages))
+
+        for process_id, percentage in percentages:
+            self._change_feed.publish(process_id=process_id, changes={'percentage': percentage})
+
+    def save_metrics(self, process_id: str, report: Dict) -> None:
+        """
+        Store the profiler report of a run, so that the server can serve the reports of the runs made by other
+        processes (see `/metrics`)
+
+        :param process_id: id of the process the report was recorded for
+        :param report: Profiler.get_report()
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute(f'''INSERT OR REPLACE INTO {self._metrics_table_name}
+                                         (process_id, created_at, report) VALUES (?, ?, ?);''',
+                                     (process_id, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                                      json.dumps(report)))
+            self._connection.commit()
+
+    def read_metrics(self, limit: int = 10) -> List[Dict]:
+        """
+        :return: the latest `limit` run reports, most recent first, as {process_id, created_at, report}
+        """
+        with self._lock:
+            rows = self._connection.execute(f'''SELECT process_id, created_at, report FROM {self._metrics_table_name}
+                                                ORDER BY created_at DESC, rowid DESC LIMIT ?;''',
+                                            (limit,)).fetchall()
+
+        return [{'process_id': process_id, 'created_at': created_at, 'report': json.loads(report)}
+                for process_id, created_at, report in rows]
+
+    def get_data_version(self) -> int:
+        """
+        Changes whenever another connection commits to the database, see https://www.sqlite.org/pragma.html
+        """
+        with self._lock:
+            return self._connection.execute('PRAGMA data_version;').fetchone()[0]
+
+    def get_progress_writer(self) -> BufferedProgressWriter:
+        """
+        Buffered writer to use for progress updates from hot loops, see BufferedProgressWriter
+        """
+        if self._progress_writer is None:
+            self._progress_writer = BufferedProgressWriter(db=self)
+
+        return self._progress_writer
+
+
+# one DB object (and so one SQLite connection) per database file, shared by everything in the process
+_shared_dbs: Dict[str, DB] = {}
+_shared_dbs_lock = threading.Lock()
+
+
+def get_shared_db(db_name: str = "database.sqlite") -> DB:
+    with _shared_dbs_lock:
+        if db_name not in _shared_dbs:
+            _shared_dbs[db_name] = DB(db_name=db_name)
+
+        return _shared_dbs[db_name]
+
+
+class AsyncDB:
+    """
+    Async access to the database for the event loop
+
+    Every call runs on a small pool of threads, so the event loop never waits on SQLite. Each thread of the pool
+    opens its own read connection once and reuses it for every read (WAL lets them read concurrently with the
+    writer), writes go through the shared DB of the process (see `get_shared_db`).
+
+    processes = await get_async_db().read_all()
+    """
+    def __init__(self, db_name: str = "database.sqlite", n_readers: int = 4) -> None:
+        self._db_name = db_name
+        self._writer = get_shared_db(db_name=db_name)
+        self._local = threading.local()
+        self._readers: List[DB] = []
+        self._executor = ThreadPoolExecutor(max_workers=n_readers, thread_name_prefix='db-reader')
+
+    def get_writer(self) -> DB:
+        return self._writer
+
+    def get_readers(self) -> List[DB]:
+        return self._readers
+
+    def _get_reader(self) -> DB:
+        if getattr(self._local, 'db', None) is None:
+            self._local.db = DB(db_name=self._db_name)
+            self._readers.append(self._local.db)
+
+        return self._local.db
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """
+        Run any blocking function on the pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def read_all(self) -> List[Dict]:
+        return await self.run(lambda: self._get_reader().read_all())
+
+    async def read_page(self, process_filter: ProcessFilter = None, limit: int = 100,
+                        cursor: str = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self.run(lambda: self._get_reader().read_page(process_filter=process_filter, limit=limit,
+                                                                   cursor=cursor))
+
+    async def read_metrics(self, limit: int = 10) -> List[Dict]:
+        return await self.run(lambda: self._get_reader().read_metrics(limit=limit))
+
+    async def insert(self, **kwargs) -> None:
+        await self.run(self._writer.insert, **kwargs)
+
+    async def update_percentage(self, process_id, percentage) -> None:
+        await self.run(self._writer.update_percentage, process_id=process_id, percentage=percentage)
+
+    async def update_end_time(self, process_id, end_time) -> None:
+        await self.run(self._writer.update_end_time, process_id=process_id, end_time=end_time)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+_async_dbs: Dict[str, AsyncDB] = {}
+_async_dbs_lock = threading.Lock()
 
-    ######################################## YOUR CODE HERE ##################################################
 
+def get_async_db(db_name: str = "database.sqlite") -> AsyncDB:
+    with _async_dbs_lock:
+        if db_name not in _async_dbs:
+            _async_dbs[db_name] = AsyncDB(db_name=db_name)
 
+        return _async_dbs[db_name]
@@ -11,3 +11,4 @@ class ProcessStatus(BaseModel):
     start_time: str
     end_time: Union[str, None] = None
     percentage: Union[int, None] = None
+    time_taken: Union[float, None] = None
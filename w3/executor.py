@@ -0,0 +1,150 @@
+from typing import Dict, List, Tuple
+import multiprocessing
+import time
+import os
+from w1.engine import QueryPlan, Operator
+
+
+def run_chunk(plan: QueryPlan, byte_range: Tuple[int, int]) -> Dict[str, Operator]:
+    """
+    Run a plan over one byte range of its file, inside a worker process
+
+    The plan is pickled to the worker with its (empty) operators, and the operators are sent back with the
+    partial state of this range so that the parent process can merge them
+    """
+    plan.run(byte_range=byte_range, progress_bar=False)
+    return plan.get_operators()
+
+
+def run_task(task: Tuple[int, QueryPlan, Tuple[int, int]]) -> Tuple[int, int, float, float, Dict[str, Operator]]:
+    """
+    :return: task index, worker pid, start time, end time and the partial operators of the task
+    """
+    task_ind, plan, byte_range = task
+
+    st = time.time()
+    operators = run_chunk(plan=plan, byte_range=byte_range)
+    en = time.time()
+
+    return task_ind, os.getpid(), st, en, operators
+
+
+class ChunkedExecutor:
+    """
+    Runs query plans over newline aligned byte ranges of their files in a `multiprocessing.Pool` and merges the
+    partial results, so a single large file is processed by every core
+
+    Every file is split into a number of ranges proportional to its size, so that all the ranges of all the
+    files are about the same size and there are `chunks_per_process` ranges per process in total.
+
+    Ranges are not assigned to processes up front: they are queued largest first and every worker pulls the next
+    range as soon as it is done with the previous one, so all the workers stay busy until the queue is empty.
+    `get_report` gives the busy and idle time of every worker of the last run to check the balance.
+
+    Plans with a result cache first load the cached operators, only the others are run over the ranges.
+
+    executor = ChunkedExecutor(n_processes=8)
+    results = executor.run(plans=[plan_2015, plan_2016])  # [plan_2015 results, plan_2016 results]
+    """
+    def __init__(self, n_processes: int = None, chunks_per_process: int = 4) -> None:
+        self._n_processes = n_processes or os.cpu_count()
+        self._chunks_per_process = chunks_per_process
+        self._report = {}
+
+    def get_n_processes(self) -> int:
+        return self._n_processes
+
+    def get_report(self) -> Dict:
+        return self._report
+
+    def split(self, plans: List[QueryPlan],
+              rows_ranges: List[Tuple[int, int]] = None) -> List[Tuple[int, Tuple[int, int]]]:
+        """
+        :param rows_ranges: byte range of the rows to split per plan (None for all the rows of its file), all the
+                            rows of every file by default
+        :return: list of (plan index, byte range) tasks, in file order
+        """
+        rows_ranges = rows_ranges or [None] * len(plans)
+        file_sizes = [os.path.getsize(plan.get_data_reader().get_file_path()) if rows_range is None
+                      else rows_range[1] - rows_range[0] for plan, rows_range in zip(plans, rows_ranges)]
+        total_size = max(sum(file_sizes), 1)
+        n_chunks = self._n_processes * self._chunks_per_process
+
+        tasks = []
+        for plan_ind, (plan, rows_range, file_size) in enumerate(zip(plans, rows_ranges, file_sizes)):
+            n_ranges = max(1, round(n_chunks * file_size / total_size))
+            tasks.extend([(plan_ind, byte_range)
+                          for byte_range in plan.get_data_reader().get_byte_ranges(n_ranges, rows_range=rows_range)])
+
+        return tasks
+
+    def run(self, plans: List[QueryPlan]) -> List[Dict]:
+        pending_plans = []
+        for plan in plans:
+            if plan.get_result_cache() is None:
+                pending_plans.append((plan, list(plan.get_operators()), None))
+                continue
+
+            # the complete rows of the file as it is now: the ranges stop there and it is the checkpoint, a row
+            # still being appended is left to the next run
+            rows_range = plan.get_data_reader().get_rows_range()
+            pending = plan.load_cached()
+            if pending:
+                pending_plans.append((plan, pending, rows_range))
+
+        self._run([plan.subplan(pending) for plan, pending, _ in pending_plans],
+                  rows_ranges=[rows_range for _, _, rows_range in pending_plans])
+
+        for plan, pending, rows_range in pending_plans:
+            if rows_range is not None:
+                plan.save_cached(pending, file_size=rows_range[1])
+
+        return [plan.results() for plan in plans]
+
+    def _run(self, plans: List[QueryPlan], rows_ranges: List[Tuple[int, int]] = None) -> None:
+        tasks = self.split(plans, rows_ranges=rows_ranges)
+        if not tasks:
+            self._set_report(worker_times={}, wall_time=0)
+            return
+
+        # largest ranges first, so the last ranges to finish are the small ones
+        queue = sorted(range(len(tasks)), key=lambda task_ind: tasks[task_ind][1][0] - tasks[task_ind][1][1])
+
+        partial_operators = [None] * len(tasks)
+        worker_times = {}
+
+        st = time.time()
+        with multiprocessing.Pool(processes=min(self._n_processes, max(len(tasks), 1))) as pool:
+            # chunksize=1 - a worker only takes the next range from the queue once it is free
+            for task_ind, pid, task_st, task_en, operators in pool.imap_unordered(
+                    run_task, [(task_ind, plans[tasks[task_ind][0]], tasks[task_ind][1]) for task_ind in queue],
+                    chunksize=1):
+                partial_operators[task_ind] = operators
+                worker_times.setdefault(pid, []).append(task_en - task_st)
+        en = time.time()
+
+        self._set_report(worker_times=worker_times, wall_time=en - st)
+
+        # merge in the file order, so group by keys keep the order in which they appear in the file
+        for (plan_ind, _), operators in zip(tasks, partial_operators):
+            plans[plan_ind].merge(operators)
+
+    def _set_report(self, worker_times: Dict[int, List[float]], wall_time: float) -> None:
+        workers = {}
+        for worker_num, (pid, task_times) in enumerate(sorted(worker_times.items())):
+            busy = sum(task_times)
+            workers[f'worker-{worker_num}'] = {
+                'pid': pid,
+                'n_tasks': len(task_times),
+                'busy': busy,
+                'idle': max(wall_time - busy, 0),
+                'utilisation': busy / wall_time if wall_time > 0 else 0
+            }
+
+        self._report = {
+            'wall_time': wall_time,
+            'n_processes': self._n_processes,
+            'n_workers_used': len(workers),
+            'n_tasks': sum([worker['n_tasks'] for worker in workers.values()]),
+            'workers': workers
+        }
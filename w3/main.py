@@ -1,9 +1,10 @@
 import time
 from typing import List, Dict
-from tqdm import tqdm
 import os
-import multiprocessing
 from w1.data_processor import DataProcessor
+from w1.engine import GroupByOperator
+from w1.result_cache import ResultCache
+from w3.executor import ChunkedExecutor
 import constants
 from global_utils import get_file_name, make_dir, plot_sales_data
 import json
@@ -15,8 +16,8 @@ CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 
 
 class DP(DataProcessor):
-    def __init__(self, file_path: str) -> None:
-        super().__init__(file_path)
+    def __init__(self, file_path: str, result_cache: ResultCache = None) -> None:
+        super().__init__(file_path, result_cache=result_cache)
 
     def get_file_path(self) -> str:
         return self._fp
@@ -29,67 +30,52 @@ class DP(DataProcessor):
 
 
 def revenue_per_region(dp: DP) -> Dict:
-    data_reader = dp.data_reader
-    data_reader_gen = (row for row in data_reader)
+    plan = dp.new_plan()
+    plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                        value_column=constants.OutDataColNames.TOTAL_PRICE))
 
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
+    return dp.run_plan(plan)['revenue_per_region']
 
-    aggregate = dict()
 
-    for row in tqdm(data_reader_gen):
-        if row[constants.OutDataColNames.COUNTRY] not in aggregate:
-            aggregate[row[constants.OutDataColNames.COUNTRY]] = 0
-        aggregate[row[constants.OutDataColNames.COUNTRY]] += dp.to_float(row[constants.OutDataColNames.TOTAL_PRICE])
-
-    return aggregate
-
-
-def get_sales_information(file_path: str) -> Dict:
+def get_sales_information(file_path: str, result_cache: ResultCache = None) -> Dict:
     # Initialize
-    dp = DP(file_path=file_path)
+    dp = DP(file_path=file_path, result_cache=result_cache)
+
+    results = dp.run_plan(dp.sales_plan())
 
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.set_stats(results['describe'])
 
     # return total revenue and revenue per region
     return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
 
-# batches the files based on the number of processes
-def batch_files(file_paths: List[str], n_processes: int) -> List[set]:
-    if n_processes > len(file_paths):
-        return []
-
-    n_per_batch = len(file_paths) // n_processes
-
-    first_set_len = n_processes * n_per_batch
-    first_set = file_paths[0:first_set_len]
-    second_set = file_paths[first_set_len:]
-
-    batches = [set(file_paths[i:i + n_per_batch]) for i in range(0, len(first_set), n_per_batch)]
-    for ind, each_file in enumerate(second_set):
-        batches[ind].add(each_file)
+# splits every file into byte ranges and processes all the ranges of all the files in a pool of processes
+def get_sales_information_chunked(file_paths: List[str], n_processes: int = None,
+                                  result_cache: ResultCache = None) -> List[Dict]:
+    dps = [DP(file_path=file_path, result_cache=result_cache) for file_path in file_paths]
 
-    return batches
+    executor = ChunkedExecutor(n_processes=n_processes)
+    plans_results = executor.run(plans=[dp.sales_plan() for dp in dps])
 
+    # busy / idle time of every worker
+    pprint(executor.get_report())
 
-# Fetch the revenue data from a file
-def run(file_names: List[str], n_process: int) -> List[Dict]:
-    st = time.time()
-
-    print("Process : {}".format(n_process))
-    folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-    file_paths = [os.path.join(folder_path, file_name) for file_name in file_names]
-    revenue_data = [get_sales_information(file_path) for file_path in file_paths]
+    revenue_data = []
+    for dp, results in zip(dps, plans_results):
+        # print stats
+        dp.set_stats(results['describe'])
 
-    en = time.time()
+        revenue_data.append({
+            'total_revenue': results['total_revenue'],
+            'revenue_per_region': results['revenue_per_region'],
+            'file_name': get_file_name(dp.get_file_path())
+        })
 
-    print(f"Batch for process-{n_process} time taken {en - st}")
     return revenue_data
 
 
@@ -99,11 +85,9 @@ def flatten(lst: List[List]) -> List:
 
 def main() -> List[Dict]:
     """
-    Use the `batch_files` method to create batches of files that needs to be run in each process
-    Use the `run` method to fetch revenue data for a given batch of files
-
-    Use multiprocessing module to process batches of data in parallel
-    Check `multiprocessing.Pool` and `pool.starmap` methods to help you wit the task
+    Every file is split into newline aligned byte ranges (see `w3.executor.ChunkedExecutor`), the ranges of all
+    the files are processed in a `multiprocessing.Pool` and the partial results are merged per file, so throughput
+    scales with the number of cores rather than with the number of files
 
     At the end check the overall time taken in this code vs the time taken in W1 code
 
@@ -144,14 +128,18 @@ def main() -> List[Dict]:
     """
 
     st = time.time()
-    n_processes = 3 # you may modify this number - check out multiprocessing.cpu_count() as well
 
     parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
     parser.add_argument('--type',
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--n-processes',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of processes')
     args = parser.parse_args()
+    n_processes = args.n_processes
 
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
     files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
@@ -161,17 +149,14 @@ def main() -> List[Dict]:
     make_dir(output_save_folder)
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
 
-    batches = batch_files(file_paths=file_paths, n_processes=n_processes)
-
-    ######################################## YOUR CODE HERE ##################################################
-
-    ######################################## YOUR CODE HERE ##################################################
+    # every file is split into byte ranges, so all the processes are busy even with a single large file
+    revenue_data = get_sales_information_chunked(file_paths=file_paths, n_processes=n_processes)
 
     en = time.time()
     print("Overall time taken : {}".format(en-st))
 
     # should return revenue data
-    return [{}]
+    return revenue_data
 
 
 if __name__ == '__main__':
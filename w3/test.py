@@ -1,5 +1,10 @@
 import os
-from w3.main import get_sales_information
+from datetime import datetime
+from w3.main import get_sales_information, get_sales_information_chunked, DP
+from w3.executor import ChunkedExecutor
+from w1.result_cache import ResultCache
+from benchmark import compare_reports
+import generate_data
 from w1.utils import DataReader
 import constants
 from global_utils import blockPrint, enablePrint
@@ -35,13 +40,15 @@ def test_data_reader():
     pprint(row_1)
 
 
-def test_revenue_per_region():
+def test_revenue_per_region(tmp_path):
     blockPrint()
     data_folder_path = os.path.join(CURRENT_FOLDER, '..', constants.DATA_FOLDER_NAME, 'tst')
     files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
 
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
-    revenue_data = [{'file_path': file_path, 'revenue_data': get_sales_information(file_path)}
+    result_cache = ResultCache(cache_path=str(tmp_path))
+    revenue_data = [{'file_path': file_path, 'revenue_data': get_sales_information(file_path,
+                                                                                   result_cache=result_cache)}
                     for file_path in file_paths]
     enablePrint()
 
@@ -50,3 +57,155 @@ def test_revenue_per_region():
     assert all([len(each) > 0 for each in revenue_data])
 
     pprint(revenue_data)
+
+
+def test_chunked_executor(tmp_path):
+    blockPrint()
+    data_folder_path = os.path.join(CURRENT_FOLDER, '..', constants.DATA_FOLDER_NAME, 'tst')
+    file_paths = [os.path.join(data_folder_path, file_name) for file_name in ['2015.csv', '2016.csv']]
+
+    # a result cache per engine, neither run is served the results of the other
+    chunked_cache = ResultCache(cache_path=os.path.join(tmp_path, 'chunked'))
+    sequential_cache = ResultCache(cache_path=os.path.join(tmp_path, 'sequential'))
+    revenue_data = get_sales_information_chunked(file_paths=file_paths, n_processes=3, result_cache=chunked_cache)
+    expected = [get_sales_information(file_path, result_cache=sequential_cache) for file_path in file_paths]
+    enablePrint()
+
+    # merging the partial results of the byte ranges should give the results of a single scan
+    for chunked, sequential in zip(revenue_data, expected):
+        assert chunked['file_name'] == sequential['file_name']
+        assert abs(chunked['total_revenue'] - sequential['total_revenue']) < 1e-3
+        assert chunked['revenue_per_region'].keys() == sequential['revenue_per_region'].keys()
+        assert all([abs(chunked['revenue_per_region'][country] - revenue) < 1e-3
+                    for country, revenue in sequential['revenue_per_region'].items()])
+
+
+def test_byte_ranges():
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    data_reader = DataReader(fp=file_path, sep=',', col_names=[])
+
+    with open(file_path, 'rb') as f:
+        rows = f.read().split(b'\n', 1)[1]
+
+    # ranges should cover every row exactly once and never cut a row
+    chunks = []
+    with open(file_path, 'rb') as f:
+        for start, end in data_reader.get_byte_ranges(n_ranges=9):
+            f.seek(start)
+            chunks.append(f.read(end - start))
+
+    assert b''.join(chunks) == rows
+    assert all([chunk.endswith(b'\n') for chunk in chunks])
+
+
+def test_executor_report(tmp_path):
+    blockPrint()
+    file_path = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2017.csv')
+    result_cache = ResultCache(cache_path=str(tmp_path))
+
+    # more processes than files - every process still gets byte ranges to work on
+    executor = ChunkedExecutor(n_processes=4)
+    plan = DP(file_path=file_path).sales_plan()
+    plan.set_result_cache(result_cache)
+    results = executor.run(plans=[plan])
+    report = executor.get_report()
+
+    # second run of the same plan on the unchanged file - served from the result cache, no task
+    plan = DP(file_path=file_path).sales_plan()
+    plan.set_result_cache(result_cache)
+    cached_results = executor.run(plans=[plan])
+    enablePrint()
+
+    assert len(results) == 1 and results[0]['total_revenue'] > 0
+    assert report['n_tasks'] == len(executor.split(plans=[DP(file_path=file_path).sales_plan()]))
+    assert all([0 < worker['utilisation'] <= 1.01 for worker in report['workers'].values()])
+    assert executor.get_report()['n_tasks'] == 0
+    assert cached_results[0]['total_revenue'] == results[0]['total_revenue']
+    assert cached_results[0]['revenue_per_region'] == results[0]['revenue_per_region']
+
+
+def test_executor_appended_rows(tmp_path):
+    file_path = os.path.join(tmp_path, '2015.csv')
+    with open(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')) as f:
+        lines = f.readlines()
+    result_cache = ResultCache(cache_path=os.path.join(tmp_path, 'results'))
+
+    def run():
+        plan = DP(file_path=file_path).sales_plan()
+        plan.set_result_cache(result_cache)
+        return ChunkedExecutor(n_processes=3).run(plans=[plan])[0]['total_revenue']
+
+    def revenue(rows):
+        return sum([float(row.split(',')[4]) for row in rows])
+
+    # the last row is still being written: it is left out of the ranges and of the checkpoint
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:3001])
+        f.write(lines[3001][:len(lines[3001]) // 2])
+    blockPrint()
+    total_revenue = run()
+    assert abs(total_revenue - revenue(lines[1:3001])) < 1e-3
+
+    # once written, it is counted exactly once
+    with open(file_path, 'a') as f:
+        f.write(lines[3001][len(lines[3001]) // 2:])
+        f.writelines(lines[3002:3101])
+    total_revenue = run()
+    enablePrint()
+    assert abs(total_revenue - revenue(lines[1:3101])) < 1e-3
+
+
+def test_compare_reports():
+    baseline = {'results': [{'path': 'w1_columnar', 'rows_per_sec': 1000}, {'path': 'w3_chunked', 'rows_per_sec': 4000}]}
+    report = {'results': [{'path': 'w1_columnar', 'rows_per_sec': 950}, {'path': 'w3_chunked', 'rows_per_sec': 3000},
+                          {'path': 'result_cache', 'rows_per_sec': 10 ** 6}]}
+
+    # a 5% drop is within the threshold, a 25% drop is a regression and new paths are not compared
+    comparison = {row['path']: row for row in compare_reports(baseline=baseline, report=report, threshold=0.1)}
+    assert comparison.keys() == {'w1_columnar', 'w3_chunked'}
+    assert not comparison['w1_columnar']['regression']
+    assert comparison['w3_chunked']['regression'] and abs(comparison['w3_chunked']['change'] + 0.25) < 1e-9
+
+
+def test_generate_files(tmp_path):
+    files_to_generate = [{
+        'folder_name': str(tmp_path),
+        'n_datapoints': 3000,
+        'file_name': f'{year}.csv',
+        'start_date': datetime.strptime(f'{year}/1/1', constants.DATE_FORMAT),
+        'end_date': datetime.strptime(f'{year}/12/31', constants.DATE_FORMAT),
+    } for year in [2015, 2016]]
+
+    def generate(workers):
+        generate_data.generate_files(files_to_generate=files_to_generate, workers=workers)
+        contents = {}
+        for file_details in files_to_generate:
+            with open(os.path.join(tmp_path, file_details['file_name']), 'rb') as f:
+                contents[file_details['file_name']] = f.read()
+        return contents
+
+    # every file has its own seed: the same files no matter how many processes generate them
+    blockPrint()
+    sequential, parallel = generate(workers=1), generate(workers=2)
+    enablePrint()
+    assert sequential == parallel
+    assert all([content.count(b'\n') == 3001 for content in sequential.values()])
+    assert sequential['2015.csv'] != sequential['2016.csv']
+
+
+def test_generate_block():
+    start_date = datetime.strptime('2015/1/1', constants.DATE_FORMAT)
+    end_date = datetime.strptime('2015/12/31', constants.DATE_FORMAT)
+
+    # the same seed gives the same rows, another seed other rows
+    blocks = [generate_data.DataGenerator(seed=seed).generate_block(n_rows=3000, start_date=start_date,
+                                                                    end_date=end_date)
+              for seed in [1, 1, 2]]
+    assert blocks[0] == blocks[1]
+    assert blocks[0][0] != blocks[2][0]
+
+    # one row per line, with the total price of the row
+    rows = [row.split(',') for row in blocks[0][0].rstrip('\n').split('\n')]
+    assert len(rows) == 3000 and all([len(row) == 8 for row in rows])
+    assert abs(sum([float(row[4]) for row in rows]) - blocks[0][2]) < 1e-3
+
@@ -1,54 +1,137 @@
 import logging
+import logging.handlers
+import threading
+import atexit
+import queue
+import time
 import os
+from typing import Dict
 from global_utils import make_dir
 
 CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `max_records` records per `interval` seconds for every rate limit key, the records of a
+    key over the limit are dropped and counted. The next record of the key that goes through tells how many were
+    dropped (`... [suppressed 41 similar messages]`).
+
+    Records without a key (`extra={'rate_key': ...}`, see Logger) are never limited.
+    """
+    def __init__(self, max_records: int = 1, interval: float = 10.0) -> None:
+        super().__init__()
+        self._max_records = max_records
+        self._interval = interval
+        # key -> [start of the current window, records let through in the window, records dropped]
+        self._windows: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'rate_key', None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(key, [now, 0, 0])
+            if now - window[0] >= self._interval:
+                window[0], window[1] = now, 0
+
+            if window[1] >= self._max_records:
+                window[2] += 1
+                return False
+
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+
+        if suppressed:
+            record.msg = f'{record.msg} [suppressed {suppressed} similar messages]'
+        return True
 
 
 class Logger:
-    def __init__(self, log_file_name: str, module_name: str):
+    def __init__(self, log_file_name: str, module_name: str, asynchronous: bool = True,
+                 max_bytes: int = 10 << 20, backup_count: int = 5, when: str = None,
+                 rate_limit_interval: float = 10.0):
         """
         :param log_file_name: name of the log file
         :param module_name: name of the module (can be kept same as the log_file_name without the extension)
+        :param asynchronous: the calling thread only puts the record on a queue, a background thread
+                             (QueueListener) formats it and writes it to the file - the event loop and the analytics
+                             loop never wait on the disk
+        :param max_bytes: the log file is rotated when it gets over this size, 0 to never rotate on size
+        :param backup_count: number of rotated log files to keep
+        :param when: rotate on time instead of size, e.g. 'midnight' or 'H' (see TimedRotatingFileHandler)
+        :param rate_limit_interval: window of the rate limited messages, see `RateLimitFilter`
         """
         # Create a custom logger
         self.logger = logging.getLogger(module_name)
         make_dir(directory=os.path.join(CURRENT_FOLDER_NAME, 'logs'))
 
-        self.f_handler = logging.FileHandler(os.path.join(CURRENT_FOLDER_NAME, 'logs', log_file_name))
+        log_file_path = os.path.join(CURRENT_FOLDER_NAME, 'logs', log_file_name)
+        if when is not None:
+            self.f_handler = logging.handlers.TimedRotatingFileHandler(log_file_path, when=when,
+                                                                       backupCount=backup_count)
+        else:
+            self.f_handler = logging.handlers.RotatingFileHandler(log_file_path, maxBytes=max_bytes,
+                                                                  backupCount=backup_count)
 
         # Create formatters and add it to handlers
-        ######################################## YOUR CODE HERE ##################################################
-        # set the logging formatter to the f_handler
-        ######################################## YOUR CODE HERE ##################################################
+        self.f_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
-        ######################################## YOUR CODE HERE ##################################################
         # Add handlers to the logger and setlevel to DEBUG
-        ######################################## YOUR CODE HERE ##################################################
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.rate_limit_filter = RateLimitFilter(interval=rate_limit_interval)
+        self.listener = None
 
-    def warning(self, msg):
-        pass
-        ######################################## YOUR CODE HERE ##################################################
-        ######################################## YOUR CODE HERE ##################################################
+        if asynchronous:
+            log_queue = queue.SimpleQueue()
+            handler = logging.handlers.QueueHandler(log_queue)
+            self.listener = logging.handlers.QueueListener(log_queue, self.f_handler, respect_handler_level=True)
+            self.listener.start()
+            # whatever is still on the queue is written before the interpreter exits
+            atexit.register(self.stop)
+        else:
+            handler = self.f_handler
 
-    def error(self, msg):
-        pass
-        ######################################## YOUR CODE HERE ##################################################
-        ######################################## YOUR CODE HERE ##################################################
+        # rate limited records are dropped in the calling thread, before they are queued
+        handler.addFilter(self.rate_limit_filter)
+        self.logger.handlers = [handler]
 
-    def info(self, msg):
-        pass
-        ######################################## YOUR CODE HERE ##################################################
-        ######################################## YOUR CODE HERE ##################################################
+    def stop(self) -> None:
+        """
+        Write the queued records and stop the background thread
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.f_handler.flush()
 
-    def debug(self, msg):
-        pass
-        ######################################## YOUR CODE HERE ##################################################
-        ######################################## YOUR CODE HERE ##################################################
+    def _log(self, level: int, msg, rate_key: str = None) -> None:
+        if rate_key is None:
+            self.logger.log(level, msg)
+        else:
+            self.logger.log(level, msg, extra={'rate_key': rate_key})
 
+    def warning(self, msg, rate_key: str = None):
+        self._log(logging.WARNING, msg, rate_key=rate_key)
 
-server_logger = Logger(log_file_name='server_logs.txt', module_name='server_logs')
-main_logger = Logger(log_file_name='main_logs.txt', module_name='main_logs')
+    def error(self, msg, rate_key: str = None):
+        self._log(logging.ERROR, msg, rate_key=rate_key)
+
+    def info(self, msg, rate_key: str = None):
+        """
+        :param rate_key: messages that share a key are rate limited together (see RateLimitFilter), for messages
+                         logged from hot loops
+        """
+        self._log(logging.INFO, msg, rate_key=rate_key)
 
+    def debug(self, msg, rate_key: str = None):
+        self._log(logging.DEBUG, msg, rate_key=rate_key)
 
 
+server_logger = Logger(log_file_name='server_logs.txt', module_name='server_logs')
+main_logger = Logger(log_file_name='main_logs.txt', module_name='main_logs')
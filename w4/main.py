@@ -1,14 +1,13 @@
 from w4.logger_config import main_logger
-from w2.utils.database import DB
+from w2.utils.database import DB, get_shared_db
 import datetime
 from typing import List, Dict
-from pprint import pprint
-from w1.utils import Stats
-from tqdm import tqdm
 import os
 import uuid
 import inspect
 from w1.data_processor import DataProcessor
+from w1.engine import QueryPlan, DescribeOperator, AggregateOperator, GroupByOperator
+from w1.profiler import profiler
 import argparse
 from global_utils import make_dir,  plot_sales_data, get_file_name
 import json
@@ -20,7 +19,7 @@ CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 class DP(DataProcessor):
     def __init__(self, file_path):
         super().__init__(file_path)
-        self._db = DB()
+        self._db = get_shared_db()
 
     def get_db(self) -> DB:
         return self._db
@@ -34,105 +33,85 @@ class DP(DataProcessor):
     def get_n_rows(self) -> int:
         return self._n_rows
 
-    def aggregate(self, column_name: str) -> float:
-        main_logger.info("Inside `aggregate` method")
+    def run_plan(self, plan: QueryPlan, description: str = None) -> Dict:
+        main_logger.info("Inside `run_plan` method")
         process_id = str(uuid.uuid4())
         self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                        file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
-
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
+                        file_name=self._file_name, file_path=self._fp,
+                        description=description or ','.join(plan.get_operators().keys()))
 
-        aggregate = 0
+        # progress goes through the buffered writer, the scan never waits on SQLite
+        progress_writer = self._db.get_progress_writer()
 
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
+        def update_percentage(row_num: int) -> None:
+            if isinstance(self._n_rows, int) and self._n_rows > 0:
+                progress_writer.update(process_id=process_id, percentage=100 * row_num/self._n_rows)
 
-            if self.to_float(row[column_name]):
-                aggregate += self.to_float(row[column_name])
+        results = plan.run(progress_callback=update_percentage)
 
+        progress_writer.flush()
         self._db.update_percentage(process_id=process_id, percentage=100)
         self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-        return aggregate
-
-    def describe(self, column_names: List[str]):
-        main_logger.info("Inside `describe` method")
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
 
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
+        # served by the `/metrics` API of the server
+        if profiler.is_enabled():
+            self._db.save_metrics(process_id=process_id, report=profiler.get_report())
+        return results
 
-        stats = {name: Stats() for name in column_names}
-
-        process_id = str(uuid.uuid4())
-        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                        file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
-
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
+    def aggregate(self, column_name: str) -> float:
+        main_logger.info("Inside `aggregate` method")
+        plan = self.new_plan()
+        plan.register('aggregate', AggregateOperator(column_name=column_name))
 
-            for column_name in column_names:
-                stats[column_name].update_stats(val=row[column_name])
+        return self.run_plan(plan, description=inspect.stack()[0][3])['aggregate']
 
-        self._stats = stats
-        for column_name, value in self._stats.items():
-            pprint(column_name)
-            pprint(value.get_stats())
+    def describe(self, column_names: List[str]):
+        main_logger.info("Inside `describe` method")
+        plan = self.new_plan()
+        plan.register('describe', DescribeOperator(column_names=column_names))
 
-        self._db.update_percentage(process_id=process_id, percentage=100)
-        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        self.set_stats(self.run_plan(plan, description=inspect.stack()[0][3])['describe'])
 
 
 def revenue_per_region(dp: DP) -> Dict:
     main_logger.info("Inside `revenue_per_region` method")
-    # get generator from data_reader
-    data_reader_gen = (row for row in dp.data_reader)
-
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
-
-    aggregate = dict()
-
-    process_id = str(uuid.uuid4())
-    dp.get_db().insert(process_id=process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                       file_name=dp.get_file_name(), file_path=dp.get_file_path(), description=inspect.stack()[0][3])
-
-    for n_row, row in enumerate(tqdm(data_reader_gen)):
-        if isinstance(dp.get_n_rows(), int) and isinstance(n_row, int) and n_row % 10000 == 0:
-            dp.get_db().update_percentage(process_id=process_id, percentage=100 * n_row / dp.get_n_rows())
+    plan = dp.new_plan()
+    plan.register('revenue_per_region', GroupByOperator(key_column=constants.OutDataColNames.COUNTRY,
+                                                        value_column=constants.OutDataColNames.TOTAL_PRICE))
 
-        if row['Country'] not in aggregate:
-            aggregate[row['Country']] = 0
-        aggregate[row['Country']] += dp.to_float(row['TotalPrice'])
-
-    dp.get_db().update_percentage(process_id=process_id, percentage=100)
-    dp.get_db().update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-
-    return aggregate
+    return dp.run_plan(plan, description=inspect.stack()[0][3])['revenue_per_region']
 
 
 def get_sales_information(file_path: str) -> Dict:
     main_logger.info("Inside `get_sales_information` method")
 
+    # the profiler report covers this file only
+    profiler.reset()
+
     # Initialize
     dp = DP(file_path=file_path)
 
+    # describe, aggregate and revenue per region are all fed by a single scan of the file
+    plan = dp.sales_plan()
+    results = dp.run_plan(plan, description=inspect.stack()[0][3])
+
     # print stats
-    dp.describe(column_names=['UnitPrice', 'TotalPrice'])
+    dp.set_stats(results['describe'])
 
     # return total revenue and revenue per region
-    return {
-        'total_revenue': dp.aggregate(column_name='TotalPrice'),
-        'revenue_per_region': revenue_per_region(dp),
+    information = {
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
+    # timings and counters of the run, with `--profile`
+    if profiler.is_enabled():
+        information['profile'] = profiler.get_report()
+        main_logger.info(f"Profile of {information['file_name']}: {json.dumps(information['profile'])}")
+
+    return information
+
 
 def main():
     parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
@@ -140,8 +119,14 @@ def main():
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Record timings and counters of the runs (also enabled with PROFILE=1)')
     args = parser.parse_args()
 
+    if args.profile:
+        profiler.enable()
+
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
     files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
 
@@ -1,27 +1,36 @@
 from w4.logger_config import server_logger
-from fastapi import FastAPI, WebSocketDisconnect
+from fastapi import FastAPI, WebSocketDisconnect, Query, Response, HTTPException
 from fastapi.responses import HTMLResponse
-from typing import List
-from threading import Thread
+from typing import List, Optional
 import asyncio
 from starlette.websockets import WebSocket
 from w4.utils.websocket import ConnectionManager
 from w2.utils.response_model import ProcessStatus
-from w2.utils.database import DB
+from w2.utils.database import get_async_db, ProcessFilter
+from w1.profiler import profiler
 
 app = FastAPI()
 manager = ConnectionManager()
 
-# start an asynchronous task that will keep broadcasting the process status to all the connected clients
-broadcast_continuous = Thread(target=asyncio.run, args=(manager.broadcast_all(),))
-broadcast_continuous.start()
+
+# start an asynchronous task on the event loop of the app that will keep broadcasting the process status to all the
+# connected clients
+@app.on_event("startup")
+async def start_broadcast() -> None:
+    app.state.broadcast_task = asyncio.create_task(manager.broadcast_all())
+
+
+@app.on_event("shutdown")
+async def stop_broadcast() -> None:
+    app.state.broadcast_task.cancel()
 
 
 # The below endpoint is used to create websocket connection
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # create a websocket connection for a client and assign it to a room
-    await manager.connect(websocket)
+    # create a websocket connection for a client and assign it to a room, the query parameters filter the processes
+    # it receives (e.g. `/ws?running=true`)
+    await manager.connect(websocket, process_filter=ProcessFilter.from_params(websocket.query_params))
 
     try:
         while True:
@@ -29,17 +38,32 @@ async def websocket_endpoint(websocket: WebSocket):
             # Broadcast message to all the connections/clients in a chatroom
             await websocket.send_text(f"Websocket connection established Connected")
 
-    except WebSocketDisconnect:
+    # RuntimeError: the socket was closed by the manager (a client that could not keep up)
+    except (WebSocketDisconnect, RuntimeError):
+        manager.disconnect(websocket)
         server_logger.warning("Client disconnected")
 
 
 # health check API
 @app.get("/health")
 async def get():
-    server_logger.info("`/health` API called")
+    # health checks poll this API, it is logged at most once per rate limit window
+    server_logger.info("`/health` API called", rate_key='health')
     return {"status": "ok"}
 
 
+# profiler reports: the one of the server process (DB reads of the APIs and of the broadcasts) and the latest ones
+# of the runs, saved to the database by `main.py --profile`
+@app.get("/metrics")
+async def get(limit: int = Query(10, ge=1, le=100)):
+    server_logger.info("`/metrics` API called")
+
+    return {
+        'server': dict(profiler.get_report(), enabled=profiler.is_enabled()),
+        'runs': await get_async_db().read_metrics(limit=limit)
+    }
+
+
 # Below endpoint renders an HTML page
 @app.get("/home")
 async def get():
@@ -52,16 +76,29 @@ async def get():
     return HTMLResponse(html)
 
 
-# Below endpoint to get the initial data
+# Below endpoint to get the initial data, one page at a time - the cursor of the next page is sent back in the
+# `X-Next-Cursor` header
 @app.get("/processes")
-async def get() -> List[ProcessStatus]:
+async def get(response: Response, limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+              running: Optional[bool] = None, file_name: Optional[str] = None, start_after: Optional[str] = None,
+              start_before: Optional[str] = None) -> List[ProcessStatus]:
     server_logger.info("`/processes` API called")
 
-    db = DB()
-    processes = db.read_all()
+    process_filter = ProcessFilter(running=running, file_name=file_name, start_after=start_after,
+                                   start_before=start_before)
+
+    # read on the pooled reader threads, the event loop keeps serving the other requests meanwhile
+    try:
+        processes, next_cursor = await get_async_db().read_page(process_filter=process_filter, limit=limit,
+                                                                cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
 
     return [
         ProcessStatus(process_id=process['process_id'], file_name=process['file_name'],
                       file_path=process['file_path'], description=process['description'],
-                      start_time=process['start_time'], end_time=process['end_time'], percentage=process['percentage'])
+                      start_time=process['start_time'], end_time=process['end_time'], percentage=process['percentage'],
+                      time_taken=process['time_taken'])
         for process in processes]
@@ -1,4 +1,4 @@
-from w2.utils.database import DB
+from w2.utils.database import DB, AsyncDB, ProcessFilter, get_async_db
 from w2.utils.response_model import ProcessStatus
 import uuid
 from datetime import datetime
@@ -8,6 +8,11 @@ from pprint import pprint
 from fastapi.testclient import TestClient
 from w4.server import app
 import unittest
+import asyncio
+from starlette.websockets import WebSocketState
+from w4.utils.websocket import ConnectionManager
+from w4.logger_config import Logger
+import os
 
 
 class TestApp(unittest.TestCase):
@@ -66,4 +71,131 @@ class TestApp(unittest.TestCase):
                                     end_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
 
         records = self.db.read_all()
-        pprint(records)
\ No newline at end of file
+        pprint(records)
+
+    def test_broadcast_tick(self):
+        class FakeWebSocket:
+            def __init__(self, delay: float, state: WebSocketState = WebSocketState.CONNECTED):
+                self.application_state = state
+                self.client_state = state
+                self.delay = delay
+                self.messages = []
+                self.close_code = None
+
+            async def send_json(self, data):
+                await asyncio.sleep(self.delay)
+                self.messages.append(data)
+
+            async def close(self, code):
+                self.close_code = code
+
+        manager = ConnectionManager(send_timeout=0.5, async_db=get_async_db('db_test.sqlite'))
+        fast, slow = FakeWebSocket(delay=0), FakeWebSocket(delay=5)
+        dead = FakeWebSocket(delay=0, state=WebSocketState.DISCONNECTED)
+        manager.connections = [fast, slow, dead]
+        manager.new_connections = [fast, slow, dead]
+
+        st = time.time()
+        asyncio.run(manager.broadcast_tick())
+
+        # the slow client does not hold the fast one back and is removed with the dead one
+        self.assertLess(time.time() - st, 2, msg='Broadcast should not wait for slow clients')
+        self.assertEqual(fast.messages[0]['type'], 'snapshot', msg='New client should receive a snapshot')
+        self.assertEqual(manager.connections, [fast], msg='Slow and dead clients should be removed')
+        self.assertEqual(slow.close_code, 1013, msg='Slow client should be closed to make it reconnect')
+        manager.snapshot.close()
+
+    def test_broadcast_filter(self):
+        class FakeWebSocket:
+            application_state = client_state = WebSocketState.CONNECTED
+
+            def __init__(self):
+                self.messages = []
+
+            async def send_json(self, data):
+                self.messages.append(data)
+
+        # the fake processes go to the test database, never to the one the dashboard serves
+        manager = ConnectionManager(async_db=get_async_db('db_test.sqlite'))
+        client = FakeWebSocket()
+        file_name = f'{uuid.uuid4()}.csv'
+        manager.connections, manager.new_connections = [client], [client]
+        manager.filters[client] = ProcessFilter(running=True, file_name=file_name)
+        asyncio.run(manager.broadcast_tick())
+        self.assertEqual(client.messages[-1], {'type': 'snapshot', 'processes': []}, msg='Nothing matches yet')
+
+        # a process that never matched is neither sent nor removed
+        process_id, other_id = str(uuid.uuid4()), str(uuid.uuid4())
+        manager.db.insert(process_id=other_id, start_time='2023-01-01 10:00:00', end_time='2023-01-01 10:01:00',
+                          file_name=file_name, file_path=f'/usr/{file_name}', description='sample')
+        manager.db.insert(process_id=process_id, start_time='2023-01-01 10:00:00', file_name=file_name,
+                          file_path=f'/usr/{file_name}', description='sample')
+        asyncio.run(manager.broadcast_tick())
+        self.assertEqual(list(client.messages[-1]['processes'].keys()), [process_id], msg='Only the match is sent')
+        self.assertEqual(client.messages[-1]['processes'][process_id]['file_name'], file_name,
+                         msg='A process that starts to match should be sent with all its fields')
+        self.assertEqual(client.messages[-1]['removed'], [], msg='Nothing was removed')
+
+        manager.db.update_end_time(process_id=process_id, end_time='2023-01-01 10:02:00')
+        manager.db.update_end_time(process_id=other_id, end_time='2023-01-01 10:03:00')
+        asyncio.run(manager.broadcast_tick())
+        self.assertEqual(client.messages[-1], {'type': 'delta', 'processes': {}, 'removed': [process_id]},
+                         msg='Only the processes sent before should be removed')
+        manager.snapshot.close()
+
+    def test_processes_cursor(self):
+        response = self.client.get("/processes", params={'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400, msg='A malformed cursor should be a bad request')
+
+    def test_async_db(self):
+        async_db = AsyncDB(db_name='db_test.sqlite', n_readers=2)
+        process_id = str(uuid.uuid4())
+
+        async def run():
+            await async_db.insert(process_id=process_id, start_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                                  file_name='sample.csv', file_path='/usr/sample.csv', description='sample')
+            return await asyncio.gather(*[async_db.read_all() for _ in range(20)])
+
+        results = asyncio.run(run())
+        async_db.close()
+
+        self.assertTrue(all([process_id in [row['process_id'] for row in rows] for rows in results]),
+                        msg='Every read should see the inserted process')
+        # the reader threads reuse their connection, at most one per thread
+        self.assertLessEqual(len(async_db.get_readers()), 2, msg='One read connection per reader thread')
+
+    def test_metrics(self):
+        process_id = str(uuid.uuid4())
+        report = {'stages': {'parse': {'calls': 1, 'seconds': 0.5}}, 'counters': {'rows_parsed': 10}}
+        self.db.save_metrics(process_id=process_id, report=report)
+
+        self.assertEqual(self.db.read_metrics(limit=1)[0]['process_id'], process_id, msg='Latest report first')
+        self.assertEqual(self.db.read_metrics(limit=1)[0]['report'], report, msg='Report should round trip')
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200, msg='Response code should be 200')
+        self.assertEqual(set(response.json().keys()), {'server', 'runs'}, msg='Server and run reports')
+
+    def test_logger(self):
+        logger = Logger(log_file_name='test_logs.txt', module_name='test_logs')
+        log_file_path = logger.f_handler.baseFilename
+        logger.stop()
+        open(log_file_path, 'w').close()
+
+        logger = Logger(log_file_name='test_logs.txt', module_name='test_logs')
+        st = time.perf_counter()
+        for ind in range(1000):
+            logger.info(f'tick {ind}', rate_key='tick')
+        logger.info('done')
+        elapsed = time.perf_counter() - st
+        logger.stop()
+
+        with open(log_file_path) as f:
+            lines = f.readlines()
+        os.remove(log_file_path)
+
+        # one tick per rate limit window, the other messages are written as they are
+        self.assertEqual(len(lines), 2, msg='Rate limited messages should be dropped')
+        self.assertIn('tick 0', lines[0])
+        self.assertIn('done', lines[1])
+        self.assertLess(elapsed, 1, msg='Logging should only queue the records')
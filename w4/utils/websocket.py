@@ -1,25 +1,43 @@
 from w4.logger_config import server_logger
-from typing import List
+from typing import List, Dict, Set
+import asyncio
 from starlette.websockets import WebSocket, WebSocketState
-import time
-from w2.utils.database import DB
+from w2.utils.database import AsyncDB, get_async_db, ProcessFilter
+from w2.utils.change_feed import ProcessSnapshot
 
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, broadcast_interval: float = 1.0, send_timeout: float = 1.0, async_db: AsyncDB = None):
         # self.connections contains the chat room to connection mapping
         # Every chat room can contain multiple clients
         self.connections: List[WebSocket] = []
-        self.db = DB()
+        # the processes database of the dashboard by default
+        self.async_db = async_db or get_async_db()
+        self.db = self.async_db.get_writer()
 
-    async def connect(self, websocket: WebSocket):
+        # connections that have not received the initial snapshot yet
+        self.new_connections: List[WebSocket] = []
+        # processes every connection subscribed to
+        self.filters: Dict[WebSocket, ProcessFilter] = {}
+        # processes a connection with a filter has been sent and not told to remove since
+        self.sent_ids: Dict[WebSocket, Set[str]] = {}
+        self.snapshot = ProcessSnapshot(db=self.db)
+
+        self.broadcast_interval = broadcast_interval
+        self.send_timeout = send_timeout
+
+    async def connect(self, websocket: WebSocket, process_filter: ProcessFilter = None):
         """
-        Create a connection and add it to the connections list
+        Create a connection and add it to the connections list, it only receives the processes that match
+        `process_filter`
         """
         await websocket.accept()
 
+        self.filters[websocket] = process_filter or ProcessFilter()
+
         # Adding the client connection
         self.connections.append(websocket)
+        self.new_connections.append(websocket)
         server_logger.info(msg='Created a websocket connection')
 
     async def broadcast(self, data: str):
@@ -28,21 +46,109 @@ class ConnectionManager:
         """
         for connection in self.connections:
             await connection.send_text(data)
-        server_logger.info(msg=f'Broadcasting to all connections : {data}')
+        # the size of the payload only, at most once per rate limit window
+        server_logger.debug(msg=f'Broadcast {len(data)} characters to {len(self.connections)} connections',
+                            rate_key='broadcast')
+
+    def disconnect(self, websocket: WebSocket):
+        """
+        Remove a connection from the connections list
+        """
+        if websocket in self.connections:
+            self.connections.remove(websocket)
+        if websocket in self.new_connections:
+            self.new_connections.remove(websocket)
+        self.filters.pop(websocket, None)
+        self.sent_ids.pop(websocket, None)
+
+    async def close(self, websocket: WebSocket, code: int = 1013) -> None:
+        """
+        Close the socket of a client that was given up on, so that it sees the drop and reconnects (1013: try
+        again later)
+        """
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    async def send(self, websocket: WebSocket, data: Dict) -> bool:
+        """
+        Send data to one client, a client that does not take it within `send_timeout` seconds is given up on and
+        its socket is closed - the frame may have been cut half way, nothing else can be sent on it
+
+        :return: True if the data was sent
+        """
+        try:
+            await asyncio.wait_for(websocket.send_json(data), timeout=self.send_timeout)
+            return True
+        except Exception:
+            await self.close(websocket)
+            return False
+
+    async def broadcast_tick(self):
+        """
+        Send the process status changes of the last tick to every connection, concurrently
+
+        A new connection first receives the whole table {"type": "snapshot", "processes": [...]}, after that only
+        the changed fields of the processes that changed {"type": "delta", "processes": {process_id: {...}}}.
+        A connection with a filter only receives the processes that match it: a process that starts to match is
+        sent with all its fields, a process it was sent that no longer matches is listed in the `removed` field of
+        the delta.
+        The table state is refreshed once per tick on the database threads of AsyncDB, no matter how many clients
+        are connected.
+        """
+        deltas = await self.async_db.run(self.snapshot.refresh)
+        new_connections, self.new_connections = self.new_connections, []
+
+        messages = []
+        for connection in list(self.connections):
+            if (connection.application_state != WebSocketState.CONNECTED or
+                    connection.client_state != WebSocketState.CONNECTED):
+                self.disconnect(connection)
+                continue
+
+            process_filter = self.filters.get(connection, ProcessFilter())
+            if connection in new_connections:
+                rows = [row for row in self.snapshot.get_rows() if process_filter.matches(row)]
+                self.sent_ids[connection] = {row['process_id'] for row in rows}
+                messages.append((connection, {'type': 'snapshot', 'processes': rows}))
+            elif deltas and process_filter.is_empty():
+                messages.append((connection, {'type': 'delta', 'processes': deltas}))
+            elif deltas:
+                sent_ids = self.sent_ids.setdefault(connection, set())
+                matching, removed = {}, []
+                for process_id, changes in deltas.items():
+                    row = self.snapshot.get_row(process_id)
+                    if process_filter.matches(row):
+                        # the client has never seen a process that just started to match
+                        matching[process_id] = changes if process_id in sent_ids else dict(row)
+                        sent_ids.add(process_id)
+                    elif process_id in sent_ids:
+                        removed.append(process_id)
+                        sent_ids.discard(process_id)
+
+                if matching or removed:
+                    messages.append((connection, {'type': 'delta', 'processes': matching, 'removed': removed}))
+
+        # a slow client only delays its own send, every send runs concurrently with its own timeout
+        sent = await asyncio.gather(*[self.send(connection, data) for connection, data in messages])
+        for (connection, _), is_sent in zip(messages, sent):
+            if not is_sent:
+                self.disconnect(connection)
+                server_logger.warning(msg='Removed a dead websocket connection', rate_key='dead_connection')
 
     async def broadcast_all(self):
         """
-        Broadcast data to every connection
+        Broadcast data to every connection, every `broadcast_interval` seconds
+
+        Meant to run as a task on the event loop of the app (see the startup event in server.py)
         """
         while True:
             try:
-                for connection in self.connections:
-                    if (connection.application_state == WebSocketState.CONNECTED and
-                            connection.client_state == WebSocketState.CONNECTED):
-                        processes = self.db.read_all()
-                        await connection.send_json(processes)
-
-                time.sleep(1)
+                await self.broadcast_tick()
 
             except Exception as e:
-                server_logger.error(msg=f'Error in broadcasting to all connections : {str(e)}')
+                server_logger.error(msg=f'Error in broadcasting to all connections : {str(e)}',
+                                    rate_key='broadcast_error')
+
+            await asyncio.sleep(self.broadcast_interval)